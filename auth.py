@@ -1,16 +1,48 @@
 import logging
-import psycopg
-from constants import CONN_CONFIG
+from os import environ
+from batch import BatchStatement, execute_batch
+from connections import CONNECTIONS
 from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from argon2.profiles import RFC_9106_LOW_MEMORY
+from psycopg import sql
+from config import load_config
+from constants import AUTH_OPTION_DEFAULTS
 
 logger = logging.getLogger()
-password_hasher = PasswordHasher()
+
+# leave room on every page so that the web tier's updates of last_seen/last_refill/tokens_remaining stay HOT
+AUTH_TABLE_FILLFACTORS = {"users": 80, "sessions": 80}
+
+
+def argon2_hasher() -> PasswordHasher:
+    """Builds the password hasher from the ARGON2_TIME_COST, ARGON2_MEMORY_COST (in KiB) and ARGON2_PARALLELISM environment variables.
+
+    Returns:
+        PasswordHasher: The hasher. Unset costs default to the RFC 9106 low-memory profile.
+    """
+    return PasswordHasher(
+        time_cost=int(
+            environ.get("ARGON2_TIME_COST", RFC_9106_LOW_MEMORY.time_cost)
+        ),
+        memory_cost=int(
+            environ.get("ARGON2_MEMORY_COST", RFC_9106_LOW_MEMORY.memory_cost)
+        ),
+        parallelism=int(
+            environ.get("ARGON2_PARALLELISM", RFC_9106_LOW_MEMORY.parallelism)
+        ),
+    )
+
+
+password_hasher = argon2_hasher()
 
 
 def ensure_auth_tables():
-    with psycopg.connect(**CONN_CONFIG, dbname="info") as conn:
-        with conn.cursor() as cur:
-            cur.execute("""
+    execute_batch(
+        CONNECTIONS.get("info"),
+        [
+            BatchStatement(
+                """
                 CREATE TABLE IF NOT EXISTS users (
                     id                  UUID PRIMARY KEY DEFAULT gen_random_uuid(),
                     username            VARCHAR(32) UNIQUE NOT NULL,
@@ -27,10 +59,11 @@ def ensure_auth_tables():
                     CHECK (char_length(username) >= 4),
                     CHECK (tokens_remaining > -0.001)
                 )
-                """)
-            logger.info("Table info/users is ready.")
-
-            cur.execute("""
+                """,
+                "create table info/users",
+            ),
+            BatchStatement(
+                """
                 CREATE TABLE IF NOT EXISTS sessions (
                     id                  VARCHAR(24) PRIMARY KEY,
                     user_id             UUID REFERENCES users(id) NOT NULL,
@@ -42,23 +75,171 @@ def ensure_auth_tables():
                     CHECK (char_length(id) = 24),
                     CHECK (char_length(secret_hash) = 64)
                 );
-                """)
-            logger.info("Table info/sessions is ready.")
+                """,
+                "create table info/sessions",
+            ),
+            BatchStatement(
+                "CREATE INDEX IF NOT EXISTS sessions_user_id_idx ON sessions (user_id);",
+                "create index info/sessions_user_id_idx",
+            ),
+            # BRIN is a summarizing index, so it does not prevent HOT updates of last_seen
+            BatchStatement(
+                "CREATE INDEX IF NOT EXISTS sessions_last_seen_brin ON sessions USING brin (last_seen) WITH (autosummarize = on);",
+                "create index info/sessions_last_seen_brin",
+            ),
+        ],
+    )
+    ensure_fillfactors()
+    ensure_token_bucket()
+    logger.info("Table info/users is ready.")
+    logger.info("Table info/sessions is ready.")
 
 
-def ensure_admin_user():
-    with psycopg.connect(**CONN_CONFIG, dbname="info") as conn, open(
-        "/run/secrets/admin", "r"
-    ) as f:
+def ensure_token_bucket() -> None:
+    """Installs consume_tokens(user_id, cost), which refills a user's token bucket and takes `cost` tokens from it in a single UPDATE.
+
+    The function returns the remaining tokens, or NULL (and changes nothing) if the user does not have enough tokens.
+    """
+    options = auth_options()
+    capacity = float(options["token_capacity"])
+    refill_rate = float(options["token_refill_rate"])
+
+    refilled = sql.SQL(
+        "LEAST({capacity}, tokens_remaining + EXTRACT(EPOCH FROM (LOCALTIMESTAMP - last_refill)) * {refill_rate})"
+    ).format(capacity=sql.Literal(capacity), refill_rate=sql.Literal(refill_rate))
+    execute_batch(
+        CONNECTIONS.get("info"),
+        [
+            BatchStatement(
+                sql.SQL("""
+                    CREATE OR REPLACE FUNCTION consume_tokens(p_user_id UUID, p_cost DOUBLE PRECISION)
+                    RETURNS DOUBLE PRECISION LANGUAGE sql VOLATILE AS $$
+                        UPDATE users SET
+                            tokens_remaining = {refilled} - p_cost,
+                            last_refill = LOCALTIMESTAMP
+                        WHERE id = p_user_id AND {refilled} >= p_cost
+                        RETURNING tokens_remaining;
+                    $$;
+                    """).format(refilled=refilled),
+                "create function info/consume_tokens",
+            )
+        ],
+    )
+    logger.info("Function info/consume_tokens is ready.")
+
+
+def ensure_fillfactors() -> None:
+    """Sets the fillfactor of the auth tables, skipping tables that already have it. Only pages written afterwards are affected."""
+    conn = CONNECTIONS.get("info")
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT relname, reloptions FROM pg_class
+            WHERE relname = ANY(%s) AND relnamespace = current_schema()::regnamespace AND relkind = 'r';
+            """,
+            (list(AUTH_TABLE_FILLFACTORS),),
+        )
+        current = {relname: reloptions or [] for relname, reloptions in cur.fetchall()}
+
+    statements = [
+        BatchStatement(
+            sql.SQL("ALTER TABLE {} SET (fillfactor = {});").format(
+                sql.Identifier(table), sql.Literal(fillfactor)
+            ),
+            f"set the fillfactor of info/{table}",
+        )
+        for table, fillfactor in AUTH_TABLE_FILLFACTORS.items()
+        if f"fillfactor={fillfactor}" not in current.get(table, [])
+    ]
+    execute_batch(conn, statements)
+
+
+def auth_options() -> dict[str, str | int]:
+    """Reads the optional top-level "auth" section of the config, which has been validated beforehand (see validation.py).
+
+    Returns:
+        dict[str, str | int]: The configured options, with defaults for the missing ones.
+    """
+    return {
+        **AUTH_OPTION_DEFAULTS,
+        **(load_config().get("auth") or {}),  # type: ignore
+    }
+
+
+def purge_expired_sessions() -> int:
+    """Deletes the sessions that were not seen within the configured retention, in batches so that no long transaction or lock is held.
+
+    Returns:
+        int: The number of deleted sessions.
+    """
+    options = auth_options()
+    retention = str(options["session_retention"])
+    batch_size = int(options["session_purge_batch_size"])
+    conn = CONNECTIONS.get("info")
+
+    deleted = 0
+    while True:
         with conn.cursor() as cur:
-            # @TODO admin email
             cur.execute(
                 """
-                INSERT INTO users (username, password_hash, access_level) VALUES ('admin', %s, 100) ON CONFLICT (username) DO UPDATE SET
-                    email = NULL,
-                    password_hash = EXCLUDED.password_hash,
-                    access_level = 100;
+                DELETE FROM sessions WHERE id IN (
+                    SELECT id FROM sessions WHERE last_seen < now() - %s::interval
+                    LIMIT %s FOR UPDATE SKIP LOCKED
+                );
                 """,
-                (password_hasher.hash(f.read()),),
+                (retention, batch_size),
             )
-            logger.info("The admin user is ready.")
+            deleted += cur.rowcount
+            if cur.rowcount < batch_size:
+                break
+
+    logger.info(f"Purged {deleted} sessions not seen for {retention}.")
+    return deleted
+
+
+def _admin_is_current(secret: str, row: tuple | None) -> bool:
+    """Checks whether the stored admin row already matches the secret and the current Argon2 parameters.
+
+    Args:
+        secret (str): The admin password.
+        row (tuple | None): The (password_hash, email, access_level) of the stored admin user, or None if there is none.
+
+    Returns:
+        bool: True if the row does not need to be written.
+    """
+    if row is None:
+        return False
+    password_hash, email, access_level = row
+    if email is not None or access_level != 100:
+        return False
+    try:
+        password_hasher.verify(password_hash, secret)
+    except (VerificationError, InvalidHashError):
+        return False
+    return not password_hasher.check_needs_rehash(password_hash)
+
+
+def ensure_admin_user():
+    conn = CONNECTIONS.get("info")
+    with open(environ.get("ADMIN_SECRET_FILE", "/run/secrets/admin"), "r") as f:
+        secret = f.read()
+
+    with conn.transaction(), conn.cursor() as cur:
+        cur.execute(
+            "SELECT password_hash, email, access_level FROM users WHERE username = 'admin' FOR UPDATE;"
+        )
+        if _admin_is_current(secret, cur.fetchone()):
+            logger.info("The admin user is ready (unchanged).")
+            return
+
+        # @TODO admin email
+        cur.execute(
+            """
+            INSERT INTO users (username, password_hash, access_level) VALUES ('admin', %s, 100) ON CONFLICT (username) DO UPDATE SET
+                email = NULL,
+                password_hash = EXCLUDED.password_hash,
+                access_level = 100;
+            """,
+            (password_hasher.hash(secret),),
+        )
+        logger.info("The admin user is ready.")
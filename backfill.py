@@ -0,0 +1,194 @@
+"""Batched backfills.
+
+Updating every row of a large table in one statement holds its row locks (and bloats the table) until the very end. A backfill walks the table by id instead, and updates one batch of rows per transaction, so the website is only ever blocked by a single batch.
+
+The progress of every backfill is checkpointed in the info database, so that a run that was interrupted resumes where it stopped instead of starting over.
+"""
+
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from os import environ
+from time import sleep
+from psycopg import sql
+from psycopg.connection import Connection
+
+logger = logging.getLogger()
+
+BACKFILL_TABLE = "create_tables_backfills"
+
+
+@dataclass(frozen=True)
+class BackfillSettings:
+    batch_size: int = 10000  # rows per transaction
+    pause: float = 0.0  # seconds to sleep between batches, to leave room for the website's writes
+
+    @classmethod
+    def from_environ(cls) -> "BackfillSettings":
+        """Reads the settings from the BACKFILL_BATCH_SIZE and BACKFILL_SLEEP environment variables."""
+        return cls(
+            int(environ.get("BACKFILL_BATCH_SIZE", cls.batch_size)),
+            float(environ.get("BACKFILL_SLEEP", cls.pause)),
+        )
+
+
+def ensure_backfill_table(conn: Connection) -> None:
+    """Ensures that the checkpoint table exists.
+
+    Args:
+        conn (Connection): Connection to the info database.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    database_name       TEXT NOT NULL,
+                    backfill            TEXT NOT NULL,
+                    signature           TEXT NOT NULL,
+                    last_id             BIGINT NOT NULL,
+                    updated_at          TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (database_name, backfill)
+                )
+                """).format(sql.Identifier(BACKFILL_TABLE))
+        )
+
+
+class Checkpoints:
+    """The backfill checkpoints of one database, stored in the info database."""
+
+    def __init__(self, conn: Connection, database_name: str) -> None:
+        """
+        Args:
+            conn (Connection): Connection to the info database.
+            database_name (str): The database whose backfills are checkpointed.
+        """
+        self.conn = conn
+        self.database_name = database_name
+
+    def load(self, backfill: str, signature: str) -> int:
+        """Returns the last id done by the backfill, or 0 if it never ran or its statement changed since."""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    "SELECT last_id FROM {} WHERE database_name = %s AND backfill = %s AND signature = %s;"
+                ).format(sql.Identifier(BACKFILL_TABLE)),
+                (self.database_name, backfill, signature),
+            )
+            row = cur.fetchone()
+        return 0 if row is None else row[0]
+
+    def save(self, backfill: str, signature: str, last_id: int) -> None:
+        with self.conn.cursor() as cur:
+            cur.execute(
+                sql.SQL("""
+                    INSERT INTO {} (database_name, backfill, signature, last_id) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (database_name, backfill) DO UPDATE SET
+                        signature = EXCLUDED.signature,
+                        last_id = EXCLUDED.last_id,
+                        updated_at = now();
+                    """).format(sql.Identifier(BACKFILL_TABLE)),
+                (self.database_name, backfill, signature, last_id),
+            )
+
+    def clear(self, backfill: str) -> None:
+        with self.conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    "DELETE FROM {} WHERE database_name = %s AND backfill = %s;"
+                ).format(sql.Identifier(BACKFILL_TABLE)),
+                (self.database_name, backfill),
+            )
+
+
+@dataclass
+class Backfill:
+    table: str
+    assignments: sql.Composable  # the SET clause, e.g. "x_migrating" = "x"::integer
+    description: str
+    where: sql.Composable | None = None  # only rows matching it are updated
+    settings: BackfillSettings = field(default_factory=BackfillSettings)
+    # the highest id done so far, so that a retried backfill resumes where it stopped
+    last_id: int = 0
+
+    def batch_statement(
+        self, last_id: sql.Composable, batch_size: sql.Composable
+    ) -> sql.Composable:
+        """Updates the batch of rows following last_id and returns the highest id of the batch (NULL once the table is done)."""
+        return sql.SQL("""
+            WITH batch AS (
+                SELECT id FROM {table} WHERE id > {last_id} ORDER BY id LIMIT {batch_size}
+            ), updated AS (
+                UPDATE {table} SET {assignments} FROM batch WHERE {table}.id = batch.id{where}
+            )
+            SELECT max(id) FROM batch""").format(
+            table=sql.Identifier(self.table),
+            last_id=last_id,
+            batch_size=batch_size,
+            assignments=self.assignments,
+            where=(
+                sql.SQL("")
+                if self.where is None
+                else sql.SQL(" AND ({})").format(self.where)
+            ),
+        )
+
+    def run(self, conn: Connection, checkpoints: Checkpoints | None = None) -> None:
+        """Runs the backfill, one autocommitted batch at a time.
+
+        Args:
+            conn (Connection): An autocommit connection to the database of the table.
+            checkpoints (Checkpoints | None, optional): Where to resume from and record the progress. Defaults to None.
+        """
+        statement = self.batch_statement(sql.Placeholder(), sql.Placeholder())
+        # a checkpoint is only valid for the very same backfill
+        signature = hashlib.sha1(statement.as_string(conn).encode()).hexdigest()
+        if checkpoints is not None:
+            resumed = checkpoints.load(self.description, signature)
+            if resumed > self.last_id:
+                logger.info(f"Resuming to {self.description} after id {resumed}.")
+                self.last_id = resumed
+
+        batches = 0
+        while True:
+            with conn.cursor() as cur:
+                cur.execute(statement, (self.last_id, self.settings.batch_size))
+                row = cur.fetchone()
+            if row is None or row[0] is None:
+                break
+            self.last_id = row[0]
+            batches += 1
+            if checkpoints is not None:
+                checkpoints.save(self.description, signature, self.last_id)
+            logger.debug("%s: done up to id %d.", self.description, self.last_id)
+            if self.settings.pause > 0:
+                sleep(self.settings.pause)
+
+        if checkpoints is not None:
+            checkpoints.clear(self.description)
+        logger.info(f"Done to {self.description} in {batches} batches.")
+
+    def script(self) -> sql.Composable:
+        """The backfill as a single DO block that commits after every batch, for dry runs. It must run outside of a transaction block and is not checkpointed."""
+        return sql.SQL("""DO $$
+            DECLARE
+                _last_id bigint := {start};
+            BEGIN
+                LOOP
+                    {statement} INTO _last_id;
+                    EXIT WHEN _last_id IS NULL;
+                    COMMIT;{pause}
+                END LOOP;
+            END
+            $$;""").format(
+            start=sql.Literal(self.last_id),
+            statement=self.batch_statement(
+                sql.SQL("_last_id"), sql.Literal(self.settings.batch_size)
+            ),
+            pause=(
+                sql.SQL("\n                    PERFORM pg_sleep({});").format(
+                    sql.Literal(self.settings.pause)
+                )
+                if self.settings.pause > 0
+                else sql.SQL("")
+            ),
+        )
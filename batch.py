@@ -0,0 +1,67 @@
+"""Batched statement execution built on psycopg's pipeline mode.
+
+A batch is sent in one go and costs about one round trip. If it fails, it is replayed statement by statement (and rolled back) to find out which statement caused the failure.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Protocol, Sequence
+import psycopg
+from psycopg import sql
+from psycopg.connection import Connection
+from instrumentation import for_table
+
+
+class BatchItem(Protocol):
+    statement: sql.Composable | str
+    description: str
+
+
+@dataclass
+class BatchStatement:
+    statement: sql.Composable | str
+    description: str
+    params: tuple[Any, ...] | None = None
+
+
+class BatchError(RuntimeError):
+    """Raised when a statement of a batch fails. The whole batch is rolled back."""
+
+    def __init__(self, item: BatchItem, cause: psycopg.Error) -> None:
+        super().__init__(f"Failed to {item.description}: {cause}")
+        self.item = item
+        self.cause = cause
+
+
+def execute_batch(conn: Connection, items: Sequence[BatchItem]) -> None:
+    """Executes every statement in a single pipelined transaction (or savepoint, if a transaction is already open).
+
+    Args:
+        conn (Connection): The connection to execute the statements with.
+        items (Sequence[BatchItem]): The statements to execute, in order. Items may carry a `params` attribute, and a `table` attribute that their statements are attributed to in METRICS.
+
+    Raises:
+        BatchError: When a statement fails. Nothing in the batch is committed.
+    """
+    if len(items) == 0:
+        return
+
+    try:
+        with conn.transaction(), conn.pipeline(), conn.cursor() as cur:
+            for item in items:
+                with for_table(getattr(item, "table", None)):
+                    cur.execute(item.statement, getattr(item, "params", None))
+        return
+    except psycopg.Error as e:
+        # pipeline mode only reports that the batch failed, not which statement did it
+        original_error = e
+
+    with conn.transaction(force_rollback=True), conn.cursor() as cur:
+        for item in items:
+            try:
+                with for_table(getattr(item, "table", None)):
+                    cur.execute(item.statement, getattr(item, "params", None))
+            except psycopg.Error as e:
+                raise BatchError(item, e) from e
+
+    # the replay went through, so the failure was not caused by a particular statement
+    raise original_error
@@ -0,0 +1,64 @@
+"""Times Argon2 hashing and verification for a grid of cost parameters.
+
+Run it on the host that runs create_tables to pick ARGON2_TIME_COST, ARGON2_MEMORY_COST and ARGON2_PARALLELISM:
+
+    python3 benchmarks/argon2_costs.py --time-cost 2 3 4 --memory-cost 19456 65536 --parallelism 1 4
+"""
+
+import argparse
+from itertools import product
+from statistics import median
+from time import perf_counter
+from argon2 import PasswordHasher
+from argon2.profiles import RFC_9106_LOW_MEMORY
+
+
+def time_call(call, repeat: int) -> float:
+    """Returns the median duration of the call, in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        start = perf_counter()
+        call()
+        durations.append((perf_counter() - start) * 1000)
+    return median(durations)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--time-cost", type=int, nargs="+", default=[RFC_9106_LOW_MEMORY.time_cost]
+    )
+    parser.add_argument(
+        "--memory-cost",
+        type=int,
+        nargs="+",
+        default=[RFC_9106_LOW_MEMORY.memory_cost],
+        help="in KiB",
+    )
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        nargs="+",
+        default=[RFC_9106_LOW_MEMORY.parallelism],
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    secret = "correct horse battery staple"
+
+    print(f"{'time':>4} {'memory KiB':>10} {'lanes':>5} {'hash ms':>9} {'verify ms':>9}")
+    for time_cost, memory_cost, parallelism in product(
+        args.time_cost, args.memory_cost, args.parallelism
+    ):
+        hasher = PasswordHasher(
+            time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism
+        )
+        password_hash = hasher.hash(secret)
+        hash_ms = time_call(lambda: hasher.hash(secret), args.repeat)
+        verify_ms = time_call(lambda: hasher.verify(password_hash, secret), args.repeat)
+        print(
+            f"{time_cost:>4} {memory_cost:>10} {parallelism:>5} {hash_ms:>9.1f} {verify_ms:>9.1f}"
+        )
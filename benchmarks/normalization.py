@@ -0,0 +1,62 @@
+"""Compares the cached name normalization of names.py with the previous uncached implementation.
+
+    python3 benchmarks/normalization.py --names 5000 --repeat 20
+
+names.py imports constants.py, so the DATABASE_* environment variables must be set. They are not used.
+"""
+
+import argparse
+import re
+import sys
+from pathlib import Path
+from timeit import timeit
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from names import to_lower_snake_case
+
+
+def uncached_to_lower_snake_case(target: str) -> str:
+    """The implementation names.py replaced: re.split on every call and repeated string concatenation."""
+    stringFrags: List[str] = re.split(r"[\.\ \-]", target)
+
+    output: str = ""
+
+    for i in stringFrags:
+        output += i.lower() + "_"
+
+    return output[:-1]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--names", type=int, default=5000, help="distinct names to normalize"
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=20,
+        help="how often every name is normalized, as during planning",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    names = [f"Table {i} Some-Column.Name {i % 7}" for i in range(args.names)]
+    workload = names * args.repeat
+
+    for name in names:
+        assert to_lower_snake_case(name) == uncached_to_lower_snake_case(name)
+
+    to_lower_snake_case.cache_clear()
+    for label, function in (
+        ("uncached", uncached_to_lower_snake_case),
+        ("cached", to_lower_snake_case),
+    ):
+        seconds = timeit(lambda: [function(name) for name in workload], number=1)
+        print(
+            f"{label:>8}: {seconds * 1000:8.1f} ms for {len(workload)} calls ({seconds / len(workload) * 1e9:6.0f} ns/call)"
+        )
+    print(f"   cache: {to_lower_snake_case.cache_info()}")
@@ -0,0 +1,363 @@
+"""Times create_tables.py against a throwaway local PostgreSQL server.
+
+For every size, a synthetic config is generated and create_tables.py is run five times against a fresh cluster:
+
+- cold: every database and table is created from scratch.
+- warm: nothing changed, so the fingerprints let the run skip enforcement.
+- forced: nothing changed, but --force enforces everything anyway.
+- plan: a --plan dry run against the live catalogs.
+- migrate: the config adds an enum label and makes it the column's default, which must apply in one run. A --plan dry run afterwards must find nothing left to do.
+
+Wall time, connections opened/reused and round trips are printed per run. Together with the per-phase timings from create_tables.py --metrics, they can be written as JSON so that regressions in the provisioning path show up.
+
+The server is started with initdb/pg_ctl from --pg-bin (or the PATH) with fsync off, and is removed afterwards. If PostGIS is not installed, an empty stub extension is loaded through extension_control_path (PostgreSQL 18+) and the configs contain no geodetic points.
+
+    python3 benchmarks/provision.py --sizes 10 100 1000 --columns 20 --json results.json
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, List
+import psycopg
+import yaml
+from psycopg import sql
+
+REPO = Path(__file__).resolve().parent.parent
+USER = "bench"
+DATATYPES = ["int", "float", "str", "bool", "date", "time", "timestamp"]
+
+
+@dataclass
+class RunResult:
+    tables: int
+    run: str
+    wall: float
+    connections_opened: int
+    connections_reused: int
+    round_trips: int
+    phases: dict  # the "phases" of the create_tables.py --metrics report
+
+
+@dataclass
+class LocalServer:
+    host: str  # the socket directory
+    port: int
+    postgis: bool  # False if PostGIS is stubbed
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _pg_bin(pg_bin: str | None) -> Path:
+    if pg_bin is not None:
+        return Path(pg_bin)
+    initdb = shutil.which("initdb")
+    if initdb is not None:
+        return Path(initdb).parent
+    pg_config = shutil.which("pg_config")
+    if pg_config is not None:
+        return Path(
+            subprocess.run(
+                [pg_config, "--bindir"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        )
+    raise RuntimeError(
+        "Cannot find initdb. Pass the PostgreSQL bin directory with --pg-bin."
+    )
+
+
+def _stub_postgis(directory: Path) -> Path:
+    """Writes an empty postgis extension that only satisfies CREATE EXTENSION postgis."""
+    extension_directory = directory / "extension"
+    extension_directory.mkdir()
+    (extension_directory / "postgis.control").write_text(
+        "comment = 'benchmark stub'\ndefault_version = 'stub'\nrelocatable = true\n"
+    )
+    (extension_directory / "postgis--stub.sql").write_text("-- intentionally empty\n")
+    return extension_directory
+
+
+@contextmanager
+def local_server(pg_bin: Path) -> Iterator[LocalServer]:
+    """Runs a throwaway cluster for the duration of the block."""
+    with tempfile.TemporaryDirectory(prefix="create_tables_bench_") as directory:
+        data = Path(directory) / "data"
+        port = _free_port()
+        subprocess.run(
+            [
+                pg_bin / "initdb",
+                "-D",
+                data,
+                "-U",
+                USER,
+                "-A",
+                "trust",
+                "-E",
+                "UTF8",
+                "--locale=C",
+                "--no-sync",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        options = f"-p {port} -k {directory} -c listen_addresses='' -c fsync=off -c synchronous_commit=off -c full_page_writes=off"
+        subprocess.run(
+            [
+                pg_bin / "pg_ctl",
+                "-D",
+                data,
+                "-o",
+                options,
+                "-w",
+                "-l",
+                Path(directory) / "server.log",
+                "start",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        try:
+            with psycopg.connect(
+                host=directory, port=port, user=USER, dbname="postgres", autocommit=True
+            ) as conn:
+                postgis = (
+                    conn.execute(
+                        "SELECT EXISTS (SELECT FROM pg_available_extensions WHERE name = 'postgis');"
+                    ).fetchone()
+                    or (False,)
+                )[0]
+                if not postgis:
+                    if conn.info.server_version < 180000:
+                        raise RuntimeError(
+                            "PostGIS is not installed and PostgreSQL < 18 cannot load a stub extension."
+                        )
+                    stub = _stub_postgis(Path(directory))
+                    conn.execute(
+                        f"ALTER SYSTEM SET extension_control_path = '$system:{stub}';"
+                    )
+                    conn.execute("SELECT pg_reload_conf();")
+            yield LocalServer(directory, port, postgis)
+        finally:
+            subprocess.run(
+                [pg_bin / "pg_ctl", "-D", data, "-m", "immediate", "stop"],
+                capture_output=True,
+            )
+
+
+def reset_server(server: LocalServer) -> None:
+    """Drops every database except the templates and postgres."""
+    with psycopg.connect(
+        host=server.host,
+        port=server.port,
+        user=USER,
+        dbname="postgres",
+        autocommit=True,
+    ) as conn:
+        databases = conn.execute(
+            "SELECT datname FROM pg_database WHERE NOT datistemplate AND datname <> 'postgres';"
+        ).fetchall()
+        for (database_name,) in databases:
+            conn.execute(
+                sql.SQL("DROP DATABASE {} WITH (FORCE);").format(
+                    sql.Identifier(database_name)
+                )
+            )
+
+
+def generate_config(
+    tables: int, columns: int, geodetic: bool, migrated: bool = False
+) -> dict:
+    """Generates a config with `tables` wide tables spread over databases of at most 100 tables.
+
+    Every third table is tagged, every fifth has two descriptors, and the columns cycle through the datatypes, with an enum, a pointer and (if geodetic) a geodetic point in every table. If migrated, the enum has an additional label "d", which is its default.
+    """
+    databases = []
+    for first in range(0, tables, 100):
+        database_tables = []
+        for i in range(first, min(first + 100, tables)):
+            schema: List[dict] = [
+                {"name": "Enum Column", "datatype": "enum", "values": ["a", "b", "c"]},
+            ]
+            if migrated:
+                schema[0].update(values=["a", "b", "c", "d"], default="d")
+            if i > first:
+                schema.append(
+                    {
+                        "name": "Previous",
+                        "datatype": "pointer",
+                        "references": f"table_{i - 1}",
+                    }
+                )
+            if geodetic:
+                schema.append(
+                    {"name": "Location", "datatype": "geodetic point", "comments": True}
+                )
+            for j in range(max(columns - len(schema), 1)):
+                schema.append(
+                    {
+                        "name": f"Column {j}",
+                        "datatype": DATATYPES[j % len(DATATYPES)],
+                        "unique": j == 0,
+                        "optional": j != 1,
+                    }
+                )
+            table = {"tableName": f"Table {i}", "tagging": i % 3 == 0, "schema": schema}
+            if i % 5 == 0:
+                table["descriptors"] = [
+                    {
+                        "name": name,
+                        "schema": [
+                            {"name": "Value", "datatype": "str"},
+                            {"name": "Weight", "datatype": "float"},
+                        ],
+                    }
+                    for name in ("Detail", "Source")
+                ]
+            database_tables.append(table)
+        databases.append({"dbname": f"Bench {first // 100}", "tables": database_tables})
+    return {"data": databases}
+
+
+def run_tool(
+    server: LocalServer, directory: Path, tables: int, run: str, arguments: List[str]
+) -> RunResult:
+    environment = {
+        **os.environ,
+        "DATABASE_HOST": server.host,
+        "DATABASE_PORT": str(server.port),
+        "DATABASE_USERNAME": USER,
+        "DATABASE_PASSWORD": "",
+        "CONFIG_PATH": str(directory / "config.yml"),
+        "CONFIG_CACHE_PATH": str(directory / "config.cache"),
+        "LOG_DIRECTORY": str(directory),
+        "ADMIN_SECRET_FILE": str(directory / "admin"),
+    }
+    start = perf_counter()
+    completed = subprocess.run(
+        [
+            sys.executable,
+            REPO / "create_tables.py",
+            *arguments,
+            "--metrics",
+            directory / "metrics.json",
+        ],
+        cwd=REPO,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    wall = perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"create_tables.py {' '.join(arguments)} failed:\n{completed.stderr[-4000:]}"
+        )
+
+    with open(directory / "metrics.json", "r") as file:
+        metrics = json.load(file)
+    return RunResult(
+        tables,
+        run,
+        wall,
+        metrics["connections_opened"],
+        metrics["connections_reused"],
+        metrics["round_trips"],
+        metrics["phases"],
+    )
+
+
+def check_settled(server: LocalServer, directory: Path, tables: int) -> None:
+    """Checks that a --plan dry run against the live catalogs plans no operations."""
+    run_tool(
+        server,
+        directory,
+        tables,
+        "settled",
+        ["--plan", "--output", str(directory / "settled.sql")],
+    )
+    script = (directory / "settled.sql").read_text()
+    pending = "\n".join(
+        line
+        for line in script.splitlines()
+        if line.startswith("-- ") and not line.endswith(": 0 operations")
+    )
+    if len(pending) > 0:
+        raise RuntimeError(
+            f"The databases are not settled after migrating:\n{pending}\n{script[-4000:]}"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10, 100, 1000],
+        help="numbers of tables",
+    )
+    parser.add_argument("--columns", type=int, default=20, help="columns per table")
+    parser.add_argument("--pg-bin", help="the directory holding initdb and pg_ctl")
+    parser.add_argument(
+        "--json", metavar="PATH", help="also write the results to this file"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results: List[RunResult] = []
+
+    print(
+        f"{'tables':>6} {'run':>6} {'wall s':>8} {'opened':>6} {'reused':>6} {'trips':>7}"
+    )
+    with local_server(_pg_bin(args.pg_bin)) as server:
+        for size in args.sizes:
+            reset_server(server)
+            with tempfile.TemporaryDirectory(
+                prefix="create_tables_bench_run_"
+            ) as run_directory:
+                directory = Path(run_directory)
+                (directory / "admin").write_text("benchmark-admin-password")
+                with open(directory / "config.yml", "w") as file:
+                    yaml.safe_dump(
+                        generate_config(size, args.columns, server.postgis), file
+                    )
+
+                for run, arguments in (
+                    ("cold", []),
+                    ("warm", []),
+                    ("forced", ["--force"]),
+                    ("plan", ["--plan", "--output", str(directory / "plan.sql")]),
+                    ("migrate", []),
+                ):
+                    if run == "migrate":
+                        with open(directory / "config.yml", "w") as file:
+                            yaml.safe_dump(
+                                generate_config(
+                                    size, args.columns, server.postgis, migrated=True
+                                ),
+                                file,
+                            )
+                    result = run_tool(server, directory, size, run, arguments)
+                    results.append(result)
+                    print(
+                        f"{result.tables:>6} {result.run:>6} {result.wall:>8.2f} {result.connections_opened:>6} {result.connections_reused:>6} {result.round_trips:>7}"
+                    )
+                check_settled(server, directory, size)
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump([asdict(result) for result in results], file, indent=1)
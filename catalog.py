@@ -0,0 +1,403 @@
+"""In-memory snapshot of a database's catalog.
+
+Loading the snapshot costs a handful of pg_catalog queries per database. Every existence and type check afterwards is answered from memory, and the snapshot is updated as DDL is issued so that it never goes stale during a run.
+"""
+
+from dataclasses import asdict, dataclass, field
+from typing import Any
+from psycopg.connection import Connection
+
+
+@dataclass
+class ColumnInfo:
+    name: str
+    datatype: str  # as rendered by format_type(), e.g. "timestamp without time zone"
+    udt_name: str  # the underlying type name, e.g. "int4" or the name of an enum type
+    not_null: bool = False
+    default: str | None = None  # as rendered by pg_get_expr(), e.g. "'x'::text"
+
+
+@dataclass
+class ConstraintInfo:
+    name: str
+    contype: str  # p (primary key), f (foreign key), u (unique), c (check), n (not null), x (exclusion)
+    definition: str
+    columns: tuple[str, ...] = ()
+    validated: bool = True
+
+
+@dataclass
+class IndexInfo:
+    name: str
+    definition: str  # as rendered by pg_get_indexdef()
+    unique: bool = False
+    primary: bool = False
+    valid: bool = True  # False if e.g. CREATE INDEX CONCURRENTLY failed halfway
+    comment: str | None = None
+
+
+@dataclass
+class RelationInfo:
+    name: str
+    kind: str = "r"  # r (ordinary), p (partitioned), f (foreign)
+    columns: dict[str, ColumnInfo] = field(default_factory=dict)
+    constraints: dict[str, ConstraintInfo] = field(default_factory=dict)
+    indexes: dict[str, IndexInfo] = field(default_factory=dict)
+    estimated_rows: float = -1  # pg_class.reltuples, -1 if the table was never analyzed
+
+
+_TABLES_QUERY = """
+    SELECT c.relname, c.relkind, c.reltuples
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p', 'f');
+"""
+
+_COLUMNS_QUERY = """
+    SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), t.typname, a.attnotnull, pg_get_expr(d.adbin, d.adrelid)
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    JOIN pg_type t ON t.oid = a.atttypid
+    LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+    WHERE n.nspname = current_schema()
+        AND c.relkind IN ('r', 'p', 'f')
+        AND a.attnum > 0
+        AND NOT a.attisdropped
+    ORDER BY c.relname, a.attnum;
+"""
+
+_CONSTRAINTS_QUERY = """
+    SELECT
+        c.relname,
+        con.conname,
+        con.contype,
+        pg_get_constraintdef(con.oid),
+        con.convalidated,
+        ARRAY(
+            SELECT a.attname
+            FROM unnest(con.conkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum
+            ORDER BY k.ord
+        )
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = current_schema();
+"""
+
+_INDEXES_QUERY = """
+    SELECT
+        c.relname,
+        i.relname,
+        pg_get_indexdef(x.indexrelid),
+        x.indisunique,
+        x.indisprimary,
+        x.indisvalid,
+        obj_description(x.indexrelid, 'pg_class')
+    FROM pg_index x
+    JOIN pg_class c ON c.oid = x.indrelid
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = current_schema() AND c.relkind IN ('r', 'p');
+"""
+
+_ENUMS_QUERY = """
+    SELECT t.typname, array_agg(e.enumlabel ORDER BY e.enumsortorder)
+    FROM pg_type t
+    JOIN pg_enum e ON e.enumtypid = t.oid
+    JOIN pg_namespace n ON n.oid = t.typnamespace
+    WHERE n.nspname = current_schema()
+    GROUP BY t.typname;
+"""
+
+
+_EXTENSIONS_QUERY = "SELECT extname FROM pg_extension;"
+
+
+def load_enums(conn: Connection) -> dict[str, list[str]]:
+    """Loads every enum type of the current schema and its labels in one query.
+
+    Args:
+        conn (Connection): Connection to the database.
+
+    Returns:
+        dict[str, list[str]]: The labels of every enum type, in their sort order.
+    """
+    with conn.cursor() as cur:
+        cur.execute(_ENUMS_QUERY)
+        return {type_name: list(labels) for type_name, labels in cur.fetchall()}
+
+
+class CatalogSnapshot:
+    """The tables, columns, constraints, indexes and enum types of one database (current schema only), and the extensions installed in it."""
+
+    def __init__(self) -> None:
+        self.tables: dict[str, RelationInfo] = {}
+        self.enums: dict[str, list[str]] = {}
+        self.extensions: set[str] = set()
+
+    @classmethod
+    def load(cls, conn: Connection) -> "CatalogSnapshot":
+        """Loads a snapshot of the catalog of the database behind the connection.
+
+        Args:
+            conn (Connection): Connection to the database to snapshot.
+
+        Returns:
+            CatalogSnapshot: The populated snapshot.
+        """
+        snapshot = cls()
+        with conn.cursor() as cur:
+            cur.execute(_TABLES_QUERY)
+            for table_name, kind, estimated_rows in cur.fetchall():
+                snapshot.tables[table_name] = RelationInfo(
+                    table_name, kind, estimated_rows=estimated_rows
+                )
+
+            cur.execute(_COLUMNS_QUERY)
+            for (
+                table_name,
+                column_name,
+                datatype,
+                udt_name,
+                not_null,
+                default,
+            ) in cur.fetchall():
+                snapshot.tables[table_name].columns[column_name] = ColumnInfo(
+                    column_name, datatype, udt_name, not_null, default
+                )
+
+            cur.execute(_CONSTRAINTS_QUERY)
+            for (
+                table_name,
+                constraint_name,
+                contype,
+                definition,
+                validated,
+                columns,
+            ) in cur.fetchall():
+                snapshot.tables[table_name].constraints[constraint_name] = (
+                    ConstraintInfo(
+                        constraint_name, contype, definition, tuple(columns), validated
+                    )
+                )
+
+            cur.execute(_INDEXES_QUERY)
+            for (
+                table_name,
+                index_name,
+                definition,
+                unique,
+                primary,
+                valid,
+                comment,
+            ) in cur.fetchall():
+                snapshot.tables[table_name].indexes[index_name] = IndexInfo(
+                    index_name, definition, unique, primary, valid, comment
+                )
+
+            cur.execute(_EXTENSIONS_QUERY)
+            snapshot.extensions = {extension for (extension,) in cur.fetchall()}
+
+        snapshot.enums = load_enums(conn)
+        return snapshot
+
+    def to_dict(self) -> dict[str, Any]:
+        """Converts the snapshot into plain JSON-serializable data, e.g. to plan against it offline later."""
+        return {
+            "tables": {name: asdict(table) for name, table in self.tables.items()},
+            "enums": self.enums,
+            "extensions": sorted(self.extensions),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "CatalogSnapshot":
+        """Rebuilds a snapshot from the output of to_dict."""
+        snapshot = cls()
+        for name, table in data.get("tables", {}).items():
+            snapshot.tables[name] = RelationInfo(
+                table["name"],
+                table["kind"],
+                {
+                    column_name: ColumnInfo(**column)
+                    for column_name, column in table["columns"].items()
+                },
+                {
+                    constraint_name: ConstraintInfo(
+                        **{**constraint, "columns": tuple(constraint["columns"])}
+                    )
+                    for constraint_name, constraint in table["constraints"].items()
+                },
+                {
+                    index_name: IndexInfo(**index)
+                    for index_name, index in table["indexes"].items()
+                },
+                table.get("estimated_rows", -1),
+            )
+        snapshot.enums = {
+            type_name: list(labels) for type_name, labels in data.get("enums", {}).items()
+        }
+        snapshot.extensions = set(data.get("extensions", []))
+        return snapshot
+
+    # START - lookups
+    def table_exists(self, table_name: str) -> bool:
+        return table_name in self.tables
+
+    def column_exists(self, table_name: str, column_name: str) -> bool:
+        table = self.tables.get(table_name)
+        return table is not None and column_name in table.columns
+
+    def constraints(self, table_name: str) -> list[ConstraintInfo]:
+        table = self.tables.get(table_name)
+        return [] if table is None else list(table.constraints.values())
+
+    def indexes(self, table_name: str) -> list[IndexInfo]:
+        table = self.tables.get(table_name)
+        return [] if table is None else list(table.indexes.values())
+
+    def enum_exists(self, type_name: str) -> bool:
+        return type_name in self.enums
+
+    def enum_labels(self, type_name: str) -> list[str] | None:
+        return self.enums.get(type_name)
+
+    # END - lookups
+
+    # START - updates (call these whenever the matching DDL is issued)
+    def add_table(self, table_name: str, kind: str = "r") -> None:
+        if table_name not in self.tables:
+            self.tables[table_name] = RelationInfo(table_name, kind)
+
+    def add_column(
+        self,
+        table_name: str,
+        column_name: str,
+        datatype: str,
+        udt_name: str | None = None,
+        not_null: bool = False,
+        default: str | None = None,
+    ) -> None:
+        self.add_table(table_name)
+        self.tables[table_name].columns[column_name] = ColumnInfo(
+            column_name, datatype, udt_name or datatype, not_null, default
+        )
+
+    def drop_column(self, table_name: str, column_name: str) -> None:
+        table = self.tables.get(table_name)
+        if table is not None:
+            table.columns.pop(column_name, None)
+
+    def add_constraint(self, table_name: str, constraint: ConstraintInfo) -> None:
+        self.add_table(table_name)
+        self.tables[table_name].constraints[constraint.name] = constraint
+
+    def drop_constraint(self, table_name: str, constraint_name: str) -> None:
+        table = self.tables.get(table_name)
+        if table is not None:
+            table.constraints.pop(constraint_name, None)
+
+    def add_index(self, table_name: str, index: IndexInfo) -> None:
+        self.add_table(table_name)
+        self.tables[table_name].indexes[index.name] = index
+
+    def drop_index(self, table_name: str, index_name: str) -> None:
+        table = self.tables.get(table_name)
+        if table is not None:
+            table.indexes.pop(index_name, None)
+
+    def add_enum(self, type_name: str, labels: list[str]) -> None:
+        self.enums[type_name] = list(labels)
+
+    # END - updates
+
+
+_CATALOG_VERSION_QUERY = """
+    SELECT md5(concat_ws('|',
+        (
+            SELECT string_agg(format('%s.%s:%s:%s:%s', c.relname, a.attname, a.atttypid, a.attnotnull, pg_get_expr(d.adbin, d.adrelid)), ',' ORDER BY c.relname, a.attnum)
+            FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+            WHERE n.nspname = current_schema()
+                AND c.relkind IN ('r', 'p', 'f', 'i')
+                AND a.attnum > 0
+                AND NOT a.attisdropped
+        ),
+        (
+            SELECT string_agg(format('%s:%s', c.relname, c.reloptions), ',' ORDER BY c.relname)
+            FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema()
+                AND c.relkind IN ('r', 'p', 'i')
+                AND c.reloptions IS NOT NULL
+        ),
+        (
+            SELECT string_agg(format('%s.%s:%s:%s:%s', c.relname, con.conname, con.contype, con.convalidated, pg_get_constraintdef(con.oid)), ',' ORDER BY c.relname, con.conname)
+            FROM pg_constraint con
+            JOIN pg_namespace n ON n.oid = con.connamespace
+            LEFT JOIN pg_class c ON c.oid = con.conrelid
+            WHERE n.nspname = current_schema()
+        ),
+        (
+            SELECT string_agg(format('%s:%s:%s:%s', i.relname, pg_get_indexdef(i.oid), x.indisvalid, obj_description(i.oid, 'pg_class')), ',' ORDER BY i.relname)
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            JOIN pg_namespace n ON n.oid = i.relnamespace
+            WHERE n.nspname = current_schema()
+        ),
+        (
+            SELECT string_agg(format('%s:%s', t.typname, e.enumlabel), ',' ORDER BY t.typname, e.enumsortorder)
+            FROM pg_enum e
+            JOIN pg_type t ON t.oid = e.enumtypid
+            JOIN pg_namespace n ON n.oid = t.typnamespace
+            WHERE n.nspname = current_schema()
+        ),
+        (
+            -- the functions created by this script, not those of extensions (PostGIS alone has hundreds)
+            SELECT string_agg(format('%s(%s):%s', p.proname, pg_get_function_identity_arguments(p.oid), md5(pg_get_functiondef(p.oid))), ',' ORDER BY p.proname, p.oid)
+            FROM pg_proc p
+            JOIN pg_namespace n ON n.oid = p.pronamespace
+            WHERE n.nspname = current_schema()
+                AND p.prokind IN ('f', 'p')
+                AND NOT EXISTS (
+                    SELECT FROM pg_depend d
+                    WHERE d.classid = 'pg_proc'::regclass AND d.objid = p.oid AND d.deptype = 'e'
+                )
+        ),
+        (
+            SELECT string_agg(format('%s:%s', extname, extversion), ',' ORDER BY extname)
+            FROM pg_extension
+        ),
+        (
+            SELECT string_agg(format('%s:%s', srvname, srvoptions), ',' ORDER BY srvname)
+            FROM pg_foreign_server
+        ),
+        (
+            SELECT string_agg(format('%s:%s:%s', c.relname, ft.ftserver, ft.ftoptions), ',' ORDER BY c.relname)
+            FROM pg_foreign_table ft
+            JOIN pg_class c ON c.oid = ft.ftrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = current_schema()
+        )
+    ));
+"""
+
+
+def catalog_version(conn: Connection) -> str:
+    """Computes a marker that changes whenever the tables, columns, storage options, constraints, indexes (and their comments), enum types, functions, extensions, foreign servers or foreign tables of the database change. Statistics and data changes do not affect it.
+
+    Args:
+        conn (Connection): Connection to the database.
+
+    Returns:
+        str: The md5 hash of the relevant parts of the catalog.
+    """
+    with conn.cursor() as cur:
+        cur.execute(_CATALOG_VERSION_QUERY)
+        row = cur.fetchone()
+        if row is None:
+            raise RuntimeError("None returned as a result.")
+        return row[0]
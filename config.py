@@ -1,10 +1,246 @@
+"""The config, loaded lazily on first use.
+
+The config can be split into fragments with the !include tag, e.g. one file per database or per table:
+
+    data:
+      - !include databases/blog.yml
+      - dbname: shop
+        tables: !include shop/*.yml
+
+Paths are relative to the including file. A glob includes every matching file in name order as a list, which is spliced into the surrounding list if there is one.
+
+Every file is parsed on its own and cached by the SHA-256 of its content in CONFIG_CACHE_PATH, so that editing one fragment only reparses that fragment. Files are not even hashed again while they keep their size and modification time. An empty CONFIG_CACHE_PATH disables the cache.
+"""
+
+import glob
+import hashlib
 import logging
+import os
+import pickle
+from dataclasses import dataclass
+from functools import cache
+from os import environ
+from typing import Any
 import yaml
 from Wywy_Website_Types import MainConfig
 
 logger = logging.getLogger()
 
-# peak at config
-with open("/home/create_tables/config.yml", "r") as file:
-    CONFIG: MainConfig = yaml.safe_load(file)
-    logger.debug(f"Loaded config: {CONFIG}")
+# the libyaml loader is several times faster on large configs
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+DEFAULT_CONFIG_PATH = "/home/create_tables/config.yml"
+DEFAULT_CONFIG_CACHE_PATH = "/home/create_tables/.config.cache"
+# bump when the cached representation changes
+CACHE_VERSION = 2
+INCLUDE_TAG = "!include"
+
+
+@dataclass(frozen=True)
+class Include:
+    """An unresolved !include in a parsed fragment."""
+
+    path: str
+
+    @property
+    def is_glob(self) -> bool:
+        return glob.has_magic(self.path)
+
+
+@dataclass
+class Fragment:
+    tree: Any  # the parsed file, with Include placeholders
+    includes: int  # how many Include placeholders the tree holds
+
+
+class IncludeLoader(SafeLoader):  # type: ignore
+    """The safe loader plus the !include tag."""
+
+    def __init__(self, stream: Any) -> None:
+        super().__init__(stream)
+        self.includes = 0
+
+
+def _construct_include(loader: IncludeLoader, node: yaml.Node) -> Include:
+    loader.includes += 1
+    return Include(str(loader.construct_scalar(node)))  # type: ignore
+
+
+IncludeLoader.add_constructor(INCLUDE_TAG, _construct_include)
+
+
+def config_path() -> str:
+    return environ.get("CONFIG_PATH", DEFAULT_CONFIG_PATH)
+
+
+def parse_fragment(content: bytes, path: str = "<string>") -> Fragment:
+    """Parses one config file without resolving its includes.
+
+    Args:
+        content (bytes): The content of the file.
+        path (str, optional): The file, used in errors. Defaults to "<string>".
+
+    Raises:
+        RuntimeError: When the file is not valid YAML.
+
+    Returns:
+        Fragment: The parsed file.
+    """
+    loader = IncludeLoader(content)
+    try:
+        tree = loader.get_single_data()
+    except yaml.YAMLError as e:
+        raise RuntimeError(f"Cannot parse the config file {path}: {e}") from e
+    finally:
+        loader.dispose()
+    return Fragment(tree, loader.includes)
+
+
+class FragmentCache:
+    """Parsed files by content hash, and the content hash of every file by path. Loaded from and saved to a pickle file."""
+
+    def __init__(self, cache_path: str) -> None:
+        self.cache_path = cache_path
+        # path -> (mtime_ns, size, sha256)
+        self.files: dict[str, tuple[int, int, str]] = {}
+        self.fragments: dict[str, Fragment] = {}  # sha256 -> fragment
+        self.used: set[str] = set()  # the hashes used by this load
+        self.parsed = 0
+        self.changed = False
+        if len(cache_path) > 0:
+            self._read()
+
+    def _read(self) -> None:
+        try:
+            with open(self.cache_path, "rb") as file:
+                entry = pickle.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.debug(
+                "Ignoring the unreadable config cache %s: %s", self.cache_path, e
+            )
+            return
+        if isinstance(entry, dict) and entry.get("version") == CACHE_VERSION:
+            self.files = entry["files"]
+            self.fragments = entry["fragments"]
+
+    def write(self) -> None:
+        """Saves the cache, keeping only the files and fragments used by this load."""
+        if len(self.cache_path) == 0 or not (
+            self.changed or set(self.fragments) != self.used
+        ):
+            return
+        entry = {
+            "version": CACHE_VERSION,
+            "files": {
+                path: stat for path, stat in self.files.items() if stat[2] in self.used
+            },
+            "fragments": {digest: self.fragments[digest] for digest in self.used},
+        }
+        temporary = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "wb") as file:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, self.cache_path)
+        except OSError as e:
+            # the cache is an optimization, never a reason to fail
+            logger.debug("Cannot write the config cache %s: %s", self.cache_path, e)
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+    def fragment(self, path: str) -> Fragment:
+        """Returns the parsed file, reparsing it only if its content is not cached."""
+        stat = os.stat(path)
+        known = self.files.get(path)
+        if (
+            known is not None
+            and known[:2] == (stat.st_mtime_ns, stat.st_size)
+            and known[2] in self.fragments
+        ):
+            self.used.add(known[2])
+            return self.fragments[known[2]]
+
+        with open(path, "rb") as file:
+            content = file.read()
+        digest = hashlib.sha256(content).hexdigest()
+        self.files[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        self.changed = True
+        if digest not in self.fragments:
+            logger.debug("Parsing the config file %s.", path)
+            self.fragments[digest] = parse_fragment(content, path)
+            self.parsed += 1
+        self.used.add(digest)
+        return self.fragments[digest]
+
+
+class ConfigLoader:
+    """Loads a config file and resolves its includes through a FragmentCache."""
+
+    def __init__(self, fragments: FragmentCache) -> None:
+        self.fragments = fragments
+        self.stack: list[str] = []  # the files being resolved, to detect cycles
+
+    def load(self, path: str) -> Any:
+        path = os.path.realpath(path)
+        if path in self.stack:
+            raise RuntimeError(
+                f"The config file {path} includes itself: {' -> '.join(self.stack + [path])}."
+            )
+        fragment = self.fragments.fragment(path)
+        if fragment.includes == 0:
+            return fragment.tree
+        self.stack.append(path)
+        try:
+            return self.resolve(fragment.tree, os.path.dirname(path))
+        finally:
+            self.stack.pop()
+
+    def include(self, include: Include, directory: str) -> Any:
+        path = os.path.join(directory, include.path)
+        if include.is_glob:
+            return [self.load(match) for match in sorted(glob.glob(path))]
+        if not os.path.isfile(path):
+            raise RuntimeError(
+                f"The config file {self.stack[-1]} includes {include.path}, which does not exist."
+            )
+        return self.load(path)
+
+    def resolve(self, tree: Any, directory: str) -> Any:
+        """Returns a copy of the tree with its includes replaced by the included files. Subtrees without includes are shared."""
+        if isinstance(tree, Include):
+            return self.include(tree, directory)
+        if isinstance(tree, dict):
+            return {key: self.resolve(value, directory) for key, value in tree.items()}
+        if isinstance(tree, list):
+            resolved: list = []
+            for item in tree:
+                if isinstance(item, Include) and item.is_glob:
+                    resolved.extend(self.include(item, directory))
+                else:
+                    resolved.append(self.resolve(item, directory))
+            return resolved
+        return tree
+
+
+@cache
+def load_config() -> MainConfig:
+    """Loads the config and its includes, reparsing only the files that changed. The result is shared, so do not modify it.
+
+    Returns:
+        MainConfig: The parsed config, with every include resolved.
+    """
+    fragments = FragmentCache(
+        environ.get("CONFIG_CACHE_PATH", DEFAULT_CONFIG_CACHE_PATH)
+    )
+    config = ConfigLoader(fragments).load(config_path())
+    fragments.write()
+    logger.debug(
+        "Loaded config from %d distinct files, %d of which were parsed.",
+        len(fragments.used),
+        fragments.parsed,
+    )
+    logger.debug("Loaded config: %s", config)
+    return config
@@ -0,0 +1,131 @@
+"""Shared connection manager.
+
+Every module borrows its connections from CONNECTIONS so that each database is connected to (and the TLS handshake paid for) at most once per run.
+"""
+
+import logging
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+from typing import Any, Iterator
+import psycopg
+from psycopg.connection import Connection
+from constants import CONN_CONFIG
+from instrumentation import METRICS
+
+logger = logging.getLogger()
+
+
+class CountingCursor(psycopg.Cursor):
+    """Counts a round trip for every statement executed outside of a pipeline, and records every statement in METRICS."""
+
+    def execute(
+        self, query: Any, params: Any = None, **kwargs: Any
+    ) -> "CountingCursor":
+        connection = self.connection
+        if not isinstance(connection, CountingConnection):
+            return super().execute(query, params, **kwargs)
+        if connection._pipeline is not None:
+            # the latency is recorded for the whole pipeline
+            connection.pipelined += 1
+            METRICS.record_statement(query, 0.0)
+            return super().execute(query, params, **kwargs)
+
+        connection.round_trips += 1
+        start = perf_counter()
+        try:
+            return super().execute(query, params, **kwargs)
+        finally:
+            METRICS.record_statement(query, perf_counter() - start)
+
+
+class CountingConnection(Connection):
+    """A connection that counts its round trips: one per statement, or one per pipeline however many statements it holds. BEGIN and COMMIT are not counted."""
+
+    round_trips = 0
+    pipelined = 0  # statements sent in the current pipeline
+
+    @contextmanager
+    def pipeline(self) -> Iterator[psycopg.Pipeline]:
+        if self._pipeline is not None:
+            with super().pipeline() as pipeline:
+                yield pipeline
+            return
+
+        self.pipelined = 0
+        start = perf_counter()
+        try:
+            with super().pipeline() as pipeline:
+                yield pipeline
+        finally:
+            self.round_trips += 1
+            METRICS.record_statement(
+                f"(pipeline of {self.pipelined} statements)",
+                perf_counter() - start,
+                statements=0,
+            )
+
+
+class ConnectionManager:
+    """Caches one autocommit connection per database name.
+
+    Connections are autocommit so that statements such as CREATE DATABASE work; wrap work that must be atomic in `conn.transaction()`.
+    """
+
+    def __init__(self) -> None:
+        self._connections: dict[str | None, Connection] = {}
+        self._lock = Lock()
+        self.opened = 0
+        self.reused = 0
+        self._closed_round_trips = (
+            0  # round trips of connections that were closed since
+        )
+
+    def get(self, dbname: str | None = None) -> Connection:
+        """Returns the cached connection to the given database, opening it if necessary.
+
+        Args:
+            dbname (str | None, optional): The database to connect to. None connects to the server's default database. Defaults to None.
+
+        Returns:
+            Connection: An autocommit connection to the database.
+        """
+        with self._lock:
+            conn = self._connections.get(dbname)
+            if conn is not None and not conn.closed and not conn.broken:
+                self.reused += 1
+                return conn
+
+            conn = CountingConnection.connect(
+                **CONN_CONFIG,
+                dbname=dbname,
+                autocommit=True,
+                cursor_factory=CountingCursor,
+            )
+            self._connections[dbname] = conn
+            self.opened += 1
+            return conn
+
+    def close_all(self) -> None:
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            self._closed_round_trips += sum(conn.round_trips for conn in connections)  # type: ignore
+        for conn in connections:
+            conn.close()
+
+    @property
+    def round_trips(self) -> int:
+        """The number of round trips made so far over all connections, see CountingConnection."""
+        with self._lock:
+            return self._closed_round_trips + sum(
+                conn.round_trips for conn in self._connections.values()  # type: ignore
+            )
+
+    def report(self) -> None:
+        logger.info(
+            f"Connections: {self.opened} opened, {self.reused} reused, {self.round_trips} round trips."
+        )
+
+
+CONNECTIONS = ConnectionManager()
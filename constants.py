@@ -3,7 +3,8 @@ from typing import Literal
 from Wywy_Website_Types import Datatype, PostgresDatatype
 
 # Constants
-RESERVED_DATABASE_NAMES = ["info"]
+# the partition of info/sync_status for a database named "default" would be its default partition, sync_status_default
+RESERVED_DATABASE_NAMES = ["info", "default"]
 RESERVED_TABLE_NAMES: list[str] = ["sync_status"]
 RESERVED_TABLE_SUFFIXES = [
     "tags",
@@ -13,7 +14,25 @@ RESERVED_TABLE_SUFFIXES = [
     "descriptors",
 ]
 RESERVED_COLUMN_NAMES = ["id", "user", "users", "primary_tag"]
-RESERVED_COLUMN_SUFFIXES = ["comments"]
+# a column whose type is being changed online is copied into "<column>_migrating" first
+SHADOW_COLUMN_SUFFIX = "migrating"
+RESERVED_COLUMN_SUFFIXES = ["comments", SHADOW_COLUMN_SUFFIX]
+# the extra columns stored next to a geodetic point column
+GEODETIC_COLUMN_SUFFIXES = ["latlong_accuracy", "altitude", "altitude_accuracy"]
+# the optional generated geometry copy of a geodetic point column, for planar queries
+GEOMETRY_COLUMN_SUFFIX = "geometry"
+# the index methods that can index geography and geometry columns
+SPATIAL_INDEX_METHODS = ("gist", "spgist")
+# the indexes backing the foreign keys of the tagging tables, by table suffix: (index suffix, columns, unique).
+# the unique (entry_id, tag_id) index on _tags also serves lookups by entry_id alone, so entry_id gets no index of its own.
+TAGGING_INDEXES: dict[str, tuple[tuple[str, tuple[str, ...], bool], ...]] = {
+    "tags": (
+        ("tags_entry_id_tag_id_unique", ("entry_id", "tag_id"), True),
+        ("tags_tag_id_idx", ("tag_id",), False),
+    ),
+    "tag_aliases": (("tag_aliases_tag_id_idx", ("tag_id",), False),),
+    "tag_groups": (("tag_groups_tag_id_idx", ("tag_id",), False),),
+}
 PSQLDATATYPES: dict[Datatype, PostgresDatatype] = {
     "int": "integer",
     "integer": "integer",
@@ -43,6 +62,23 @@ CONSTRAINT_NAMES = {
     # "default": "default",
 }
 
+# options of the optional top-level "auth" section of the config, and their defaults
+AUTH_OPTION_DEFAULTS: dict[str, str | int] = {
+    "session_retention": "30 days",
+    "session_purge_batch_size": 1000,
+    "token_capacity": 1000,
+    "token_refill_rate": 1,  # tokens per second
+}
+# postgres_fdw options that can be set from the "syncStatus" section of the config, and their defaults.
+# the defaults fetch and insert rows in batches instead of one remote round trip per row.
+FDW_OPTION_DEFAULTS: dict[str, str | int | bool] = {
+    "fetch_size": 1000,
+    "batch_size": 100,
+    "use_remote_estimate": False,
+    "async_capable": True,
+    "keep_connections": True,
+}
+
 CONN_CONFIG: dict[Literal["host", "port", "user", "password", "sslmode"], str] = {
     "host": environ["DATABASE_HOST"],
     "port": environ["DATABASE_PORT"],
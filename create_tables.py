@@ -1,25 +1,60 @@
 """Helper script to create PostgreSQL tables based on the config.yml file.
 @TODO write to stderr on errors, and figure out warnings, too
-@TODO ensure that no table name or column name is used twice
-@TODO check column names & suffixes
 @TODO log enforcement failures
-@TODO more descriptive logging & verbosity settings
 """
 
 # imports
 import logging
 from os import environ
 from constants import *
-from config import CONFIG
-from Wywy_Website_Types import TableInfo, DataColumn
+from config import load_config
 from utils import to_lower_snake_case, select_result_is_true
+from names import NameTable
+from catalog import CatalogSnapshot, catalog_version
+from connections import CONNECTIONS
+from planner import (
+    SchemaPlan,
+    apply_plan,
+    config_index_specs,
+    plan_column,
+    plan_constraints,
+    plan_descriptor_tables,
+    plan_indexes,
+    plan_reserved_columns,
+    plan_table,
+    plan_tagging_tables,
+    tagging_index_specs,
+)
+from fingerprint import (
+    GLOBAL_KEY,
+    config_hash,
+    ensure_fingerprint_table,
+    load_fingerprints,
+    save_fingerprint,
+    save_fingerprints,
+    table_key,
+)
+from online import OnlineSettings
+from backfill import Checkpoints, ensure_backfill_table
+from log_context import DATABASE
+from logging_config import LOG_FORMATS, configure_logging
 from typing import List, Literal
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import perf_counter
+from functools import partial
+import argparse
 import psycopg
 from psycopg.connection import Connection
 from psycopg.cursor import Cursor
 from psycopg import sql
 import sync_status
-from auth import ensure_auth_tables, ensure_admin_user
+import dry_run
+from validation import Violation, validate_auth_config, validate_config
+from instrumentation import METRICS, phase
+from auth import ensure_auth_tables, ensure_admin_user, purge_expired_sessions
+
+logger = logging.getLogger()
 
 
 def ensure_database_exists(conn: Connection, cur: Cursor, database_name: str) -> None:
@@ -41,576 +76,541 @@ def ensure_database_exists(conn: Connection, cur: Cursor, database_name: str) ->
         logger.info(f"Created database {database_name}.")
 
 
-def validate_name(name: str, reserved_names: List[str]) -> bool:
-    """
-    @param name the name to validate
-    @param reserved_names a list of reserved names to check for.
-    @return Returns whether or not the name is reserved (validity)
-    """
-    for reserved_name in reserved_names:
-        if name == reserved_name:
-            return False
-    return True
-
-
-def validate_suffix(name: str, reserved_suffixes: List[str]) -> bool:
-    """
-    @param name the name to validate
-    @param reserved_suffixes a list of suffixes to check for.
-    @returns Returns whether or not the name's suffix is reserved (validity)
-    """
-    for reserved_suffix in reserved_suffixes:
-        suffix_len = len(reserved_suffix) + 1
-        if len(name) >= suffix_len and name[:-suffix_len] == f"_{reserved_suffix}":
-            return False
-    return True
-
-
-def table_exists(conn: Connection, table_name: str) -> bool:
-    """Checks if the given table exists inside the database related to the connection.
-    @param conn the connection to the database that may contain the given table.
-    @param table_name the table to check for
-    @returns True if the table exists, False if it does not.
-    """
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT EXISTS (SELECT FROM pg_tables WHERE tablename = %s);", (table_name,)
-        )
-
-        return select_result_is_true(cur)
+@dataclass
+class ProvisionResult:
+    database_name: str
+    status: Literal["ready", "unchanged", "skipped", "failed"] = "skipped"
+    tables_ready: int = 0
+    elapsed: float = 0.0
+    error: BaseException | None = None
+    needs_rerun: bool = False  # set if the database must be enforced again on the next run
 
 
-def column_exists(conn: Connection, table_name: str, column_name: str) -> bool:
-    """Checks if the column inside the given table exists. Assumes that the table already exists.
-    @param conn the connection to the database that contains the table that may contain the given column.
-    @param table_name the name of the table that may contain the given column.
-    @param column_name the column to check for
-    @returns True if the column exists, False if it does not.
-    """
-    with conn.cursor() as cur:
-        cur.execute(
-            "SELECT EXISTS (SELECT * FROM information_schema.columns WHERE table_name = %s AND column_name = %s);",
-            (
-                table_name,
-                column_name,
-            ),
-        )
-        return select_result_is_true(cur)
+def plan_database(plan: SchemaPlan, dbInfo: dict) -> List[str]:
+    """Plans every table of the database described by the config entry. Nothing is executed.
 
+    Args:
+        plan (SchemaPlan): The plan to add the operations to. Its catalog snapshot is the state to plan against.
+        dbInfo (dict): The config entry of the database.
 
-def enforce_column(
-    conn: Connection, table_name: str, column_schema: DataColumn
-) -> bool:
-    """Attempts to ensure that the column conforms to the given schema. Assumes that the respective table already exists. Will remove all constraints and repopulate them without necessarily validating previous data. Chooses to keep rather than destroy old data.
-    @param conn the connection to the database that contains the table that will contain the given column.
-    @param table_name the name of the table that will contain the given column.
-    @param column_schema the column schema to enforce. This function assumes that column_schema is well-formed.
-    @returns True if the column matches the schema, False if the column already exists under a different datatype.
+    Returns:
+        List[str]: The names of the planned tables.
     """
-    column_name = to_lower_snake_case(column_schema["name"])
-
-    # ensure that the column exists
-    with conn.cursor() as cur:
-        if column_exists(conn, table_name, column_name):
-            cur.execute(
-                "SELECT data_type FROM information_schema.columns WHERE table_name=%s AND column_name=%s",
-                (
-                    table_name,
-                    to_lower_snake_case(column_schema["name"]),
-                ),
-            )
-            is_datatype_correct: bool = select_result_is_true(cur)
-            if not is_datatype_correct:
-                return False
-        else:
-            match (column_schema["datatype"]):
-                case "enum":
-                    cur.execute(
-                        sql.SQL("""
-                                            CREATE TYPE {} AS ENUM ({});
-                                            ALTER TABLE {} ADD COLUMN {} {};
-                                            """).format(
-                            sql.Identifier(f"{table_name}_{column_name}_enum"),
-                            sql.SQL(", ").join(map(sql.Literal, column_schema["values"])),  # type: ignore
-                            sql.Identifier(table_name),
-                            sql.Identifier(column_name),
-                            sql.Identifier(f"{table_name}_{column_name}_enum"),
-                        )
-                    )
-                case "geodetic point":
-                    cur.execute(
-                        sql.SQL("""
-                                        ALTER TABLE {table_name} ADD COLUMN {ST_Point_column_name} geography(POINT, 4326);
-                                        ALTER TABLE {table_name} ADD COLUMN {latlong_accuracy_column_name} double precision;
-                                        ALTER TABLE {table_name} ADD COLUMN {altitude_column_name} double precision;
-                                        ALTER TABLE {table_name} ADD COLUMN {altitude_accuracy_column_name} double precision;
-                                        """).format(
-                            table_name=sql.Identifier(table_name),
-                            ST_Point_column_name=sql.Identifier(column_name),
-                            latlong_accuracy_column_name=sql.Identifier(
-                                f"{column_name}_latlong_accuracy"
-                            ),
-                            altitude_column_name=sql.Identifier(
-                                f"{column_name}_altitude"
-                            ),
-                            altitude_accuracy_column_name=sql.Identifier(
-                                f"{column_name}_altitude_accuracy"
-                            ),
-                        )
-                    )
-                case "pointer":
-                    pointer_target = column_schema.get("references")
-                    if pointer_target is None:
-                        raise RuntimeError(
-                            f"Pointer target for {table_name}/{column_schema["name"]} is undefined."
-                        )
-                    cur.execute(
-                        sql.SQL(
-                            "ALTER TABLE {table_name} ADD COLUMN {column_name} INTEGER REFERENCES {foreign_table_name}(id)"
-                        ).format(
-                            table_name=sql.Identifier(table_name),
-                            column_name=sql.Identifier(column_name),
-                            foreign_table_name=sql.Identifier(pointer_target),
-                        )
-                    )
-                case "polymorphic pointer" | "polypointer":
-                    cur.execute(
-                        sql.SQL("""
-                                ALTER TABLE {table_name} ADD COLUMN {target_column_name} INTEGER;
-                                ALTER TABLE {table_name} ADD COLUMN {type_column_name} VARCHAR(64);
-                                """).format(
-                            table_name=sql.Identifier(table_name),
-                            target_column_name=sql.Identifier(column_name),
-                            type_column_name=sql.Identifier(f"{column_name}_type"),
-                        )
+    planned_tables: List[str] = []
+
+    # the config has been validated beforehand, see validation.py
+    for tableInfo in dbInfo.get("tables", []):
+        table_name = plan.names.normalize(tableInfo["tableName"])
+
+        # create the table if necessary
+        with phase("plan tables"):
+            plan_table(plan, table_name)
+
+        # create tagging tables if necessary
+        if tableInfo.get("tagging", False):
+            with phase("plan tagging"):
+                plan_tagging_tables(plan, table_name)
+
+        # create descriptor tables if necessary
+        if "descriptors" in tableInfo:
+            with phase("plan descriptors"):
+                if not plan_descriptor_tables(plan, tableInfo):
+                    logger.warning(
+                        "Descriptor tables of %s/%s do not match the schema.",
+                        plan.database_name,
+                        table_name,
+                        extra={"table": table_name},
                     )
-                case _:
-                    cur.execute(
-                        sql.SQL("ALTER TABLE {} ADD {} {};").format(
-                            sql.Identifier(table_name),
-                            sql.Identifier(column_name),
-                            sql.SQL(PSQLDATATYPES[column_schema["datatype"]]),
-                        )
+
+        # add in the columns individually
+        with phase("plan columns"):
+            for column_schema in tableInfo["schema"]:
+                if not plan_column(plan, table_name, column_schema):
+                    logger.warning(
+                        "Column %s/%s/%s does not match the schema.",
+                        plan.database_name,
+                        table_name,
+                        column_schema["name"],
+                        extra={"table": table_name, "column": column_schema["name"]},
                     )
+            plan_constraints(plan, table_name, tableInfo["schema"])
 
-    # remove existing constraints
-    with conn.cursor() as cur:
-        cur.execute(
-            """
-                    SELECT
-                        constraint_name
-                    FROM
-                        information_schema.table_constraints
-                    WHERE
-                        table_name = %s AND constraint_name <> 'FOREIGN KEY' AND constraint_type NOT IN ('PRIMARY KEY', 'FOREIGN KEY');
-                    """,
-            (table_name,),
-        )
-        constraints = cur.fetchall()
-        for (constraint_name,) in cur.fetchall():
-            cur.execute(
-                sql.SQL("ALTER TABLE {} DROP CONSTRAINT {};").format(
-                    sql.Identifier(table_name), sql.Identifier(constraint_name)
-                )
-            )
-    # enforce schema
-    # @TODO enforce fkey
-    # check out constraints
-    with conn.cursor() as cur:
-        if column_schema.get("unique", False):
-            cur.execute(
-                sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} UNIQUE ({});").format(
-                    sql.Identifier(table_name),
-                    sql.Identifier(f"{table_name}_{column_name}_unique"),
-                    sql.Identifier(column_name),
-                )
-            )
-        if not column_schema.get("optional", True):
-            cur.execute(
-                sql.SQL(
-                    "ALTER TABLE {} ADD CONSTRAINT {} NOT_NULL ({}) NOT VALID;"
-                ).format(
-                    sql.Identifier(table_name),
-                    sql.Identifier(f"{table_name}_{column_name}_unique"),
-                    sql.Identifier(column_name),
+        # add in the reserved columns
+        with phase("plan reserved columns"):
+            if not plan_reserved_columns(plan, tableInfo):
+                logger.warning(
+                    "Reserved columns of %s/%s do not match the schema.",
+                    plan.database_name,
+                    table_name,
+                    extra={"table": table_name},
                 )
+
+        # keep the indexes in sync
+        with phase("plan indexes"):
+            plan_indexes(
+                plan, table_name, config_index_specs(plan.names, table_name, tableInfo)
             )
-        # @TODO CHECK (REGEX, number comparisons)
-
-    # special checks for enum values:
-    # @TODO
-
-    # check for the comments column
-    # do not remove old comments columns
-    comments_column_exists = column_exists(conn, table_name, column_name + "_comments")
-    if "comments" in column_schema and column_schema["comments"]:
-        if not comments_column_exists:
-            with conn.cursor() as cur:
-                cur.execute(
-                    sql.SQL("ALTER TABLE {} ADD COLUMN {} text DEFAULT '';").format(
-                        sql.Identifier(table_name),
-                        sql.Identifier(column_name + "_comments"),
-                    )
-                )
-    elif comments_column_exists:
-        return False
-    return True
+            if tableInfo.get("tagging", False):
+                for tagging_table_name, specs in tagging_index_specs(
+                    table_name
+                ).items():
+                    plan_indexes(plan, tagging_table_name, specs)
+        planned_tables.append(table_name)
 
+    return planned_tables
 
-def enforce_reserved_columns(conn: Connection, table_schema: TableInfo) -> bool:
-    """Attempts to ensure that the table's reserved columns conform to its schema. Assumes that the respective tables already exist (the table itself and the tagging tables). (There's almost nothing this function can do to save the table if it doesn't conform to the schema) @TODO
-    @param conn the connection to the database that contains the given table.
-    @param table_schema the table schema to enforce. This function assumes that table_schema is well-formed.
-    @returns True if the table matches the schema, False if there are reserved columns that should not exist.
-    """
-    with conn.cursor() as cur:
-        # id column
-        if not column_exists(
-            conn, table_name, "id"
-        ):  # @TODO check constraints & primary key status
-            return False
-
-        # primary_tag column
-        if table_schema.get("tagging", False):  # if the schema enables tagging,
-            if not column_exists(
-                conn, table_name, "primary_tag"
-            ):  # @TODO check constraints
-                cur.execute(
-                    sql.SQL(
-                        "ALTER TABLE {} ADD COLUMN primary_tag INT NOT NULL;"
-                    ).format(
-                        sql.Identifier(table_name),
-                    )
-                )
-                cur.execute(
-                    sql.SQL(
-                        "ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY (primary_tag) REFERENCES {}(id)"
-                    ).format(
-                        sql.Identifier(table_name),
-                        sql.Identifier("fk_primary_tags"),
-                        sql.Identifier(f"{table_name}_tag_names"),
-                    )
-                )
-        else:  # if the schema does not specify tagging or disables tagging
-            if column_exists(conn, table_name, "primary_tag"):
-                return False
-    return True
-
-
-TAGGING_TABLE_NAMES = Literal["tag_names", "tags", "tag_aliases", "tag_groups"]
-TAGGING_TABLE_STATEMENTS: dict[TAGGING_TABLE_NAMES, sql.SQL] = {
-    "tag_names": sql.SQL("""
-                         CREATE TABLE {} (
-                            id SERIAL PRIMARY KEY,
-                            tag_name TEXT NOT NULL UNIQUE
-                         );
-                         """),
-    "tags": sql.SQL("""
-                    CREATE TABLE {} (
-                        id SERIAL PRIMARY KEY,
-                        entry_id INT REFERENCES {} (id) NOT NULL,
-                        tag_id INT REFERENCES {} (id) NOT NULL
-                    );
-                    """),
-    "tag_aliases": sql.SQL("""
-                         CREATE TABLE {} (
-                            alias TEXT PRIMARY KEY,
-                            tag_id INT REFERENCES {} (id) NOT NULL
-                         );
-                         """),
-    "tag_groups": sql.SQL("""
-                         CREATE TABLE {} (
-                            id SERIAL PRIMARY KEY,
-                            tag_id INT REFERENCES {} (id) NOT NULL,
-                            group_name TEXT NOT NULL
-                         );
-                         """),
-}
-
-
-def enforce_tagging_tables(conn: Connection, table_name: str):
-    """Creates related tagging tables if necessary, assuming that the table requires tagging.
+
+def provision_database(
+    dbInfo: dict, online: OnlineSettings | None = None
+) -> ProvisionResult:
+    """Creates the database described by the config entry along with all of its tables.
 
     Args:
-        conn (_type_): _description_
-        table_name (str): The name of the target table.
-    """
-    # go through every table in order (foreign key dependencies)
-    with conn.cursor() as cur:
-        # tag names
-        if not table_exists(conn, table_name + "_tag_names"):
-            cur.execute(
-                TAGGING_TABLE_STATEMENTS["tag_names"].format(
-                    sql.Identifier(table_name + "_tag_names")
-                )
-            )
+        dbInfo (dict): The config entry of the database.
+        online (OnlineSettings | None, optional): Migrate existing tables online with these settings. Defaults to None.
 
-    with conn.cursor() as cur:
-        # tags
-        if not table_exists(conn, table_name + "_tags"):
-            cur.execute(
-                TAGGING_TABLE_STATEMENTS["tags"].format(
-                    sql.Identifier(table_name + "_tags"),
-                    sql.Identifier(table_name),
-                    sql.Identifier(f"{table_name}_tag_names"),
-                )
-            )
+    Returns:
+        ProvisionResult: What happened to the database. Exceptions are left to the caller.
+    """
+    db_name = to_lower_snake_case(dbInfo["dbname"])
+    result = ProvisionResult(db_name)
+
+    # check if the table already exists
+    with phase("database"):
+        server_conn = CONNECTIONS.get()
+        with server_conn.cursor() as cur:
+            ensure_database_exists(server_conn, cur, db_name)
+
+    # take a snapshot of the catalog, which also tells whether the required packages are installed
+    conn = CONNECTIONS.get(db_name)
+    with phase("catalog"):
+        catalog = CatalogSnapshot.load(conn)
+    if "postgis" not in catalog.extensions:
+        with phase("extension"), conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
+        catalog.extensions.add("postgis")
+    plan = SchemaPlan(db_name, catalog, online, names=NameTable.build(dbInfo))
+    with phase("plan"):
+        planned_tables = plan_database(plan, dbInfo)
+
+    # apply every change in one go
+    logger.debug("Applying %d DDL operations to %s.", len(plan), db_name)
+    with phase("apply"):
+        apply_plan(conn, plan, Checkpoints(CONNECTIONS.get("info"), db_name))
+    for table_name in planned_tables:
+        logger.info(
+            "Table %s/%s is ready.", db_name, table_name, extra={"table": table_name}
+        )
+    result.tables_ready = len(planned_tables)
+
+    result.status = "ready"
+    if plan.needs_rerun:
+        # leave the fingerprint alone so that the next run enforces the database again
+        logger.info(f"{db_name} will be enforced again on the next run.")
+        result.needs_rerun = True
+    return result
+
+
+def _provision_in_context(
+    dbInfo: dict, online: OnlineSettings | None = None
+) -> ProvisionResult:
+    """Runs provision_database inside a logging context and captures its failure instead of raising."""
+    token = DATABASE.set(to_lower_snake_case(str(dbInfo.get("dbname", "-"))))
+    start = perf_counter()
+    try:
+        result = provision_database(dbInfo, online)
+    except Exception as e:
+        logger.exception(f"Failed to create database {DATABASE.get()}.")
+        result = ProvisionResult(DATABASE.get(), "failed", error=e)
+    finally:
+        DATABASE.reset(token)
+    result.elapsed = perf_counter() - start
+    return result
+
+
+def provision_databases(
+    databases: List[dict], max_workers: int, online: OnlineSettings | None = None
+) -> List[ProvisionResult]:
+    """Creates every database in parallel. Each database is independent of the others, so up to max_workers of them are handled at the same time.
 
-        # tag aliases
-        if not table_exists(conn, table_name + "_tag_aliases"):
-            cur.execute(
-                TAGGING_TABLE_STATEMENTS["tag_aliases"].format(
-                    sql.Identifier(table_name + "_tag_aliases"),
-                    sql.Identifier(f"{table_name}_tag_names"),
-                )
-            )
+    Args:
+        databases (List[dict]): The config entries of the databases.
+        max_workers (int): The maximum number of databases to handle concurrently.
+        online (OnlineSettings | None, optional): Migrate existing tables online with these settings. Defaults to None.
 
-        # tag groups
-        if not table_exists(conn, table_name + "_tag_groups"):
-            cur.execute(
-                TAGGING_TABLE_STATEMENTS["tag_groups"].format(
-                    sql.Identifier(table_name + "_tag_groups"),
-                    sql.Identifier(f"{table_name}_tag_names"),
-                )
-            )
+    Returns:
+        List[ProvisionResult]: One result per database, in config order.
+    """
+    if max_workers <= 1:
+        return [_provision_in_context(dbInfo, online) for dbInfo in databases]
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="provision"
+    ) as executor:
+        return list(
+            executor.map(partial(_provision_in_context, online=online), databases)
+        )
 
 
-def enforce_descriptor_tables(conn: Connection, table_schema: TableInfo) -> bool:
-    """Creates related descriptor tables if necessary. @TODO reject invalid configs where there is a collision between different descriptor tables (extremely unlikely if the user is good-faith)
+def plan_databases(
+    databases: List[dict],
+    snapshots: dict[str, CatalogSnapshot],
+    online: OnlineSettings | None = None,
+) -> List[SchemaPlan]:
+    """Plans every database of a validated config against the given catalog snapshots without connecting to anything.
 
     Args:
-        conn (_type_): Connection to the database containing the parent table.
-        table_schema (dict): The schema for the parent table.
+        databases (List[dict]): The config entries of the databases.
+        snapshots (dict[str, CatalogSnapshot]): The snapshot of every existing database. Missing databases are planned from scratch.
+        online (OnlineSettings | None, optional): Plan online migrations with these settings. Defaults to None.
 
     Returns:
-        bool: Whether or not the tables already exist or have been created.
+        List[SchemaPlan]: One plan per database, in config order.
     """
-    output: bool = True
-    if "descriptors" not in table_schema:
-        return True
-
-    # create one table for every descriptor type.
-    for descriptor_schema in table_schema["descriptors"]:
-        descriptor_table_name: str = (
-            f"{to_lower_snake_case(table_schema["tableName"])}_{to_lower_snake_case(descriptor_schema["name"])}_descriptors"
+    plans: List[SchemaPlan] = []
+    for dbInfo in databases:
+        db_name = to_lower_snake_case(dbInfo["dbname"])
+        plan = SchemaPlan(
+            db_name,
+            snapshots.get(db_name) or CatalogSnapshot(),
+            online,
+            names=NameTable.build(dbInfo),
         )
-        if not table_exists(conn, descriptor_table_name):
-            with conn.cursor() as cur:
-                cur.execute(
-                    sql.SQL("CREATE TABLE {} (id SERIAL PRIMARY KEY);").format(
-                        sql.Identifier(descriptor_table_name)
-                    )
-                )
+        token = DATABASE.set(db_name)
+        try:
+            plan_database(plan, dbInfo)
+        finally:
+            DATABASE.reset(token)
+        plans.append(plan)
+    return plans
+
+
+def _catalog_matches(db_name: str, fingerprints: dict[str, tuple[str, str]]) -> bool:
+    """Checks whether the database's catalog is still the one its stored fingerprint was taken of."""
+    if db_name not in fingerprints:
+        return False
+    # the database might have been dropped since
+    try:
+        return catalog_version(CONNECTIONS.get(db_name)) == fingerprints[db_name][1]
+    except psycopg.OperationalError:
+        return False
 
-        for column_schema in descriptor_schema["schema"]:
-            if not enforce_column(conn, descriptor_table_name, column_schema):
-                output = False
 
-    return output
+def is_unchanged(dbInfo: dict, fingerprints: dict[str, tuple[str, str]]) -> bool:
+    """Checks whether the database's config subtree and catalog still match its stored fingerprint.
 
+    Args:
+        dbInfo (dict): The config entry of the database.
+        fingerprints (dict[str, tuple[str, str]]): The stored fingerprints.
 
-if __name__ == "__main__":
-    # START - logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
+    Returns:
+        bool: True if the database does not need to be enforced again.
+    """
+    db_name = to_lower_snake_case(dbInfo["dbname"])
+    if db_name not in fingerprints or fingerprints[db_name][0] != config_hash(dbInfo):
+        return False
 
-    verbose_formatter = logging.Formatter(
-        "{levelname} {asctime} {module} {process:d} {thread:d} {message}", style="{"
-    )
-    simple_formatter = logging.Formatter("{levelname} {message}", style="{")
+    # only look at the catalog when the config matches
+    return _catalog_matches(db_name, fingerprints)
 
-    file_handler = logging.FileHandler(
-        f"/var/log/Wywy-Website/create_tables/create_tables.log"
-    )
-    file_handler.setLevel(logging.INFO)  # @TODO configure this
-    file_handler.setFormatter(simple_formatter)
-    debug_file_handler = logging.FileHandler(
-        f"/var/log/Wywy-Website/create_tables/create_tables-debug.log"
-    )
-    debug_file_handler.setLevel(logging.DEBUG)
-    debug_file_handler.setFormatter(verbose_formatter)
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(simple_formatter)
-
-    logger.addHandler(file_handler)
-    logger.addHandler(debug_file_handler)
-    logger.addHandler(console_handler)
-    # END - logger
-
-    # @TODO validate tables
-    logging.info("Ready to create tables.")
-    # loop through every database that has tables to be created
-    for dbInfo in CONFIG["data"]:
-        # immediately exit if the database name is empty
-        if (
-            not "dbname" in dbInfo
-            or not type(dbInfo["dbname"]) is str
-            or len(dbInfo["dbname"]) == 0
-        ):
-            logger.warning(
-                'Config violation: Databases must have names under the key "dbname". Skipping the creation of a nameless database.'
-            )
-            continue
 
-        db_name = to_lower_snake_case(dbInfo["dbname"])
+def changed_tables(
+    dbInfo: dict, fingerprints: dict[str, tuple[str, str]]
+) -> List[dict] | None:
+    """Finds the tables of a changed database that need to be enforced again. This is only safe while the catalog has not drifted since the database was last enforced.
 
-        # validate database name
-        schema_violations: List[str] = []
-        if not validate_name(db_name, RESERVED_DATABASE_NAMES):
-            schema_violations.append(f"{db_name} is a reserved database name.")
+    Args:
+        dbInfo (dict): The config entry of the database.
+        fingerprints (dict[str, tuple[str, str]]): The stored fingerprints.
 
-        if len(schema_violations) > 0:
-            logger.warning(
-                f"Config violation: Skipping creation of database {db_name} due to schema {"violation" if len(schema_violations) == 1 else "violations"}"
-            )
-            for schema_violation in schema_violations:
-                logger.warning(f"Config violation: {schema_violation}")
-
-        # check if the table already exists
-        # @TODO reduce the number of with statements
-        with psycopg.connect(**CONN_CONFIG, dbname=None, autocommit=True) as conn:
-            with conn.cursor() as cur:
-                ensure_database_exists(conn, cur, db_name)
-
-        # verify that the required packages are installed
-        with psycopg.connect(**CONN_CONFIG, dbname=db_name, autocommit=True) as conn:
-            with conn.cursor() as cur:
-                cur.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
-
-        # loop through every table that needs to be created @TODO verify config validity to avoid errors
-        for tableInfo in dbInfo.get("tables", []):
-            # immediately skip if the table is nameless
-            if (
-                not "tableName" in tableInfo
-                or not type(tableInfo["tableName"]) is str
-                or len(tableInfo["tableName"]) == 0
-            ):
-                logger.warning(
-                    f'Config violation: Tables must have a non-empty name specified in key "tableName". Skipping creation of a nameless table in {db_name}.'
-                )
-                continue
-            # convert to lower_snake_case
-            table_name = to_lower_snake_case(tableInfo["tableName"])
-
-            # validate the table name
-            # do not check for nameless tables because this was previously validated
-            schema_violations: List[str] = []
-            valid = True  # innocent until proven guilty
-
-            # avoid reserved table names
-            if not validate_name(table_name, RESERVED_TABLE_NAMES):
-                schema_violations.append(
-                    f'"{tableInfo["tableName"]}" is a reserved table name.'
-                )
+    Returns:
+        List[dict] | None: The config entries of the tables whose subtree changed, in config order, or None if the whole database needs to be enforced.
+    """
+    db_name = to_lower_snake_case(dbInfo["dbname"])
+    if not _catalog_matches(db_name, fingerprints):
+        return None
+    return [
+        tableInfo
+        for tableInfo in dbInfo.get("tables", [])
+        if fingerprints.get(
+            table_key(db_name, to_lower_snake_case(tableInfo["tableName"])),
+            (None, None),
+        )[0]
+        != config_hash(tableInfo)
+    ]
+
+
+def database_fingerprints(
+    dbInfo: dict, enforced: dict, result: ProvisionResult
+) -> List[tuple[str, str, str]]:
+    """The fingerprints to store after a database was enforced successfully. The catalog version is taken now, so call it once nothing else changes the database in this run (sync_status adds a foreign table to every data database).
 
-            # avoid reserved table suffixes
-            if not validate_suffix(table_name, RESERVED_TABLE_SUFFIXES):
-                schema_violations.append(
-                    f'"{tableInfo["tableName"]}" contains a reserved table suffix ({RESERVED_TABLE_SUFFIXES}).'
-                )
+    Args:
+        dbInfo (dict): The config entry of the database.
+        enforced (dict): The part of the config entry that was enforced, i.e. dbInfo with only its changed tables.
+        result (ProvisionResult): The result of the enforcement.
 
-            # there are 1+ columns
-            if (
-                not "schema" in tableInfo
-                or not (
-                    type(tableInfo["schema"]) is List
-                    or type(tableInfo["schema"]) is list
-                )
-                or len(tableInfo["schema"]) < 1
-                or not tableInfo["schema"]
-            ):
-                schema_violations.append(
-                    f"Table {tableInfo["tableName"]} must have least 1 column of data to store."
-                )
+    Returns:
+        List[tuple[str, str, str]]: (key, config hash, catalog version) of the database and of every enforced table.
+    """
+    if result.status != "ready" or result.needs_rerun:
+        return []
+    version = catalog_version(CONNECTIONS.get(result.database_name))
+    return [
+        (result.database_name, config_hash(dbInfo), version),
+        *(
+            (
+                table_key(
+                    result.database_name, to_lower_snake_case(tableInfo["tableName"])
+                ),
+                config_hash(tableInfo),
+                version,
+            )
+            for tableInfo in enforced.get("tables", [])
+        ),
+    ]
 
-            # @TODO tagging related violations
 
-            # descriptor related violations
-            if "descriptors" in tableInfo:
-                # there are 1+ descriptors
-                if (
-                    not "descriptors" in tableInfo
-                    or not (
-                        type(tableInfo["descriptors"]) is List
-                        or type(tableInfo["descriptors"] is list)
-                    )
-                    or len(tableInfo["descriptors"]) < 1
-                ):
-                    schema_violations.append(
-                        f"Table {tableInfo["tableName"]} must have at least 1 descriptor if descriptors are enabled."
-                    )
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--log-level",
+        help="the verbosity, e.g. DEBUG, INFO or WARNING. Overrides LOG_LEVEL (default INFO)",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=LOG_FORMATS,
+        help="log as text or as JSON lines. Overrides LOG_FORMAT (default text)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="enforce every database even if its config and catalog are unchanged since the last run",
+    )
+    parser.add_argument(
+        "--partial",
+        action="store_true",
+        help="only enforce the databases whose config or catalog changed since the last run, and only the changed tables of databases whose catalog did not drift",
+    )
+    parser.add_argument(
+        "--online",
+        action="store_true",
+        help="migrate existing tables without long locks: build unique indexes concurrently, validate foreign keys separately and retry on lock timeouts",
+    )
+    parser.add_argument(
+        "--plan",
+        "--dry-run",
+        dest="plan",
+        action="store_true",
+        help="print the SQL script and a summary of the changes a run would make, without changing anything",
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="PATH",
+        help="with --plan, plan against this catalog snapshot file instead of connecting to the server",
+    )
+    parser.add_argument(
+        "--save-snapshot",
+        metavar="PATH",
+        help="with --plan, also save the live catalogs to this file for later offline dry runs",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="PATH",
+        help="with --plan, write the SQL script to this file instead of stdout",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PATH",
+        help="write a JSON report of the statement counts and timings per phase and per table",
+    )
+    parser.add_argument(
+        "--openmetrics",
+        metavar="PATH",
+        help="write the per-phase timings as an OpenMetrics text file, e.g. for node exporter's textfile collector",
+    )
+    parser.add_argument(
+        "--purge-sessions",
+        action="store_true",
+        help="only delete the sessions that were not seen within auth.session_retention, in batches, and exit",
+    )
+    return parser.parse_args()
+
+
+def write_metrics(args: argparse.Namespace, success: bool) -> None:
+    """Writes the instrumentation report(s) requested on the command line."""
+    counts = {
+        "connections_opened": CONNECTIONS.opened,
+        "connections_reused": CONNECTIONS.reused,
+        "round_trips": CONNECTIONS.round_trips,
+    }
+    if args.metrics is not None:
+        METRICS.write_json(args.metrics, {**counts, "success": success})
+    if args.openmetrics is not None:
+        METRICS.write_openmetrics(
+            args.openmetrics,
+            {
+                **{f"create_tables_{name}": value for name, value in counts.items()},
+                "create_tables_success": int(success),
+            },
+        )
 
-                # descriptor validity
-                for descriptor_schema in tableInfo["descriptors"]:
-                    # require descriptor names. These names are subject to the same rules as column names.
-                    if (
-                        "name" not in descriptor_schema
-                        or len(descriptor_schema["schema"]) == 0
-                    ):
-                        schema_violations.append(
-                            f"Table {tableInfo["tableName"]} contains a nameless descriptor."
-                        )
-                        continue
-
-                    # @TODO avoid reserved column names
-
-                    # @TODO avoid reserved column suffixes
-
-                    # there are 1+ columns
-                    if "schema" not in descriptor_schema or not (
-                        type(descriptor_schema["schema"]) is List
-                        or type(descriptor_schema["schema"]) is list
-                    ):
-                        schema_violations.append(
-                            f"Descriptor {descriptor_schema["name"]} in table {tableInfo["tableName"]} must have a schema that consists of an array of columns schemas."
-                        )
-            if len(schema_violations) > 0:
-                logger.warning(
-                    f"Config violation: Skipping creation of table {db_name}/{table_name} due to schema {"violation" if len(schema_violations) == 1 else "violations"}:"
-                )
-                for schema_violation in schema_violations:
-                    logger.warning(f"Config violation:  {schema_violation}")
-
-            with psycopg.connect(**CONN_CONFIG, dbname=db_name) as conn:
-                with conn.cursor() as cur:
-                    # create the table if necessary
-                    cur.execute(
-                        "SELECT EXISTS (SELECT FROM pg_tables WHERE tablename = %s);",
-                        (table_name,),
-                    )
-                    tableExists = select_result_is_true(cur)
-                    if not tableExists:
-                        cur.execute(
-                            sql.SQL("CREATE TABLE {} (id SERIAL PRIMARY KEY);").format(
-                                sql.Identifier(table_name)
-                            )
-                        )
 
-                    # create tagging tables if necessary
-                    if tableInfo.get("tagging", False):
-                        enforce_tagging_tables(conn, table_name)
+def report_results(results: List[ProvisionResult]) -> bool:
+    """Logs a summary of the provisioning results.
 
-                    # create descriptor tables if necessary
-                    if "descriptors" in tableInfo:
-                        enforce_descriptor_tables(conn, tableInfo)
+    Returns:
+        bool: True if no database failed.
+    """
+    failures = [result for result in results if result.status == "failed"]
+    for result in results:
+        message = f"{result.database_name or '(nameless)'}: {result.status}, {result.tables_ready} tables ready in {result.elapsed:.2f}s"
+        if result.error is not None:
+            logger.error(f"{message} ({type(result.error).__name__}: {result.error})")
+        else:
+            logger.info(message)
+    logger.info(
+        f"{len(results) - len(failures)}/{len(results)} databases provisioned successfully."
+    )
+    return len(failures) == 0
 
-                    # add in the columns individually
-                    for column_schema in tableInfo["schema"]:
-                        enforce_column(conn, table_name, column_schema)
 
-                    # add in the reserved columns
-                    enforce_reserved_columns(conn, tableInfo)
-            logger.info(f"Table {db_name}/{table_name} is ready.")
+def exit_on_violations(violations: List[Violation]) -> None:
+    """Logs every violation and exits if there are any."""
+    if len(violations) == 0:
+        return
+    for violation in violations:
+        logger.error(f"Config violation: {violation}")
+    logger.error(
+        f"The config has {len(violations)} {"violation" if len(violations) == 1 else "violations"}. Nothing was changed."
+    )
+    raise SystemExit(1)
 
-    with psycopg.connect(**CONN_CONFIG, autocommit=True) as conn:
-        with conn.cursor() as cur:
-            ensure_database_exists(conn, cur, "info")
 
-    if environ.get("SYNC_STATUS", "false").lower() == "true":
-        sync_status.main()
+if __name__ == "__main__":
+    args = parse_args()
+    configure_logging(args.log_level, args.log_format)
+    CONFIG = load_config()
+
+    # purging sessions runs on its own schedule, so it skips provisioning and only needs the auth section
+    if args.purge_sessions:
+        exit_on_violations(validate_auth_config(CONFIG))
+        with phase("purge sessions"):
+            purge_expired_sessions()
+        CONNECTIONS.report()
+        CONNECTIONS.close_all()
+        write_metrics(args, True)
+        raise SystemExit(0)
+
+    # refuse invalid configs before any connection is opened
+    exit_on_violations(validate_config(CONFIG))
+    online_settings = OnlineSettings.from_environ() if args.online else None
+
+    if args.plan:
+        database_names = [
+            to_lower_snake_case(dbInfo["dbname"]) for dbInfo in CONFIG["data"]
+        ]
+        if args.snapshot is not None:
+            snapshots = dry_run.load_snapshot_file(args.snapshot)
+        else:
+            snapshots = dry_run.capture_snapshots(database_names)
+            if args.save_snapshot is not None:
+                dry_run.save_snapshot_file(args.save_snapshot, snapshots)
+            CONNECTIONS.report()
+            CONNECTIONS.close_all()
+        with phase("plan"):
+            plans = plan_databases(CONFIG["data"], snapshots, online_settings)
+        dry_run.report_plans(plans, set(snapshots), args.output)
+        write_metrics(args, True)
+        raise SystemExit(0)
+
+    sync_status_enabled = environ.get("SYNC_STATUS", "false").lower() == "true"
+
+    with phase("database"):
+        server_conn = CONNECTIONS.get()
+        with server_conn.cursor() as cur:
+            ensure_database_exists(server_conn, cur, "info")
+    info_conn = CONNECTIONS.get("info")
+    with phase("fingerprints"):
+        ensure_fingerprint_table(info_conn)
+        ensure_backfill_table(info_conn)
+        fingerprints = {} if args.force else load_fingerprints(info_conn)
+        global_hash = config_hash(
+            {"config": CONFIG, "sync_status": sync_status_enabled}
+        )
+
+        unchanged = [
+            dbInfo for dbInfo in CONFIG["data"] if is_unchanged(dbInfo, fingerprints)
+        ]
+        everything_unchanged = len(unchanged) == len(
+            CONFIG["data"]
+        ) and fingerprints.get(GLOBAL_KEY) == (global_hash, catalog_version(info_conn))
+
+    success = True
+    if everything_unchanged:
+        logger.info("Config and catalogs are unchanged since the last run. Skipping enforcement.")
+    else:
+        logging.info("Ready to create tables.")
+        # loop through every database that has tables to be created
+        to_provision = CONFIG["data"]
+        enforced = to_provision
+        results: List[ProvisionResult] = []
+        if args.partial:
+            to_provision = [
+                dbInfo for dbInfo in CONFIG["data"] if dbInfo not in unchanged
+            ]
+            results = [
+                ProvisionResult(to_lower_snake_case(dbInfo["dbname"]), "unchanged")
+                for dbInfo in unchanged
+            ]
+            # databases whose catalog did not drift only need their changed tables enforced
+            enforced = []
+            for dbInfo in to_provision:
+                tables = changed_tables(dbInfo, fingerprints)
+                if tables is None:
+                    enforced.append(dbInfo)
+                else:
+                    logger.info(
+                        f"{len(tables)}/{len(dbInfo.get("tables", []))} tables of {to_lower_snake_case(dbInfo["dbname"])} changed since the last run."
+                    )
+                    enforced.append({**dbInfo, "tables": tables})
+        provisioned = provision_databases(
+            enforced,
+            int(environ.get("MAX_CONCURRENCY", "4")),
+            online_settings,
+        )
+        success = report_results(results + provisioned)
+
+        if sync_status_enabled:
+            with phase("sync_status"):
+                sync_status.main()
+
+        with phase("auth"):
+            ensure_auth_tables()
+
+        with phase("fingerprints"):
+            save_fingerprints(
+                info_conn,
+                [
+                    row
+                    for dbInfo, enforced_dbInfo, result in zip(
+                        to_provision, enforced, provisioned
+                    )
+                    for row in database_fingerprints(dbInfo, enforced_dbInfo, result)
+                ],
+            )
+        if success:
+            with phase("fingerprints"):
+                save_fingerprint(
+                    info_conn, GLOBAL_KEY, global_hash, catalog_version(info_conn)
+                )
 
-    ensure_auth_tables()
-    ensure_admin_user()
+    with phase("auth"):
+        ensure_admin_user()
 
+    CONNECTIONS.report()
+    CONNECTIONS.close_all()
+    write_metrics(args, success)
     logger.info("Finished creating tables.")
+    if not success:
+        raise SystemExit(1)
@@ -0,0 +1,174 @@
+"""Dry runs: plan every database without changing anything.
+
+The catalogs are either read live through read-only sessions or loaded from a snapshot file (written with --save-snapshot), in which case no connection is opened at all. The result is the SQL script that a real run would execute, plus a per-object summary of the changes.
+"""
+
+import json
+import logging
+from collections import defaultdict
+from typing import List
+from psycopg import sql
+from catalog import CatalogSnapshot
+from connections import CONNECTIONS
+from planner import POST_COMMIT_STAGES, PRE_TRANSACTION_STAGES, DDLOperation, SchemaPlan
+
+logger = logging.getLogger()
+
+
+def load_snapshot_file(path: str) -> dict[str, CatalogSnapshot]:
+    """Loads the catalog snapshots saved by save_snapshot_file.
+
+    Args:
+        path (str): The snapshot file.
+
+    Returns:
+        dict[str, CatalogSnapshot]: The snapshot of every database that existed when the file was written.
+    """
+    with open(path, "r") as file:
+        data = json.load(file)
+    return {
+        database_name: CatalogSnapshot.from_dict(snapshot)
+        for database_name, snapshot in data["databases"].items()
+    }
+
+
+def save_snapshot_file(path: str, snapshots: dict[str, CatalogSnapshot]) -> None:
+    """Saves catalog snapshots so that later dry runs can work offline.
+
+    Args:
+        path (str): The snapshot file. It is overwritten.
+        snapshots (dict[str, CatalogSnapshot]): The snapshot of every existing database.
+    """
+    with open(path, "w") as file:
+        json.dump(
+            {
+                "databases": {
+                    database_name: snapshot.to_dict()
+                    for database_name, snapshot in snapshots.items()
+                }
+            },
+            file,
+            indent=1,
+            sort_keys=True,
+        )
+
+
+def capture_snapshots(database_names: List[str]) -> dict[str, CatalogSnapshot]:
+    """Loads the catalogs of the given databases through read-only sessions. Databases that do not exist are left out.
+
+    Args:
+        database_names (List[str]): The databases to snapshot.
+
+    Returns:
+        dict[str, CatalogSnapshot]: The snapshot of every existing database.
+    """
+    server_conn = CONNECTIONS.get()
+    with server_conn.cursor() as cur:
+        cur.execute(
+            "SELECT datname FROM pg_database WHERE datname = ANY(%s);",
+            (database_names,),
+        )
+        existing = {row[0] for row in cur.fetchall()}
+
+    snapshots: dict[str, CatalogSnapshot] = {}
+    for database_name in database_names:
+        if database_name not in existing:
+            continue
+        conn = CONNECTIONS.get(database_name)
+        conn.execute("SET default_transaction_read_only = on;")
+        snapshots[database_name] = CatalogSnapshot.load(conn)
+    return snapshots
+
+
+def _statement(operation: DDLOperation) -> str:
+    statements = [operation.statement]
+    if operation.cleanup is not None:
+        statements.insert(0, operation.cleanup)
+    texts = [
+        (statement if isinstance(statement, str) else statement.as_string()).strip()
+        for statement in statements
+    ]
+    return "\n".join(text if text.endswith(";") else f"{text};" for text in texts)
+
+
+def render_script(plans: List[SchemaPlan], existing: set[str]) -> str:
+    """Renders the plans as a psql script, in the order a real run would execute them.
+
+    Args:
+        plans (List[SchemaPlan]): One plan per database.
+        existing (set[str]): The databases that already exist. The others are created first.
+
+    Returns:
+        str: The SQL script.
+    """
+    lines: List[str] = []
+    for plan in plans:
+        quoted_name = sql.Identifier(plan.database_name).as_string()
+        lines.append(f"-- {plan.database_name}: {len(plan)} operations")
+        if plan.database_name not in existing:
+            lines.append(f"CREATE DATABASE {quoted_name};")
+        lines.append(f"\\connect {quoted_name}")
+        if "postgis" not in plan.catalog.extensions:
+            lines.append("CREATE EXTENSION IF NOT EXISTS postgis;")
+
+        operations = plan.ordered()
+        lines.extend(
+            _statement(op) for op in operations if op.stage in PRE_TRANSACTION_STAGES
+        )
+        in_transaction = [
+            op
+            for op in operations
+            if op.stage not in PRE_TRANSACTION_STAGES and op.stage not in POST_COMMIT_STAGES
+        ]
+        if len(in_transaction) > 0:
+            lines.append("BEGIN;")
+            lines.extend(_statement(op) for op in in_transaction)
+            lines.append("COMMIT;")
+        lines.extend(
+            _statement(op) for op in operations if op.stage in POST_COMMIT_STAGES
+        )
+        lines.append("")
+    return "\n".join(lines)
+
+
+def summarize(plan: SchemaPlan) -> List[str]:
+    """Describes the changes of the plan, grouped by table.
+
+    Args:
+        plan (SchemaPlan): The plan to describe.
+
+    Returns:
+        List[str]: One line per changed table, e.g. "db/table: create table table, add column x to table".
+    """
+    changes: dict[str, List[str]] = defaultdict(list)
+    for operation in plan.ordered():
+        changes[operation.table].append(operation.description)
+    return [
+        f"{plan.database_name}/{table_name}: {', '.join(descriptions)}"
+        for table_name, descriptions in changes.items()
+    ]
+
+
+def report_plans(plans: List[SchemaPlan], existing: set[str], output: str | None) -> None:
+    """Writes the SQL script of the plans and logs their summaries.
+
+    Args:
+        plans (List[SchemaPlan]): One plan per database.
+        existing (set[str]): The databases that already exist.
+        output (str | None): The file to write the script to. None prints it to stdout.
+    """
+    script = render_script(plans, existing)
+    if output is None:
+        print(script)
+    else:
+        with open(output, "w") as file:
+            file.write(script)
+
+    for plan in plans:
+        if plan.database_name not in existing:
+            logger.info(f"{plan.database_name}: create database")
+        for line in summarize(plan):
+            logger.info(line)
+    logger.info(
+        f"Planned {sum(len(plan) for plan in plans)} operations in {len(plans)} databases."
+    )
@@ -0,0 +1,112 @@
+"""Config fingerprints.
+
+The hash of each database's config subtree is stored in the info database together with the catalog version it produced. When both still match on the next boot, the database does not need to be enforced again. Every table's subtree is stored as well (under "database/table"), so that a database whose catalog did not drift only needs its changed tables enforced.
+"""
+
+import hashlib
+import json
+from typing import Any
+from psycopg import sql
+from psycopg.connection import Connection
+
+FINGERPRINT_TABLE = "create_tables_fingerprints"
+# key of the row that covers the whole config and the info database itself
+GLOBAL_KEY = "*"
+# bump whenever the tool starts provisioning something new, so that the next run enforces everything again
+SCHEMA_REVISION = 6
+
+
+def config_hash(config: Any) -> str:
+    """Hashes a (sub)tree of the config together with SCHEMA_REVISION. Key order and formatting of the YAML file do not affect the result.
+
+    Args:
+        config (Any): The parsed config, or any part of it.
+
+    Returns:
+        str: The sha256 hex digest of the normalized config.
+    """
+    normalized = json.dumps(
+        {"revision": SCHEMA_REVISION, "config": config},
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def table_key(database_name: str, table_name: str) -> str:
+    """The fingerprint key of a table. Database names never contain a slash."""
+    return f"{database_name}/{table_name}"
+
+
+def ensure_fingerprint_table(conn: Connection) -> None:
+    """Ensures that the fingerprint table exists.
+
+    Args:
+        conn (Connection): Connection to the info database.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {} (
+                    database_name       TEXT PRIMARY KEY,
+                    config_hash         TEXT NOT NULL,
+                    catalog_version     TEXT NOT NULL,
+                    updated_at          TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+                """).format(sql.Identifier(FINGERPRINT_TABLE))
+        )
+
+
+def load_fingerprints(conn: Connection) -> dict[str, tuple[str, str]]:
+    """Loads every stored fingerprint.
+
+    Args:
+        conn (Connection): Connection to the info database.
+
+    Returns:
+        dict[str, tuple[str, str]]: (config hash, catalog version) for every database name.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL(
+                "SELECT database_name, config_hash, catalog_version FROM {};"
+            ).format(sql.Identifier(FINGERPRINT_TABLE))
+        )
+        return {
+            database_name: (stored_hash, stored_version)
+            for database_name, stored_hash, stored_version in cur.fetchall()
+        }
+
+
+def save_fingerprint(
+    conn: Connection, database_name: str, stored_hash: str, stored_version: str
+) -> None:
+    """Stores the fingerprint of a database that was enforced successfully.
+
+    Args:
+        conn (Connection): Connection to the info database.
+        database_name (str): The database (or GLOBAL_KEY).
+        stored_hash (str): The hash of the config subtree that was enforced.
+        stored_version (str): The catalog version after enforcement.
+    """
+    save_fingerprints(conn, [(database_name, stored_hash, stored_version)])
+
+
+def save_fingerprints(conn: Connection, rows: list[tuple[str, str, str]]) -> None:
+    """Stores several fingerprints in one pipeline.
+
+    Args:
+        conn (Connection): Connection to the info database.
+        rows (list[tuple[str, str, str]]): (key, config hash, catalog version) of every database or table that was enforced successfully.
+    """
+    query = sql.SQL("""
+        INSERT INTO {} (database_name, config_hash, catalog_version) VALUES (%s, %s, %s)
+        ON CONFLICT (database_name) DO UPDATE SET
+            config_hash = EXCLUDED.config_hash,
+            catalog_version = EXCLUDED.catalog_version,
+            updated_at = now();
+        """).format(sql.Identifier(FINGERPRINT_TABLE))
+    with conn.pipeline(), conn.cursor() as cur:
+        for row in rows:
+            cur.execute(query, row)
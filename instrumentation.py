@@ -0,0 +1,197 @@
+"""Per-phase timing and statement instrumentation.
+
+Every statement executed through a CONNECTIONS cursor is recorded against the current phase (e.g. "extension" or "apply") and table, both held in context variables like the logging context. Statements sent in a pipeline are counted one by one, but their latency is only known for the pipeline as a whole, which is recorded as a single "(pipeline of N statements)" sample.
+
+The results can be written as a JSON report and as an OpenMetrics text file for node exporter's textfile collector.
+"""
+
+import heapq
+import json
+import os
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from threading import Lock
+from time import perf_counter, time
+from typing import Any, Iterator
+from log_context import DATABASE, TABLE
+
+PHASE: ContextVar[str] = ContextVar("phase", default="other")
+
+# how many of the slowest statements are kept
+SLOWEST_STATEMENTS = 20
+# statements are cut to this many characters in the report
+STATEMENT_PREVIEW = 200
+
+
+@dataclass
+class Totals:
+    statements: int = 0
+    latency: float = 0.0  # cumulative statement latency, in seconds
+    wall: float = (
+        0.0  # time spent inside the phase, summed over databases (and therefore threads)
+    )
+
+
+@dataclass(order=True)
+class Sample:
+    latency: float
+    phase: str = field(compare=False)
+    database: str | None = field(compare=False)
+    table: str | None = field(compare=False)
+    statement: str = field(compare=False)
+
+
+class Metrics:
+    """Thread-safe collector of statement and phase timings."""
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self.phases: dict[str, Totals] = defaultdict(Totals)
+        self.tables: dict[tuple[str, str], Totals] = defaultdict(Totals)
+        self.slowest: list[Sample] = []  # a min-heap of the slowest statements
+
+    def record_statement(
+        self, statement: Any, latency: float, statements: int = 1
+    ) -> None:
+        """Records executed statements against the current phase, database and table.
+
+        Args:
+            statement (Any): The statement (str or sql.Composable), or a description of several statements.
+            latency (float): How long the statement(s) took, in seconds.
+            statements (int, optional): How many statements the sample covers. Defaults to 1.
+        """
+        phase, database, table = PHASE.get(), DATABASE.get(), TABLE.get()
+        with self._lock:
+            totals = self.phases[phase]
+            totals.statements += statements
+            totals.latency += latency
+            if table is not None:
+                totals = self.tables[(database, table)]
+                totals.statements += statements
+                totals.latency += latency
+
+            if latency > 0 and (
+                len(self.slowest) < SLOWEST_STATEMENTS
+                or latency > self.slowest[0].latency
+            ):
+                sample = Sample(latency, phase, database, table, _preview(statement))
+                if len(self.slowest) < SLOWEST_STATEMENTS:
+                    heapq.heappush(self.slowest, sample)
+                else:
+                    heapq.heapreplace(self.slowest, sample)
+
+    def record_phase(self, phase: str, wall: float) -> None:
+        with self._lock:
+            self.phases[phase].wall += wall
+
+    def report(self, extra: dict[str, Any] | None = None) -> dict[str, Any]:
+        """Builds the JSON report.
+
+        Args:
+            extra (dict[str, Any] | None, optional): Additional top-level entries, e.g. connection counts. Defaults to None.
+
+        Returns:
+            dict[str, Any]: The report.
+        """
+        with self._lock:
+            return {
+                **(extra or {}),
+                "phases": {
+                    name: asdict(totals) for name, totals in self.phases.items()
+                },
+                "tables": [
+                    {"database": database, "table": table, **asdict(totals)}
+                    for (database, table), totals in sorted(self.tables.items())
+                ],
+                "slowest_statements": [
+                    asdict(sample) for sample in sorted(self.slowest, reverse=True)
+                ],
+            }
+
+    def write_json(self, path: str, extra: dict[str, Any] | None = None) -> None:
+        _write_atomically(path, json.dumps(self.report(extra), indent=1))
+
+    def write_openmetrics(self, path: str, gauges: dict[str, float]) -> None:
+        """Writes the per-phase totals and the given gauges in the OpenMetrics text format. Per-table totals are left out to keep the cardinality low.
+
+        Args:
+            path (str): The file to write, e.g. a *.prom file in node exporter's textfile directory. It is replaced atomically.
+            gauges (dict[str, float]): Additional unlabeled gauges, by metric name.
+        """
+        lines: list[str] = []
+        with self._lock:
+            phases = dict(self.phases)
+        for name, attribute, help_text in (
+            (
+                "create_tables_phase_statements",
+                "statements",
+                "Statements executed in the phase.",
+            ),
+            (
+                "create_tables_phase_statement_seconds",
+                "latency",
+                "Cumulative statement latency in the phase.",
+            ),
+            (
+                "create_tables_phase_seconds",
+                "wall",
+                "Time spent in the phase, summed over databases.",
+            ),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for phase, totals in sorted(phases.items()):
+                lines.append(f'{name}{{phase="{phase}"}} {getattr(totals, attribute)}')
+        for name, value in {
+            **gauges,
+            "create_tables_last_run_timestamp_seconds": time(),
+        }.items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        lines.append("# EOF")
+        _write_atomically(path, "\n".join(lines) + "\n")
+
+
+def _preview(statement: Any) -> str:
+    text = statement if isinstance(statement, str) else statement.as_string()
+    text = " ".join(text.split())
+    return (
+        text
+        if len(text) <= STATEMENT_PREVIEW
+        else text[: STATEMENT_PREVIEW - 3] + "..."
+    )
+
+
+def _write_atomically(path: str, content: str) -> None:
+    # the textfile collector must never see a half-written file
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        file.write(content)
+    os.replace(temporary, path)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Attributes the statements executed in the block to the phase, and records the time spent in it."""
+    token = PHASE.set(name)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.record_phase(name, perf_counter() - start)
+        PHASE.reset(token)
+
+
+@contextmanager
+def for_table(name: str | None) -> Iterator[None]:
+    """Attributes the statements executed (and the records logged) in the block to the table."""
+    token = TABLE.set(name)
+    try:
+        yield
+    finally:
+        TABLE.reset(token)
+
+
+METRICS = Metrics()
@@ -0,0 +1,25 @@
+"""Per-task logging context.
+
+Provisioning runs one database per worker thread, so log records are tagged with the database (and table) they belong to through context variables rather than by threading names through every function.
+"""
+
+import logging
+from contextvars import ContextVar
+
+DATABASE: ContextVar[str | None] = ContextVar("database", default=None)
+TABLE: ContextVar[str | None] = ContextVar("table", default=None)
+
+
+class ContextFilter(logging.Filter):
+    """Adds the current logging context to every record as `record.database`, `record.table` and `record.column`.
+
+    `table` and `column` may also be passed per call through `extra`, which takes precedence. Context that is not set is None.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.database = DATABASE.get()
+        if not hasattr(record, "table"):
+            record.table = TABLE.get()
+        if not hasattr(record, "column"):
+            record.column = None
+        return True
@@ -0,0 +1,145 @@
+"""Logging configuration.
+
+Records are put on a queue by the threads that log them and written by a QueueListener thread, so file I/O never blocks provisioning. The context (database, table) is captured by a filter on the queue handler, i.e. in the logging thread, before the record crosses threads. Exceptions are formatted by the listener's formatters, so that the JSON format can put them in their own field.
+
+Settings (the command line takes precedence over the environment):
+
+- LOG_LEVEL / --log-level: the verbosity of the console and the log file. Defaults to INFO. The debug log file is only written at DEBUG.
+- LOG_FORMAT / --log-format: "text" or "json" (one JSON object per line, with database, table and column fields). Defaults to text.
+- LOG_DIRECTORY: where the log files go. An empty value disables the log files.
+"""
+
+import atexit
+import copy
+import json
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from os import environ
+from queue import SimpleQueue
+from typing import Literal
+from log_context import ContextFilter
+
+LogFormat = Literal["text", "json"]
+LOG_FORMATS: tuple[LogFormat, ...] = ("text", "json")
+DEFAULT_LOG_DIRECTORY = "/var/log/Wywy-Website/create_tables"
+
+_listener: QueueListener | None = None
+
+
+class _QueueHandler(QueueHandler):
+    """A QueueHandler that leaves the formatting of the exception to the listener's handlers.
+
+    QueueHandler.prepare() merges the traceback into the message and drops exc_info. Here, the traceback is only rendered into exc_text (tracebacks cannot cross the queue safely) and the record keeps exc_info as (type, value, None), so that formatters see that there was an exception.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if record.exc_text is None:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = (record.exc_info[0], record.exc_info[1], None)
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats every record as a single line of JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "database": getattr(record, "database", None),
+            "table": getattr(record, "table", None),
+            "column": getattr(record, "column", None),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _TextFormatter(logging.Formatter):
+    """The text format, which shows a record without a database as [-]."""
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        if getattr(record, "database", None) is None:
+            record = copy.copy(record)
+            record.database = "-"
+        return super().formatMessage(record)
+
+
+def _formatters(log_format: LogFormat) -> tuple[logging.Formatter, logging.Formatter]:
+    """Returns the simple and the verbose formatter for the format."""
+    if log_format == "json":
+        return JsonFormatter(), JsonFormatter()
+    return (
+        _TextFormatter("{levelname} [{database}] {message}", style="{"),
+        _TextFormatter(
+            "{levelname} {asctime} {module} {process:d} {thread:d} [{database}] {message}",
+            style="{",
+        ),
+    )
+
+
+def configure_logging(
+    level: str | None = None, log_format: str | None = None
+) -> None:
+    """Configures the root logger. Call it once, as early as possible.
+
+    Args:
+        level (str | None, optional): The verbosity, e.g. "DEBUG". None reads LOG_LEVEL. Defaults to None.
+        log_format (str | None, optional): "text" or "json". None reads LOG_FORMAT. Defaults to None.
+
+    Raises:
+        RuntimeError: When the level or the format is unknown.
+    """
+    global _listener
+
+    level = (level or environ.get("LOG_LEVEL", "INFO")).upper()
+    numeric_level = logging.getLevelNamesMapping().get(level)
+    if numeric_level is None:
+        raise RuntimeError(f"Unknown log level {level}.")
+    log_format = (log_format or environ.get("LOG_FORMAT", "text")).lower()
+    if log_format not in LOG_FORMATS:
+        raise RuntimeError(f"Unknown log format {log_format}. Expected one of {LOG_FORMATS}.")
+    simple_formatter, verbose_formatter = _formatters(log_format)  # type: ignore
+
+    handlers: list[logging.Handler] = []
+    console_handler = logging.StreamHandler()
+    # DEBUG records only go to the debug log file
+    console_handler.setLevel(max(numeric_level, logging.INFO))
+    console_handler.setFormatter(simple_formatter)
+    handlers.append(console_handler)
+
+    log_directory = environ.get("LOG_DIRECTORY", DEFAULT_LOG_DIRECTORY)
+    if len(log_directory) > 0:
+        file_handler = logging.FileHandler(f"{log_directory}/create_tables.log")
+        file_handler.setLevel(console_handler.level)
+        file_handler.setFormatter(simple_formatter)
+        handlers.append(file_handler)
+        if numeric_level <= logging.DEBUG:
+            debug_file_handler = logging.FileHandler(
+                f"{log_directory}/create_tables-debug.log"
+            )
+            debug_file_handler.setLevel(logging.DEBUG)
+            debug_file_handler.setFormatter(verbose_formatter)
+            handlers.append(debug_file_handler)
+
+    queue: SimpleQueue[logging.LogRecord] = SimpleQueue()
+    queue_handler = _QueueHandler(queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(numeric_level)
+    root.addHandler(queue_handler)
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
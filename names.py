@@ -0,0 +1,298 @@
+"""Name normalization.
+
+Config names are normalized once and cached, since the same table and column names are normalized over and over while planning. NameTable maps every config name of a database to the identifiers it produces (including generated tables, types, columns, constraints and indexes) and detects collisions between them. The planner reads its identifiers from the same table, and builds generated names with the helpers below, so validation checks exactly the names that will be created.
+"""
+
+import hashlib
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Iterator
+from constants import (
+    GEODETIC_COLUMN_SUFFIXES,
+    GEOMETRY_COLUMN_SUFFIX,
+    RESERVED_TABLE_SUFFIXES,
+    SPATIAL_INDEX_METHODS,
+    TAGGING_INDEXES,
+)
+
+# PostgreSQL silently truncates longer identifiers (NAMEDATALEN - 1 bytes)
+MAX_IDENTIFIER_LENGTH = 63
+# hex digits of the hash that ends generated identifiers that had to be shortened
+_IDENTIFIER_HASH_LENGTH = 8
+
+_SEPARATORS = re.compile(r"[\.\ \-]")
+
+
+@lru_cache(maxsize=16384)
+def to_snake_case(target: str) -> str:
+    """Attempts to convert from regular words/sentences to snake_case. This will not affect strings already in underscore notation. (Does not work with camelCase)
+    @param target
+    @return Returns underscore notation string. e.g. "hi I am Wywy" -> "hi_I_am_Wywy"
+    """
+    return _SEPARATORS.sub("_", target)
+
+
+@lru_cache(maxsize=16384)
+def to_lower_snake_case(target: str) -> str:
+    """Attempts to convert from regular words/sentences to lower_snake_case. This will not affect strings already in underscore notation. (Does not work with camelCase)
+    @param target
+    @return Returns lower_snake_case string. e.g. "hi I am Wywy" -> "hi_i_am_wywy"
+    """
+    return _SEPARATORS.sub("_", target).lower()
+
+
+def truncate_identifier(identifier: str) -> str:
+    """Returns the identifier as PostgreSQL stores it, i.e. cut to MAX_IDENTIFIER_LENGTH bytes."""
+    return identifier.encode()[:MAX_IDENTIFIER_LENGTH].decode(errors="ignore")
+
+
+@lru_cache(maxsize=16384)
+def generated_identifier(*parts: str) -> str:
+    """Joins the parts of a generated identifier (e.g. of a constraint) with underscores. Identifiers that PostgreSQL would truncate are shortened and end with a hash of the full identifier instead, so that two long ones never end up with the same name, and the name in the catalog is the one we asked for.
+
+    Returns:
+        str: The identifier, at most MAX_IDENTIFIER_LENGTH bytes long. e.g. ("things", "title", "unique") -> "things_title_unique"
+    """
+    identifier = "_".join(parts)
+    encoded = identifier.encode()
+    if len(encoded) <= MAX_IDENTIFIER_LENGTH:
+        return identifier
+    digest = hashlib.sha1(encoded).hexdigest()[:_IDENTIFIER_HASH_LENGTH]
+    prefix = encoded[: MAX_IDENTIFIER_LENGTH - _IDENTIFIER_HASH_LENGTH - 1]
+    return f"{prefix.decode(errors='ignore')}_{digest}"
+
+
+def generated_enum_name(table_name: str, column_name: str) -> str:
+    return generated_identifier(table_name, column_name, "enum")
+
+
+def generated_constraint_name(table_name: str, column_name: str, kind: str) -> str:
+    """The name of the constraint of the given kind (unique, not_null or fkey) on a column."""
+    return generated_identifier(table_name, column_name, kind)
+
+
+def generated_index_name(table_name: str, *parts: str) -> str:
+    """The name of an index the config does not name, e.g. ("things", "title", "hash") -> "things_title_hash_idx"."""
+    return generated_identifier(table_name, *parts, "idx")
+
+
+def spatial_index_method(column: dict) -> str | None:
+    """The index method of a geodetic point column ("spatialIndex", "gist" by default), or None if it is not indexed."""
+    method = column.get("spatialIndex", "gist")
+    return None if method is False else str(method).lower()
+
+
+@dataclass
+class Collision:
+    identifier: str
+    first: str  # the config path that produced the identifier first
+    second: str
+
+    def __str__(self) -> str:
+        return f"Collides with {self.first}: both map to {self.identifier}."
+
+
+@dataclass
+class Namespace:
+    """Identifiers that must be unique among each other, e.g. the relations and types of a schema or the columns of a table."""
+
+    owners: dict[str, str] = field(default_factory=dict)  # identifier -> config path
+    collisions: list[Collision] = field(default_factory=list)
+
+    def register(self, identifier: str, path: str) -> str:
+        # compare what PostgreSQL will actually store
+        stored = truncate_identifier(identifier)
+        owner = self.owners.setdefault(stored, path)
+        if owner != path:
+            self.collisions.append(Collision(stored, owner, path))
+        return identifier
+
+
+class NameTable:
+    """The identifiers of one database, built once from its config entry.
+
+    Tables share a namespace with types (every table has a row type of the same name) and indexes, so tables, generated tables, enum types, indexes and unique constraints (which are backed by an index of the same name) are registered together. Every table has its own column namespace and constraint namespace.
+    """
+
+    def __init__(self) -> None:
+        self.identifiers: dict[str, str] = {}  # config name -> normalized identifier
+        self.relations = Namespace()
+        self.columns: dict[str, Namespace] = {}
+        self.constraints: dict[str, Namespace] = {}
+
+    def normalize(self, name: str) -> str:
+        identifier = self.identifiers.get(name)
+        if identifier is None:
+            identifier = self.identifiers[name] = to_lower_snake_case(name)
+        return identifier
+
+    @classmethod
+    def build(cls, database: dict, path: str = "") -> "NameTable":
+        """Builds the name table of a database config entry. The entry is assumed to be well-formed apart from its names.
+
+        Args:
+            database (dict): The config entry of the database.
+            path (str, optional): The config path of the entry, used in collisions. Defaults to "".
+
+        Returns:
+            NameTable: The populated name table.
+        """
+        table = cls()
+        for i, table_schema in enumerate(database.get("tables", [])):
+            table_path = f"{path}.tables[{i}]"
+            table_name = table.add_table(
+                table.normalize(table_schema["tableName"]),
+                f"{table_path}.tableName",
+                table_schema.get("schema", []),
+                table_path,
+                table_schema.get("indexes", []),
+            )
+            if table_schema.get("tagging", False):
+                for suffix in RESERVED_TABLE_SUFFIXES:
+                    if suffix != "descriptors":
+                        table.relations.register(
+                            f"{table_name}_{suffix}", f"{table_path}.tagging"
+                        )
+                table.relations.register(
+                    generated_index_name(table_name, "primary_tag"),
+                    f"{table_path}.tagging",
+                )
+                for indexes in TAGGING_INDEXES.values():
+                    for suffix, _, _ in indexes:
+                        table.relations.register(
+                            generated_identifier(table_name, suffix),
+                            f"{table_path}.tagging",
+                        )
+            for j, descriptor in enumerate(table_schema.get("descriptors", [])):
+                descriptor_path = f"{table_path}.descriptors[{j}]"
+                table.add_table(
+                    table.descriptor_table_name(table_name, descriptor["name"]),
+                    f"{descriptor_path}.name",
+                    descriptor.get("schema", []),
+                    descriptor_path,
+                    descriptor.get("indexes", []),
+                )
+        return table
+
+    def table(self, name: str) -> str | None:
+        """The identifier of the table (or descriptor table) of the database with the given config name, or None if there is none."""
+        identifier = self.normalize(name)
+        return identifier if identifier in self.columns else None
+
+    def descriptor_table_name(self, table_name: str, descriptor_name: str) -> str:
+        """The identifier of the table of a descriptor of the given table."""
+        return f"{table_name}_{self.normalize(descriptor_name)}_descriptors"
+
+    def column_namespace(self, table_name: str) -> Namespace:
+        return self.columns.setdefault(table_name, Namespace())
+
+    def constraint_namespace(self, table_name: str) -> Namespace:
+        return self.constraints.setdefault(table_name, Namespace())
+
+    def add_table(
+        self,
+        table_name: str,
+        name_path: str,
+        columns: list,
+        schema_path: str,
+        indexes: list | None = None,
+    ) -> str:
+        """Registers a table, its enum types, its columns (including the generated ones) and the constraints and indexes generated for them.
+
+        Args:
+            table_name (str): The identifier of the table.
+            name_path (str): The config path of the table's name.
+            columns (list): The column schemas of the table.
+            schema_path (str): The config path of the table or descriptor the columns belong to.
+            indexes (list | None, optional): The "indexes" entries of the table or descriptor. Defaults to None.
+
+        Returns:
+            str: The identifier of the table.
+        """
+        if table_name in self.columns:
+            # a collision; its columns would only repeat it
+            self.relations.register(table_name, name_path)
+            return table_name
+        self.relations.register(table_name, name_path)
+        namespace = self.column_namespace(table_name)
+        constraints = self.constraint_namespace(table_name)
+        for k, column in enumerate(columns):
+            column_path = f"{schema_path}.schema[{k}].name"
+            column_name = namespace.register(
+                self.normalize(column["name"]), column_path
+            )
+            for generated in generated_columns(column_name, column):
+                namespace.register(generated, column_path)
+            if column.get("datatype") == "enum":
+                self.relations.register(
+                    generated_enum_name(table_name, column_name), column_path
+                )
+            for constraint in _generated_constraints(table_name, column_name, column):
+                constraints.register(constraint, column_path)
+            if column.get("unique", False):
+                self.relations.register(
+                    generated_constraint_name(table_name, column_name, "unique"),
+                    column_path,
+                )
+            for index in _generated_indexes(table_name, column_name, column):
+                self.relations.register(index, column_path)
+
+        for k, index in enumerate(indexes or []):
+            name = index.get("name") or generated_index_name(
+                table_name,
+                *map(self.normalize, index["columns"]),
+                str(index.get("method", "btree")).lower(),
+            )
+            self.relations.register(name, f"{schema_path}.indexes[{k}]")
+        return table_name
+
+    @property
+    def collisions(self) -> list[Collision]:
+        return self.relations.collisions + [
+            collision
+            for namespaces in (self.columns, self.constraints)
+            for namespace in namespaces.values()
+            for collision in namespace.collisions
+        ]
+
+
+def generated_columns(column_name: str, column: dict) -> Iterator[str]:
+    """The extra columns the planner adds for a config column."""
+    if column.get("datatype") == "geodetic point":
+        for suffix in GEODETIC_COLUMN_SUFFIXES:
+            yield f"{column_name}_{suffix}"
+        if column.get("geometry", False):
+            yield f"{column_name}_{GEOMETRY_COLUMN_SUFFIX}"
+    elif column.get("datatype") in ("polymorphic pointer", "polypointer"):
+        yield f"{column_name}_type"
+    if column.get("comments", False):
+        yield f"{column_name}_comments"
+
+
+def _generated_constraints(
+    table_name: str, column_name: str, column: dict
+) -> Iterator[str]:
+    """The constraints the planner adds for a config column."""
+    if column.get("unique", False):
+        yield generated_constraint_name(table_name, column_name, "unique")
+    if not column.get("optional", True):
+        yield generated_constraint_name(table_name, column_name, "not_null")
+    if column.get("datatype") == "pointer":
+        yield generated_constraint_name(table_name, column_name, "fkey")
+
+
+def _generated_indexes(
+    table_name: str, column_name: str, column: dict
+) -> Iterator[str]:
+    """The indexes the planner adds for a config column."""
+    if column.get("datatype") == "pointer":
+        yield generated_index_name(table_name, column_name)
+    elif column.get("datatype") == "geodetic point":
+        method = spatial_index_method(column)
+        if method in SPATIAL_INDEX_METHODS:
+            yield generated_index_name(table_name, column_name, method)
+            if column.get("geometry", False):
+                yield generated_index_name(
+                    table_name, f"{column_name}_{GEOMETRY_COLUMN_SUFFIX}", method
+                )
@@ -0,0 +1,100 @@
+"""Settings and helpers for online (lock-aware) migrations.
+
+In online mode, statements run with a lock_timeout so that a migration waiting for a lock never queues the website's queries behind it. Statements that time out are retried with exponential backoff.
+"""
+
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass
+from os import environ
+from time import perf_counter, sleep
+from typing import Callable, Iterator
+from psycopg import errors, sql
+from psycopg.connection import Connection
+
+logger = logging.getLogger()
+
+
+@dataclass(frozen=True)
+class OnlineSettings:
+    lock_timeout: str = "5s"
+    statement_timeout: str = "0"  # 0 disables the timeout
+    retries: int = 5
+    backoff: float = 0.5  # seconds before the first retry, doubled on every retry
+    # type changes of tables with at least this many (estimated) rows go through a shadow column
+    shadow_column_rows: int = 100000
+
+    @classmethod
+    def from_environ(cls) -> "OnlineSettings":
+        """Reads the settings from the LOCK_TIMEOUT, STATEMENT_TIMEOUT, LOCK_RETRIES, LOCK_RETRY_BACKOFF and SHADOW_COLUMN_ROWS environment variables."""
+        return cls(
+            environ.get("LOCK_TIMEOUT", cls.lock_timeout),
+            environ.get("STATEMENT_TIMEOUT", cls.statement_timeout),
+            int(environ.get("LOCK_RETRIES", cls.retries)),
+            float(environ.get("LOCK_RETRY_BACKOFF", cls.backoff)),
+            int(environ.get("SHADOW_COLUMN_ROWS", cls.shadow_column_rows)),
+        )
+
+
+@contextmanager
+def session_timeouts(conn: Connection, settings: OnlineSettings) -> Iterator[None]:
+    """Sets lock_timeout and statement_timeout on the session for the duration of the block.
+
+    Args:
+        conn (Connection): The connection to configure. It must not be inside a transaction.
+        settings (OnlineSettings): The timeouts to use.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("SET lock_timeout = {};").format(sql.Literal(settings.lock_timeout))
+        )
+        cur.execute(
+            sql.SQL("SET statement_timeout = {};").format(
+                sql.Literal(settings.statement_timeout)
+            )
+        )
+    try:
+        yield
+    finally:
+        if not conn.closed and not conn.broken:
+            with conn.cursor() as cur:
+                cur.execute("RESET lock_timeout;")
+                cur.execute("RESET statement_timeout;")
+
+
+def _is_lock_timeout(error: BaseException) -> bool:
+    while error is not None:
+        if isinstance(error, errors.LockNotAvailable):
+            return True
+        error = error.__cause__  # type: ignore
+    return False
+
+
+def run_with_retry(
+    settings: OnlineSettings, description: str, attempt: Callable[[], None]
+) -> float:
+    """Runs the attempt, retrying with exponential backoff while it fails on lock_timeout.
+
+    Args:
+        settings (OnlineSettings): The retry settings.
+        description (str): What the attempt does, for logging.
+        attempt (Callable[[], None]): Runs the statement(s). It must be safe to run again after a lock timeout.
+
+    Returns:
+        float: How long the successful attempt took, in seconds. Locks are held for at most this long.
+    """
+    delay = settings.backoff
+    for retry in range(settings.retries + 1):
+        start = perf_counter()
+        try:
+            attempt()
+            return perf_counter() - start
+        except Exception as e:
+            if retry == settings.retries or not _is_lock_timeout(e):
+                raise
+            logger.warning(
+                f"Timed out waiting for a lock to {description}. Retrying in {delay:.1f}s ({retry + 1}/{settings.retries})."
+            )
+            sleep(delay)
+            delay *= 2
+    raise AssertionError("unreachable")
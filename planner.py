@@ -0,0 +1,1631 @@
+"""Schema diff planner.
+
+Compares the config against a catalog snapshot and produces the DDL needed to make the database match, without touching the database. The plan is applied afterwards as one pipelined transaction per database.
+"""
+
+import hashlib
+import logging
+import re
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from graphlib import TopologicalSorter
+from typing import List, Literal
+import psycopg
+from psycopg import sql
+from psycopg.connection import Connection
+from Wywy_Website_Types import TableInfo, DataColumn
+from backfill import Backfill, BackfillSettings, Checkpoints
+from batch import BatchError, execute_batch
+from catalog import CatalogSnapshot, ConstraintInfo, IndexInfo
+from constants import (
+    GEODETIC_COLUMN_SUFFIXES,
+    GEOMETRY_COLUMN_SUFFIX,
+    PSQLDATATYPES,
+    SHADOW_COLUMN_SUFFIX,
+    SPATIAL_INDEX_METHODS,
+    TAGGING_INDEXES,
+)
+from instrumentation import for_table
+from online import OnlineSettings, run_with_retry, session_timeouts
+from names import (
+    NameTable,
+    generated_constraint_name,
+    generated_enum_name,
+    generated_identifier,
+    generated_index_name,
+    spatial_index_method,
+)
+
+logger = logging.getLogger()
+
+Stage = Literal[
+    "label",
+    "check",
+    "type",
+    "table",
+    "column",
+    "constraint",
+    "index",
+    "concurrent",
+    "backfill",
+    "swap",
+    "attach",
+    "validate",
+]
+# operations are applied stage by stage, in this order
+STAGES: tuple[Stage, ...] = (
+    "label",
+    "check",
+    "type",
+    "table",
+    "column",
+    "constraint",
+    "index",
+    "concurrent",
+    "backfill",
+    "swap",
+    "attach",
+    "validate",
+)
+# these stages run before the rest of the plan, one statement at a time.
+# a label added with ALTER TYPE ... ADD VALUE cannot be used (e.g. as a default) in the transaction that added it, so it is committed first.
+# checks scan existing rows, which must not happen under the locks the transaction takes, and fail the run before anything changed.
+PRE_TRANSACTION_STAGES: tuple[Stage, ...] = ("label", "check")
+# these stages run after the rest of the plan has been committed, one statement at a time.
+# concurrent operations (CREATE INDEX CONCURRENTLY) cannot run inside a transaction at all, and backfills commit batch by batch.
+POST_COMMIT_STAGES: tuple[Stage, ...] = (
+    "concurrent",
+    "backfill",
+    "swap",
+    "attach",
+    "validate",
+)
+
+
+@dataclass
+class DDLOperation:
+    stage: Stage
+    statement: sql.Composable
+    table: str
+    description: str
+    column: str | None = None  # the config name of the column that caused this operation
+    creates: str | None = None  # the table created by this operation
+    depends_on: tuple[str, ...] = ()  # tables that must exist before this operation runs
+    backfill: Backfill | None = None  # run instead of the statement, which then only describes it
+    cleanup: sql.Composable | None = None  # runs before every attempt, e.g. to drop the invalid index a timed out CREATE INDEX CONCURRENTLY left behind
+
+
+class SchemaPlan:
+    """The DDL operations needed to bring one database in line with the config.
+
+    Planning updates the catalog snapshot as operations are added, so later checks see the planned state.
+    """
+
+    def __init__(
+        self,
+        database_name: str,
+        catalog: CatalogSnapshot,
+        online: OnlineSettings | None = None,
+        backfill: BackfillSettings | None = None,
+        names: NameTable | None = None,
+    ) -> None:
+        """
+        Args:
+            database_name (str): The database the plan is for.
+            catalog (CatalogSnapshot): The catalog snapshot of that database.
+            online (OnlineSettings | None, optional): Plan and apply online (lock-aware) migrations for existing tables with these settings. Defaults to None.
+            backfill (BackfillSettings | None, optional): The settings of the plan's backfills. None reads them from the environment. Defaults to None.
+            names (NameTable | None, optional): The name table of the database's config entry. None normalizes names as they come. Defaults to None.
+        """
+        self.database_name = database_name
+        self.catalog = catalog
+        self.names = names or NameTable()
+        self.online = online
+        self.backfill = backfill or BackfillSettings.from_environ()
+        self.operations: List[DDLOperation] = []
+        self._created_tables: set[str] = set()
+        # (table, column) of the columns added along with their default, which therefore hold no NULLs
+        self._defaulted_columns: set[tuple[str, str]] = set()
+        # set when applying the plan leaves work for the next run, e.g. constraints dropped along with a swapped column
+        self.needs_rerun = False
+
+    def add(self, operation: DDLOperation) -> None:
+        self.operations.append(operation)
+        if operation.creates is not None:
+            self._created_tables.add(operation.creates)
+
+    def is_online(self, table_name: str) -> bool:
+        """Whether changes to the table should be made online: only existing tables can be locked by the website."""
+        return self.online is not None and table_name not in self._created_tables
+
+    def __len__(self) -> int:
+        return len(self.operations)
+
+    def ordered(self) -> List[DDLOperation]:
+        """Returns the operations in the order they must be applied.
+
+        Operations run stage by stage. Table creations are additionally sorted by their foreign key dependencies (e.g. _tag_names before _tags); everything else keeps the order it was planned in.
+        """
+        created = {op.creates for op in self.operations if op.creates is not None}
+        sorter: TopologicalSorter[str] = TopologicalSorter()
+        for op in self.operations:
+            if op.creates is not None:
+                sorter.add(
+                    op.creates,
+                    *(
+                        dependency
+                        for dependency in op.depends_on
+                        if dependency in created and dependency != op.creates
+                    ),
+                )
+        table_rank = {name: i for i, name in enumerate(sorter.static_order())}
+
+        return sorted(
+            self.operations,
+            key=lambda op: (
+                STAGES.index(op.stage),
+                table_rank.get(op.creates, 0) if op.creates is not None else 0,
+            ),
+        )
+
+
+def apply_plan(
+    conn: Connection, plan: SchemaPlan, checkpoints: Checkpoints | None = None
+) -> None:
+    """Applies the plan as a single pipelined transaction, preceded by the new enum labels and followed by the post-commit operations. Does nothing if the plan is empty.
+
+    In online mode, every step runs with the plan's lock and statement timeouts and is retried with backoff when it times out waiting for a lock. How long each step held its locks is logged.
+
+    Args:
+        conn (Connection): Connection to the database the plan was made for.
+        plan (SchemaPlan): The plan to apply.
+        checkpoints (Checkpoints | None, optional): Where the plan's backfills checkpoint their progress. Defaults to None.
+
+    Raises:
+        RuntimeError: When an operation fails. The message names the config column that caused it, if any.
+    """
+    if len(plan) == 0:
+        return
+
+    operations = plan.ordered()
+    in_transaction = [
+        op
+        for op in operations
+        if op.stage not in PRE_TRANSACTION_STAGES and op.stage not in POST_COMMIT_STAGES
+    ]
+    settings = plan.online or OnlineSettings(lock_timeout="0", retries=0)
+    log_lock_time = logger.info if plan.online is not None else logger.debug
+
+    def attempt(operation: DDLOperation) -> None:
+        if operation.cleanup is not None:
+            conn.execute(operation.cleanup)
+        conn.execute(operation.statement)
+
+    def apply_alone(operation: DDLOperation) -> None:
+        try:
+            with for_table(operation.table):
+                held = run_with_retry(
+                    settings,
+                    operation.description,
+                    (
+                        partial(operation.backfill.run, conn, checkpoints)
+                        if operation.backfill is not None
+                        else partial(attempt, operation)
+                    ),
+                )
+        except psycopg.Error as e:
+            if operation.stage != "validate":
+                raise RuntimeError(
+                    f"Config {_source(plan, operation)}: Failed to {operation.description}: {e}"
+                ) from e
+            # validating only takes a SHARE UPDATE EXCLUSIVE lock, so it does not block reads and writes.
+            # a failed validation leaves the constraint NOT VALID (old rows are kept as they are) and is retried on the next run.
+            logger.warning(
+                f"Config {_source(plan, operation)}: Failed to {operation.description}: {e}"
+            )
+            return
+        log_lock_time(f"Held locks for {held:.3f}s: {operation.description}.")
+
+    with session_timeouts(conn, settings) if plan.online is not None else nullcontext():
+        # the labels stay if the transaction fails, which is harmless: ADD VALUE IF NOT EXISTS skips them next time
+        for operation in operations:
+            if operation.stage in PRE_TRANSACTION_STAGES:
+                apply_alone(operation)
+
+        if len(in_transaction) > 0:
+            try:
+                held = run_with_retry(
+                    settings,
+                    f"apply {len(in_transaction)} operations to {plan.database_name}",
+                    lambda: execute_batch(conn, in_transaction),
+                )
+            except BatchError as e:
+                raise RuntimeError(f"Config {_source(plan, e.item)}: {e}") from e  # type: ignore
+            log_lock_time(
+                f"Held locks for {held:.3f}s: {len(in_transaction)} operations in one transaction."
+            )
+
+        for operation in operations:
+            if operation.stage in POST_COMMIT_STAGES:
+                apply_alone(operation)
+
+
+def _source(plan: SchemaPlan, operation: DDLOperation) -> str:
+    """Describes where in the config the operation comes from, e.g. "database/table/column"."""
+    source = f"{plan.database_name}/{operation.table}"
+    if operation.column is not None:
+        source += f"/{operation.column}"
+    return source
+
+
+def _plan_create_table(
+    plan: SchemaPlan,
+    table_name: str,
+    statement: sql.Composable,
+    depends_on: tuple[str, ...] = (),
+    has_id: bool = True,
+) -> None:
+    plan.add(
+        DDLOperation(
+            "table",
+            statement,
+            table_name,
+            f"create table {table_name}",
+            creates=table_name,
+            depends_on=depends_on,
+        )
+    )
+    plan.catalog.add_table(table_name)
+    if has_id:
+        plan.catalog.add_column(table_name, "id", "integer", not_null=True)
+
+
+def _plan_add_columns(
+    plan: SchemaPlan,
+    table_name: str,
+    config_name: str,
+    columns: List[tuple[str, sql.Composable, str]],
+    depends_on: tuple[str, ...] = (),
+) -> None:
+    """Plans a single ALTER TABLE that adds every given (name, datatype SQL, format_type datatype) column."""
+    plan.add(
+        DDLOperation(
+            "column",
+            sql.SQL("ALTER TABLE {} {};").format(
+                sql.Identifier(table_name),
+                sql.SQL(", ").join(
+                    sql.SQL("ADD COLUMN {} {}").format(sql.Identifier(name), datatype)
+                    for name, datatype, _ in columns
+                ),
+            ),
+            table_name,
+            f"add column{'s' if len(columns) > 1 else ''} {', '.join(name for name, _, _ in columns)} to {table_name}",
+            column=config_name,
+            depends_on=depends_on,
+        )
+    )
+    for name, _, datatype in columns:
+        plan.catalog.add_column(table_name, name, datatype)
+
+
+def _plan_foreign_key(
+    plan: SchemaPlan,
+    table_name: str,
+    column_name: str,
+    constraint_name: str,
+    foreign_table_name: str,
+    config_name: str,
+) -> None:
+    """Plans a foreign key from the column to foreign_table_name(id). Online, it is added NOT VALID and validated after the plan commits."""
+    online = plan.is_online(table_name)
+    plan.add(
+        DDLOperation(
+            "constraint",
+            sql.SQL(
+                "ALTER TABLE {} ADD CONSTRAINT {} FOREIGN KEY ({}) REFERENCES {}(id){};"
+            ).format(
+                sql.Identifier(table_name),
+                sql.Identifier(constraint_name),
+                sql.Identifier(column_name),
+                sql.Identifier(foreign_table_name),
+                sql.SQL(" NOT VALID" if online else ""),
+            ),
+            table_name,
+            f"add foreign key {table_name}.{column_name} -> {foreign_table_name}",
+            column=config_name,
+            depends_on=(foreign_table_name,),
+        )
+    )
+    plan.catalog.add_constraint(
+        table_name,
+        ConstraintInfo(
+            constraint_name,
+            "f",
+            f"FOREIGN KEY ({column_name}) REFERENCES {foreign_table_name}(id)",
+            (column_name,),
+            validated=not online,
+        ),
+    )
+    if online:
+        plan.add(
+            DDLOperation(
+                "validate",
+                sql.SQL("ALTER TABLE {} VALIDATE CONSTRAINT {};").format(
+                    sql.Identifier(table_name), sql.Identifier(constraint_name)
+                ),
+                table_name,
+                f"validate constraint {constraint_name}",
+                column=config_name,
+            )
+        )
+
+
+def plan_table(plan: SchemaPlan, table_name: str) -> None:
+    """Plans the creation of the table itself if necessary (only the id column)."""
+    if not plan.catalog.table_exists(table_name):
+        _plan_create_table(
+            plan,
+            table_name,
+            sql.SQL("CREATE TABLE {} (id SERIAL PRIMARY KEY);").format(
+                sql.Identifier(table_name)
+            ),
+        )
+
+
+@dataclass
+class EnumChanges:
+    statements: List[tuple[sql.Composable, str]]  # (statement, description)
+    labels: List[str]  # the labels of the type once the statements ran
+    removed: List[str]  # labels no longer in the config. Dropping them requires rewriting the type.
+    reordered: bool  # whether the kept labels are ordered differently than in the config, which also requires a rewrite
+
+
+def enum_changes(
+    type_name: str, current: List[str] | None, values: List
+) -> EnumChanges:
+    """Computes how to bring an enum type in line with the config. New labels are added with ALTER TYPE ... ADD VALUE next to their neighbours in the config. Labels are never removed or reordered, since PostgreSQL can only do that by rewriting the type and every column using it.
+
+    Args:
+        type_name (str): The name of the enum type.
+        current (List[str] | None): Its current labels, or None if it does not exist.
+        values (List): The labels in the config, in order.
+
+    Returns:
+        EnumChanges: The statements to run and what they cannot reconcile.
+    """
+    desired = [str(value) for value in values]
+    if current is None:
+        return EnumChanges(
+            [
+                (
+                    sql.SQL("CREATE TYPE {} AS ENUM ({});").format(
+                        sql.Identifier(type_name),
+                        sql.SQL(", ").join(map(sql.Literal, desired)),
+                    ),
+                    f"create enum type {type_name}",
+                )
+            ],
+            desired,
+            [],
+            False,
+        )
+
+    labels = list(current)
+    existing = set(labels)
+    statements: List[tuple[sql.Composable, str]] = []
+    for i, label in enumerate(desired):
+        if label in existing:
+            continue
+        # every earlier label exists by now, so the new one goes right after its predecessor
+        if i > 0:
+            position = sql.SQL(" AFTER {}").format(sql.Literal(desired[i - 1]))
+            labels.insert(labels.index(desired[i - 1]) + 1, label)
+        else:
+            following = next((other for other in desired if other in existing), None)
+            if following is not None:
+                position = sql.SQL(" BEFORE {}").format(sql.Literal(following))
+                labels.insert(labels.index(following), label)
+            else:
+                position = sql.SQL("")
+                labels.append(label)
+        existing.add(label)
+        statements.append(
+            (
+                sql.SQL("ALTER TYPE {} ADD VALUE IF NOT EXISTS {}{};").format(
+                    sql.Identifier(type_name), sql.Literal(label), position
+                ),
+                f"add value {label} to enum type {type_name}",
+            )
+        )
+
+    wanted = set(desired)
+    return EnumChanges(
+        statements,
+        labels,
+        [label for label in labels if label not in wanted],
+        [label for label in labels if label in wanted] != desired,
+    )
+
+
+def plan_enum(
+    plan: SchemaPlan, table_name: str, config_name: str, type_name: str, values: List
+) -> bool:
+    """Plans the creation of the enum type, or the addition of its new labels.
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_name (str): The table of the column that uses the type.
+        config_name (str): The config name of that column.
+        type_name (str): The name of the enum type.
+        values (List): The labels in the config, in order.
+
+    Returns:
+        bool: True if the type matches the config, False if it has labels that are no longer in the config or are out of order.
+    """
+    current = plan.catalog.enum_labels(type_name)
+    changes = enum_changes(type_name, current, values)
+    stage: Stage = "type" if current is None else "label"
+    for statement, description in changes.statements:
+        plan.add(
+            DDLOperation(stage, statement, table_name, description, column=config_name)
+        )
+    plan.catalog.add_enum(type_name, changes.labels)
+
+    if len(changes.removed) > 0:
+        logger.warning(
+            f"Enum type {plan.database_name}/{type_name} still has the labels {changes.removed}, which are no longer in the config. Removing them requires rewriting the type and its column."
+        )
+    if changes.reordered:
+        logger.warning(
+            f"The labels of enum type {plan.database_name}/{type_name} are ordered differently than in the config. Reordering them requires rewriting the type and its column."
+        )
+    return len(changes.removed) == 0 and not changes.reordered
+
+
+# format_type() spells these out
+_FORMAT_TYPE_NAMES = {
+    "time": "time without time zone",
+    "timestamp": "timestamp without time zone",
+}
+_VARCHAR = re.compile(r"character varying(?:\((\d+)\))?$")
+
+
+def _format_type(datatype: str) -> str:
+    return _FORMAT_TYPE_NAMES.get(datatype, datatype)
+
+
+def _is_binary_compatible(current: str, desired: str) -> bool:
+    """Whether ALTER COLUMN ... TYPE only relabels the column instead of rewriting the table: text and varchar are binary-compatible, and a varchar can always be widened."""
+    if current == "text":
+        return desired == "character varying"
+    match = _VARCHAR.match(current)
+    if match is None:
+        return False
+    if desired == "text":
+        return True
+    wanted = _VARCHAR.match(desired)
+    return wanted is not None and (
+        wanted[1] is None or (match[1] is not None and int(wanted[1]) >= int(match[1]))
+    )
+
+
+def _uses_column(plan: SchemaPlan, table_name: str, column_name: str) -> bool:
+    """Whether any constraint or index of the table involves the column."""
+    if any(
+        column_name in constraint.columns
+        for constraint in plan.catalog.constraints(table_name)
+    ):
+        return True
+    pattern = re.compile(rf'[(,\s]"?{re.escape(column_name)}"?[,)\s]')
+    return any(
+        pattern.search(index.definition.partition(" USING ")[2])
+        for index in plan.catalog.indexes(table_name)
+    )
+
+
+def _plan_shadow_column(
+    plan: SchemaPlan,
+    table_name: str,
+    config_name: str,
+    column_name: str,
+    datatype: sql.Composable,
+    using: sql.Composable,
+    default: str | None,
+    description: str,
+) -> None:
+    """Plans a type change through a shadow column: the column is copied into <column>_migrating under the new type by a trigger (for new writes) and a batched backfill (for old rows), and the two are swapped at the end. Only the swap locks the table, briefly. The swap also sets the given default, since the old column takes its default with it.
+
+    The copies go through a cast function that returns NULL instead of failing, so that a value that does not convert never makes a write of the website fail. Before anything changes, the existing rows are checked to convert, and the swap refuses to drop the old column while a value did not convert.
+    """
+    shadow_name = f"{column_name}_{SHADOW_COLUMN_SUFFIX}"
+    function_name = generated_identifier(table_name, shadow_name)
+    cast_name = generated_identifier(table_name, shadow_name, "cast")
+    table, column, shadow = (
+        sql.Identifier(table_name),
+        sql.Identifier(column_name),
+        sql.Identifier(shadow_name),
+    )
+
+    def unconverted(converted: sql.Composable) -> sql.Composable:
+        """Matches the rows whose value did not convert, given the converted value."""
+        return sql.SQL("{} IS NOT NULL AND {} IS NULL").format(column, converted)
+
+    plan.add(
+        DDLOperation(
+            "check",
+            sql.SQL("""
+                CREATE OR REPLACE FUNCTION {cast}(value {table}.{column}%TYPE) RETURNS {datatype} LANGUAGE plpgsql AS $$
+                BEGIN
+                    RETURN {expression};
+                EXCEPTION WHEN others THEN
+                    RETURN NULL;
+                END
+                $$;
+                """).format(
+                cast=sql.Identifier(cast_name),
+                table=table,
+                column=column,
+                datatype=datatype,
+                expression=using.format(sql.SQL("value"), datatype),
+            ),
+            table_name,
+            f"create the cast function {cast_name}",
+            column=config_name,
+        )
+    )
+    plan.add(
+        DDLOperation(
+            "check",
+            sql.SQL("""
+                DO $$
+                DECLARE
+                    _unconverted bigint;
+                BEGIN
+                    SELECT count(*) FROM {table} WHERE {unconverted} INTO _unconverted;
+                    IF _unconverted > 0 THEN
+                        RAISE EXCEPTION '% rows of % do not convert', _unconverted, {description};
+                    END IF;
+                END
+                $$;
+                """).format(
+                table=table,
+                unconverted=unconverted(
+                    sql.SQL("{}({})").format(sql.Identifier(cast_name), column)
+                ),
+                description=sql.Literal(description),
+            ),
+            table_name,
+            f"check that the values of {description} convert",
+            column=config_name,
+        )
+    )
+
+    if not plan.catalog.column_exists(table_name, shadow_name):
+        # left over if an earlier run stopped halfway, in which case the backfill simply runs again
+        _plan_add_columns(
+            plan, table_name, config_name, [(shadow_name, datatype, "")]
+        )
+    plan.add(
+        DDLOperation(
+            "column",
+            sql.SQL("""
+                CREATE OR REPLACE FUNCTION {function}() RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                    NEW.{shadow} := {cast}(NEW.{column});
+                    RETURN NEW;
+                END
+                $$;
+                """).format(
+                function=sql.Identifier(function_name),
+                shadow=shadow,
+                cast=sql.Identifier(cast_name),
+                column=column,
+            ),
+            table_name,
+            f"create the trigger function {function_name}",
+            column=config_name,
+        )
+    )
+    plan.add(
+        DDLOperation(
+            "column",
+            sql.SQL(
+                "CREATE OR REPLACE TRIGGER {} BEFORE INSERT OR UPDATE ON {} FOR EACH ROW EXECUTE FUNCTION {}();"
+            ).format(
+                sql.Identifier(function_name),
+                table,
+                sql.Identifier(function_name),
+            ),
+            table_name,
+            f"copy new writes of {table_name}.{column_name} into {shadow_name}",
+            column=config_name,
+        )
+    )
+
+    backfill = Backfill(
+        table_name,
+        sql.SQL("{} = {}({})").format(shadow, sql.Identifier(cast_name), column),
+        f"backfill {table_name}.{shadow_name}",
+        settings=plan.backfill,
+    )
+    plan.add(
+        DDLOperation(
+            "backfill",
+            backfill.script(),
+            table_name,
+            backfill.description,
+            column=config_name,
+            backfill=backfill,
+        )
+    )
+    plan.add(
+        DDLOperation(
+            "swap",
+            sql.SQL("""
+                DO $$
+                BEGIN
+                    IF EXISTS (SELECT FROM {table} WHERE {unconverted}) THEN
+                        RAISE EXCEPTION 'values of % were written that do not convert', {description};
+                    END IF;
+                    DROP TRIGGER {function} ON {table};
+                    DROP FUNCTION {function}();
+                    DROP FUNCTION {cast};
+                    ALTER TABLE {table} DROP COLUMN {column};
+                    ALTER TABLE {table} RENAME COLUMN {shadow} TO {column};{set_default}
+                END
+                $$;
+                """).format(
+                function=sql.Identifier(function_name),
+                cast=sql.Identifier(cast_name),
+                table=table,
+                column=column,
+                shadow=shadow,
+                unconverted=unconverted(shadow),
+                description=sql.Literal(description),
+                set_default=(
+                    sql.SQL("")
+                    if default is None
+                    else sql.SQL(
+                        "\n                    ALTER TABLE {} ALTER COLUMN {} SET DEFAULT {};"
+                    ).format(table, column, sql.SQL(default))
+                ),
+            ),
+            table_name,
+            f"replace {description} by {shadow_name}",
+            column=config_name,
+        )
+    )
+    plan.catalog.drop_column(table_name, shadow_name)
+    plan.needs_rerun = True
+
+
+def plan_type_change(
+    plan: SchemaPlan, table_name: str, column_schema: DataColumn
+) -> bool:
+    """Plans the changes needed for an existing column to have the type of its schema.
+
+    Binary-compatible changes only relabel the column. Other changes rewrite the table with ALTER COLUMN ... TYPE ... USING, which locks it for the whole rewrite. Online, large tables (see OnlineSettings.shadow_column_rows) are migrated through a shadow column instead, unless constraints or indexes involve the column, since they would be lost with the old column.
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_name (str): The name of the table of the column.
+        column_schema (DataColumn): The column schema to enforce.
+
+    Returns:
+        bool: True if the column has (or will have) the right type, False if it cannot be converted.
+    """
+    catalog = plan.catalog
+    column_name = plan.names.normalize(column_schema["name"])
+    column = catalog.tables[table_name].columns[column_name]
+    current = _format_type(column.datatype)
+
+    match column_schema["datatype"]:
+        case "enum":
+            enum_name = generated_enum_name(table_name, column_name)
+            if column.udt_name == enum_name:
+                return True
+            desired, datatype = enum_name, sql.Identifier(enum_name)
+        case "geodetic point":
+            # geodetic points span several columns, and nothing converts into a geography
+            return current == "geography(Point,4326)"
+        case "pointer" | "polymorphic pointer" | "polypointer":
+            desired, datatype = "integer", sql.SQL("integer")
+        case _:
+            desired = _format_type(PSQLDATATYPES[column_schema["datatype"]])
+            datatype = sql.SQL(PSQLDATATYPES[column_schema["datatype"]])
+    if current == desired:
+        return True
+
+    # enums only convert from and to text
+    using = (
+        sql.SQL("{}::text::{}")
+        if column_schema["datatype"] == "enum" or catalog.enum_exists(column.udt_name)
+        else sql.SQL("{}::{}")
+    )
+    description = f"{table_name}.{column_name} ({current} -> {desired})"
+    is_large = plan.is_online(table_name) and not (
+        0 <= catalog.tables[table_name].estimated_rows < plan.online.shadow_column_rows  # type: ignore
+    )
+    # the default of the column once its type changed: ALTER COLUMN ... TYPE keeps it, the swap sets the schema's
+    default = column.default
+    if _is_binary_compatible(current, desired):
+        plan.add(
+            DDLOperation(
+                "column",
+                sql.SQL("ALTER TABLE {} ALTER COLUMN {} TYPE {};").format(
+                    sql.Identifier(table_name), sql.Identifier(column_name), datatype
+                ),
+                table_name,
+                f"change the type of {description} without a rewrite",
+                column=column_schema["name"],
+            )
+        )
+    elif is_large and not _uses_column(plan, table_name, column_name):
+        _plan_shadow_column(
+            plan,
+            table_name,
+            column_schema["name"],
+            column_name,
+            datatype,
+            using,
+            _default_text(column_schema),
+            description,
+        )
+        default = _default_text(column_schema)
+    else:
+        if is_large:
+            logger.warning(
+                f"Constraints or indexes involve {plan.database_name}/{description}, so changing its type rewrites {table_name} under an exclusive lock."
+            )
+        # the old default may not convert to the new type, so plan_default sets it again afterwards
+        plan.add(
+            DDLOperation(
+                "column",
+                sql.SQL("ALTER TABLE {} {}ALTER COLUMN {} TYPE {} USING {};").format(
+                    sql.Identifier(table_name),
+                    (
+                        sql.SQL("")
+                        if column.default is None
+                        else sql.SQL("ALTER COLUMN {} DROP DEFAULT, ").format(
+                            sql.Identifier(column_name)
+                        )
+                    ),
+                    sql.Identifier(column_name),
+                    datatype,
+                    using.format(sql.Identifier(column_name), datatype),
+                ),
+                table_name,
+                f"change the type of {description}, rewriting {table_name}",
+                column=column_schema["name"],
+            )
+        )
+        default = None
+    catalog.add_column(
+        table_name,
+        column_name,
+        desired,
+        udt_name=desired if column_schema["datatype"] == "enum" else None,
+        not_null=column.not_null,
+        default=default,
+    )
+    return True
+
+
+def _default_text(column_schema: DataColumn) -> str | None:
+    """The "default" of the column schema as SQL, or None if it has none."""
+    if column_schema.get("default") is None:
+        return None
+    # psycopg pads negative numbers with a space
+    return sql.Literal(column_schema["default"]).as_string().strip()
+
+
+def _default_clause(column_schema: DataColumn) -> sql.Composable:
+    default = _default_text(column_schema)
+    return sql.SQL("") if default is None else sql.SQL(" DEFAULT {}").format(sql.SQL(default))
+
+
+_DEFAULT_CASTS = re.compile(r"(::[\w\s\"]+(\([\d,\s]*\))?)+$")
+
+
+def _normalize_default(default: str | None) -> str | None:
+    """Normalizes a default expression so that ours can be compared to pg_get_expr()'s (which adds casts and quotes negative numbers)."""
+    if default is None:
+        return None
+    return _DEFAULT_CASTS.sub("", default.strip()).strip().strip("'")
+
+
+def plan_default(plan: SchemaPlan, table_name: str, column_schema: DataColumn) -> None:
+    """Plans the changes needed for the default of an existing column to match its schema. Setting or dropping a default only affects new rows."""
+    column_name = plan.names.normalize(column_schema["name"])
+    column = plan.catalog.tables[table_name].columns[column_name]
+    default = _default_text(column_schema)
+    if _normalize_default(column.default) == _normalize_default(default):
+        return
+    plan.add(
+        DDLOperation(
+            "column",
+            sql.SQL("ALTER TABLE {} ALTER COLUMN {} {};").format(
+                sql.Identifier(table_name),
+                sql.Identifier(column_name),
+                (
+                    sql.SQL("DROP DEFAULT")
+                    if default is None
+                    else sql.SQL("SET DEFAULT {}").format(sql.SQL(default))
+                ),
+            ),
+            table_name,
+            (
+                f"drop the default of {table_name}.{column_name}"
+                if default is None
+                else f"set the default of {table_name}.{column_name} to {default}"
+            ),
+            column=column_schema["name"],
+        )
+    )
+    column.default = default
+
+
+def _geometry_column(column_name: str) -> tuple[str, sql.Composable, str]:
+    """The (name, datatype SQL, format_type datatype) of the generated geometry copy of a geodetic point column."""
+    return (
+        f"{column_name}_{GEOMETRY_COLUMN_SUFFIX}",
+        sql.SQL("geometry(POINT, 4326) GENERATED ALWAYS AS ({}::geometry) STORED").format(
+            sql.Identifier(column_name)
+        ),
+        "geometry(Point,4326)",
+    )
+
+
+def plan_geometry_column(
+    plan: SchemaPlan, table_name: str, column_schema: DataColumn
+) -> None:
+    """Adds or drops the generated geometry column of an existing geodetic point column, as its "geometry" key says. Adding it rewrites the table, since stored generated columns are computed for every row."""
+    column_name = plan.names.normalize(column_schema["name"])
+    geometry_name, datatype, format_type = _geometry_column(column_name)
+    exists = plan.catalog.column_exists(table_name, geometry_name)
+    if column_schema.get("geometry", False) and not exists:
+        _plan_add_columns(
+            plan,
+            table_name,
+            column_schema["name"],
+            [(geometry_name, datatype, format_type)],
+        )
+    elif not column_schema.get("geometry", False) and exists:
+        plan.add(
+            DDLOperation(
+                "column",
+                sql.SQL("ALTER TABLE {} DROP COLUMN {};").format(
+                    sql.Identifier(table_name), sql.Identifier(geometry_name)
+                ),
+                table_name,
+                f"drop column {geometry_name} from {table_name}",
+                column=column_schema["name"],
+            )
+        )
+        plan.catalog.drop_column(table_name, geometry_name)
+
+
+def plan_column(plan: SchemaPlan, table_name: str, column_schema: DataColumn) -> bool:
+    """Plans the changes needed for the column to conform to the given schema. Assumes that the respective table already exists or is planned. Chooses to keep rather than destroy old data.
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_name (str): The name of the table that will contain the given column.
+        column_schema (DataColumn): The column schema to enforce. This function assumes that column_schema is well-formed.
+
+    Returns:
+        bool: True if the column matches the schema, False if the column already exists under a different datatype.
+    """
+    catalog = plan.catalog
+    column_name = plan.names.normalize(column_schema["name"])
+    matches = True
+
+    # the enum type is reconciled whether or not the column exists
+    if column_schema["datatype"] == "enum":
+        enum_name = generated_enum_name(table_name, column_name)
+        matches = plan_enum(
+            plan, table_name, column_schema["name"], enum_name, column_schema["values"]  # type: ignore
+        )
+
+    # ensure that the column exists with the right type and default
+    if catalog.column_exists(table_name, column_name):
+        if not plan_type_change(plan, table_name, column_schema):
+            return False
+        plan_default(plan, table_name, column_schema)
+        if column_schema["datatype"] == "geodetic point":
+            plan_geometry_column(plan, table_name, column_schema)
+    else:
+        match (column_schema["datatype"]):
+            case "enum":
+                _plan_add_columns(
+                    plan,
+                    table_name,
+                    column_schema["name"],
+                    [
+                        (
+                            column_name,
+                            sql.SQL("{}{}").format(
+                                sql.Identifier(enum_name), _default_clause(column_schema)
+                            ),
+                            enum_name,
+                        )
+                    ],
+                )
+            case "geodetic point":
+                _plan_add_columns(
+                    plan,
+                    table_name,
+                    column_schema["name"],
+                    [
+                        (
+                            column_name,
+                            sql.SQL("geography(POINT, 4326)"),
+                            "geography(Point,4326)",
+                        ),
+                        *(
+                            (
+                                f"{column_name}_{suffix}",
+                                sql.SQL("double precision"),
+                                "double precision",
+                            )
+                            for suffix in GEODETIC_COLUMN_SUFFIXES
+                        ),
+                        *(
+                            [_geometry_column(column_name)]
+                            if column_schema.get("geometry", False)
+                            else []
+                        ),
+                    ],
+                )
+            case "pointer":
+                pointer_target = column_schema.get("references")
+                if pointer_target is None:
+                    raise RuntimeError(
+                        f"Pointer target for {table_name}/{column_schema["name"]} is undefined."
+                    )
+                pointer_target = plan.names.normalize(pointer_target)
+                if plan.is_online(table_name):
+                    # adding the column with REFERENCES would scan the table under an exclusive lock
+                    _plan_add_columns(
+                        plan,
+                        table_name,
+                        column_schema["name"],
+                        [(column_name, sql.SQL("INTEGER"), "integer")],
+                    )
+                    _plan_foreign_key(
+                        plan,
+                        table_name,
+                        column_name,
+                        generated_constraint_name(table_name, column_name, "fkey"),
+                        pointer_target,
+                        column_schema["name"],
+                    )
+                else:
+                    _plan_add_columns(
+                        plan,
+                        table_name,
+                        column_schema["name"],
+                        [
+                            (
+                                column_name,
+                                sql.SQL("INTEGER CONSTRAINT {} REFERENCES {}(id)").format(
+                                    sql.Identifier(
+                                        generated_identifier(
+                                            table_name, column_name, "fkey"
+                                        )
+                                    ),
+                                    sql.Identifier(pointer_target),
+                                ),
+                                "integer",
+                            )
+                        ],
+                        depends_on=(pointer_target,),
+                    )
+            case "polymorphic pointer" | "polypointer":
+                _plan_add_columns(
+                    plan,
+                    table_name,
+                    column_schema["name"],
+                    [
+                        (column_name, sql.SQL("INTEGER"), "integer"),
+                        (
+                            f"{column_name}_type",
+                            sql.SQL("VARCHAR(64)"),
+                            "character varying(64)",
+                        ),
+                    ],
+                )
+            case _:
+                _plan_add_columns(
+                    plan,
+                    table_name,
+                    column_schema["name"],
+                    [
+                        (
+                            column_name,
+                            sql.SQL("{}{}").format(
+                                sql.SQL(PSQLDATATYPES[column_schema["datatype"]]),
+                                _default_clause(column_schema),
+                            ),
+                            PSQLDATATYPES[column_schema["datatype"]],
+                        )
+                    ],
+                )
+        # constant defaults are stored in the catalog, so adding them does not rewrite the table
+        default = _default_text(column_schema)
+        catalog.tables[table_name].columns[column_name].default = default
+        if default is not None:
+            plan._defaulted_columns.add((table_name, column_name))
+
+    # constraints are reconciled once per table by plan_constraints
+    # @TODO CHECK (REGEX, number comparisons)
+
+    # check for the comments column
+    # do not remove old comments columns
+    comments_column_exists = catalog.column_exists(
+        table_name, column_name + "_comments"
+    )
+    if "comments" in column_schema and column_schema["comments"]:
+        if not comments_column_exists:
+            _plan_add_columns(
+                plan,
+                table_name,
+                column_schema["name"],
+                [(column_name + "_comments", sql.SQL("text DEFAULT ''"), "text")],
+            )
+    elif comments_column_exists:
+        return False
+    return matches
+
+
+def _normalize_definition(definition: str) -> str:
+    """Normalizes a constraint definition so that ours can be compared to pg_get_constraintdef()'s (which adds parentheses, quotes and NOT VALID as it sees fit)."""
+    definition = definition.removesuffix(" NOT VALID")
+    return " ".join(re.sub(r'[()"]', " ", definition).lower().split())
+
+
+def plan_constraints(
+    plan: SchemaPlan, table_name: str, column_schemas: List[DataColumn]
+) -> None:
+    """Reconciles the UNIQUE and NOT NULL constraints of the table with its column schemas. Existing constraints are compared by definition: only constraints that differ are dropped or created.
+
+    NOT NULL is enforced through a CHECK constraint that is added NOT VALID and validated afterwards, so adding it never holds an exclusive lock for a full table scan. If the column has a default, its NULLs in existing tables are first set to the default by a batched backfill. Primary keys, foreign keys and the columns' own NOT NULL flags are left alone.
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_name (str): The name of the table. It must exist or be planned, along with its columns.
+        column_schemas (List[DataColumn]): Every column schema of the table.
+    """
+    catalog = plan.catalog
+
+    # desired constraints: name -> (definition, definition as text, config column name)
+    desired: dict[str, tuple[sql.Composable, str, str]] = {}
+    # NOT NULL constraint name -> the default that its column's NULLs are backfilled with
+    backfilled: dict[str, str] = {}
+    for column_schema in column_schemas:
+        column_name = plan.names.normalize(column_schema["name"])
+        if column_schema.get("unique", False):
+            desired[generated_constraint_name(table_name, column_name, "unique")] = (
+                sql.SQL("UNIQUE ({})").format(sql.Identifier(column_name)),
+                f"UNIQUE ({column_name})",
+                column_schema["name"],
+            )
+        if not column_schema.get("optional", True):
+            not_null_name = generated_constraint_name(table_name, column_name, "not_null")
+            desired[not_null_name] = (
+                sql.SQL("CHECK ({} IS NOT NULL)").format(sql.Identifier(column_name)),
+                f"CHECK ({column_name} IS NOT NULL)",
+                column_schema["name"],
+            )
+            default = _default_text(column_schema)
+            if default is not None:
+                backfilled[not_null_name] = default
+        # @TODO CHECK (REGEX, number comparisons)
+
+    existing = {
+        _normalize_definition(constraint.definition): constraint
+        for constraint in catalog.constraints(table_name)
+        if constraint.contype in ("u", "c")
+    }
+    wanted = {_normalize_definition(text) for _, text, _ in desired.values()}
+
+    # drop whatever is no longer (or differently) wanted
+    for definition, constraint in existing.items():
+        if definition not in wanted:
+            plan.add(
+                DDLOperation(
+                    "constraint",
+                    sql.SQL("ALTER TABLE {} DROP CONSTRAINT {};").format(
+                        sql.Identifier(table_name), sql.Identifier(constraint.name)
+                    ),
+                    table_name,
+                    f"drop constraint {constraint.name} ({constraint.definition})",
+                )
+            )
+            catalog.drop_constraint(table_name, constraint.name)
+
+    for constraint_name, (definition, text, config_name) in desired.items():
+        current = existing.get(_normalize_definition(text))
+        if current is None and not text.startswith("CHECK") and plan.is_online(table_name):
+            # build the index without blocking writes, then turn it into a constraint (which only takes a brief lock)
+            plan.add(
+                DDLOperation(
+                    "concurrent",
+                    sql.SQL("CREATE UNIQUE INDEX CONCURRENTLY {} ON {} ({});").format(
+                        sql.Identifier(constraint_name),
+                        sql.Identifier(table_name),
+                        sql.Identifier(plan.names.normalize(config_name)),
+                    ),
+                    table_name,
+                    f"build unique index {constraint_name}",
+                    column=config_name,
+                    cleanup=_drop_index_concurrently(constraint_name),
+                )
+            )
+            plan.add(
+                DDLOperation(
+                    "attach",
+                    sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} UNIQUE USING INDEX {};").format(
+                        sql.Identifier(table_name),
+                        sql.Identifier(constraint_name),
+                        sql.Identifier(constraint_name),
+                    ),
+                    table_name,
+                    f"add constraint {constraint_name} ({text}) using its index",
+                    column=config_name,
+                )
+            )
+            current = ConstraintInfo(
+                constraint_name, "u", text, (plan.names.normalize(config_name),)
+            )
+            catalog.add_constraint(table_name, current)
+        elif current is None:
+            is_check = text.startswith("CHECK")
+            plan.add(
+                DDLOperation(
+                    "constraint",
+                    sql.SQL("ALTER TABLE {} ADD CONSTRAINT {} {}{};").format(
+                        sql.Identifier(table_name),
+                        sql.Identifier(constraint_name),
+                        definition,
+                        sql.SQL(" NOT VALID" if is_check else ""),
+                    ),
+                    table_name,
+                    f"add constraint {constraint_name} ({text})",
+                    column=config_name,
+                )
+            )
+            current = ConstraintInfo(
+                constraint_name,
+                "c" if is_check else "u",
+                text,
+                (plan.names.normalize(config_name),),
+                validated=not is_check,
+            )
+            catalog.add_constraint(table_name, current)
+
+        column_name = plan.names.normalize(config_name)
+        if (
+            not current.validated
+            and constraint_name in backfilled
+            and table_name not in plan._created_tables
+            and (table_name, column_name) not in plan._defaulted_columns
+        ):
+            backfill = Backfill(
+                table_name,
+                sql.SQL("{} = {}").format(
+                    sql.Identifier(column_name), sql.SQL(backfilled[constraint_name])
+                ),
+                f"backfill {table_name}.{column_name}",
+                where=sql.SQL("{} IS NULL").format(sql.Identifier(column_name)),
+                settings=plan.backfill,
+            )
+            plan.add(
+                DDLOperation(
+                    "backfill",
+                    backfill.script(),
+                    table_name,
+                    backfill.description,
+                    column=config_name,
+                    backfill=backfill,
+                )
+            )
+
+        if not current.validated:
+            plan.add(
+                DDLOperation(
+                    "validate",
+                    sql.SQL("ALTER TABLE {} VALIDATE CONSTRAINT {};").format(
+                        sql.Identifier(table_name), sql.Identifier(current.name)
+                    ),
+                    table_name,
+                    f"validate constraint {current.name}",
+                    column=config_name,
+                )
+            )
+            current.validated = True
+
+
+def plan_reserved_columns(plan: SchemaPlan, table_schema: TableInfo) -> bool:
+    """Plans the changes needed for the table's reserved columns to conform to its schema. Assumes that the respective tables already exist or are planned (the table itself and the tagging tables). (There's almost nothing this function can do to save the table if it doesn't conform to the schema) @TODO
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_schema (TableInfo): The table schema to enforce. This function assumes that table_schema is well-formed.
+
+    Returns:
+        bool: True if the table matches the schema, False if there are reserved columns that should not exist.
+    """
+    catalog = plan.catalog
+    table_name = plan.names.normalize(table_schema["tableName"])
+
+    # id column
+    if not catalog.column_exists(
+        table_name, "id"
+    ):  # @TODO check constraints & primary key status
+        return False
+
+    # primary_tag column
+    if table_schema.get("tagging", False):  # if the schema enables tagging,
+        if not catalog.column_exists(
+            table_name, "primary_tag"
+        ):  # @TODO check constraints
+            _plan_add_columns(
+                plan, table_name, "primary_tag", [("primary_tag", sql.SQL("INT NOT NULL"), "integer")]
+            )
+            catalog.tables[table_name].columns["primary_tag"].not_null = True
+            _plan_foreign_key(
+                plan,
+                table_name,
+                "primary_tag",
+                "fk_primary_tags",
+                f"{table_name}_tag_names",
+                "primary_tag",
+            )
+    else:  # if the schema does not specify tagging or disables tagging
+        if catalog.column_exists(table_name, "primary_tag"):
+            return False
+    return True
+
+
+def _drop_index_concurrently(index_name: str) -> sql.Composable:
+    """Drops what an interrupted CREATE INDEX CONCURRENTLY left behind: an invalid index that would make the next attempt fail."""
+    return sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {};").format(
+        sql.Identifier(index_name)
+    )
+
+
+INDEX_METHODS = ("btree", "hash", "gist", "spgist", "gin", "brin")
+# comments of the indexes managed by this script start with this marker, followed by the fingerprint of the index definition
+MANAGED_INDEX_MARKER = "create_tables:"
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    name: str
+    table: str
+    columns: tuple[str, ...]
+    method: str = "btree"
+    unique: bool = False
+    where: str | None = None  # raw SQL predicate for partial indexes
+
+    def fingerprint(self) -> str:
+        return hashlib.sha1(
+            repr((self.table, self.columns, self.method, self.unique, self.where)).encode()
+        ).hexdigest()[:16]
+
+    def statement(self, concurrently: bool = False) -> sql.Composable:
+        return sql.SQL("CREATE {}INDEX {}{} ON {} USING {} ({}){};").format(
+            sql.SQL("UNIQUE " if self.unique else ""),
+            sql.SQL("CONCURRENTLY " if concurrently else ""),
+            sql.Identifier(self.name),
+            sql.Identifier(self.table),
+            sql.SQL(self.method),
+            sql.SQL(", ").join(map(sql.Identifier, self.columns)),
+            sql.SQL(f" WHERE {self.where}" if self.where else ""),
+        )
+
+
+def tagging_index_specs(table_name: str) -> dict[str, List[IndexSpec]]:
+    """The indexes backing the foreign keys of the tagging tables (see TAGGING_INDEXES), grouped by table."""
+    return {
+        f"{table_name}_{table_suffix}": [
+            IndexSpec(
+                generated_identifier(table_name, suffix),
+                f"{table_name}_{table_suffix}",
+                columns,
+                unique=unique,
+            )
+            for suffix, columns, unique in indexes
+        ]
+        for table_suffix, indexes in TAGGING_INDEXES.items()
+    }
+
+
+def _spatial_index_specs(
+    names: NameTable, table_name: str, column_schema: dict
+) -> List[IndexSpec]:
+    method = spatial_index_method(column_schema)
+    if method is None:
+        return []
+    if method not in SPATIAL_INDEX_METHODS:
+        raise RuntimeError(
+            f"Spatial index method {method} of {table_name}/{column_schema['name']} is not one of {SPATIAL_INDEX_METHODS}."
+        )
+    column_name = names.normalize(column_schema["name"])
+    columns = [column_name]
+    if column_schema.get("geometry", False):
+        columns.append(f"{column_name}_{GEOMETRY_COLUMN_SUFFIX}")
+    return [
+        IndexSpec(
+            generated_index_name(table_name, name, method),
+            table_name,
+            (name,),
+            method,
+        )
+        for name in columns
+    ]
+
+
+def config_index_specs(
+    names: NameTable, table_name: str, table_schema: dict
+) -> List[IndexSpec]:
+    """The indexes of a data or descriptor table: one for every foreign key column (pointers and primary_tag), a spatial index for every geodetic point (and its geometry column), plus those listed under the table's "indexes" key.
+
+    The "spatialIndex" key of a geodetic point column picks the method of its spatial index: "gist" (the default), "spgist", or false for none.
+
+    Each entry under "indexes" has a list of column names under "columns" and may specify "name", "method" (btree, hash, gist, spgist, gin or brin; defaults to btree), "unique" and a partial index predicate under "where".
+
+    Args:
+        names (NameTable): The name table of the database.
+        table_name (str): The name of the table.
+        table_schema (dict): The table or descriptor schema.
+
+    Raises:
+        RuntimeError: When an index entry is malformed.
+
+    Returns:
+        List[IndexSpec]: The desired indexes.
+    """
+    specs: List[IndexSpec] = []
+    for column_schema in table_schema.get("schema", []):
+        if column_schema.get("datatype") == "pointer":
+            column_name = names.normalize(column_schema["name"])
+            specs.append(
+                IndexSpec(
+                    generated_index_name(table_name, column_name),
+                    table_name,
+                    (column_name,),
+                )
+            )
+        elif column_schema.get("datatype") == "geodetic point":
+            specs.extend(_spatial_index_specs(names, table_name, column_schema))
+    if table_schema.get("tagging", False):
+        specs.append(
+            IndexSpec(
+                generated_index_name(table_name, "primary_tag"),
+                table_name,
+                ("primary_tag",),
+            )
+        )
+
+    for index_schema in table_schema.get("indexes", []):
+        columns = tuple(map(names.normalize, index_schema.get("columns", [])))
+        method = index_schema.get("method", "btree").lower()
+        if len(columns) == 0:
+            raise RuntimeError(f"An index of {table_name} has no columns.")
+        if method not in INDEX_METHODS:
+            raise RuntimeError(
+                f"Index method {method} of {table_name} is not one of {INDEX_METHODS}."
+            )
+        specs.append(
+            IndexSpec(
+                index_schema.get("name")
+                or generated_index_name(table_name, *columns, method),
+                table_name,
+                columns,
+                method,
+                index_schema.get("unique", False),
+                index_schema.get("where"),
+            )
+        )
+    return specs
+
+
+def plan_indexes(plan: SchemaPlan, table_name: str, specs: List[IndexSpec]) -> None:
+    """Keeps the managed indexes of the table in sync with the given specs. Managed indexes are recognized by their comment, which also records the fingerprint of their definition: indexes whose definition changed are rebuilt, and managed indexes that are no longer wanted are dropped. Other indexes are never touched.
+
+    On existing tables in online mode, indexes are built and dropped concurrently.
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_name (str): The table the indexes belong to.
+        specs (List[IndexSpec]): Every desired index of the table.
+    """
+    catalog = plan.catalog
+    online = plan.is_online(table_name)
+    existing = {index.name: index for index in catalog.indexes(table_name)}
+    wanted = {spec.name: spec for spec in specs}
+
+    def drop(index_name: str, reason: str) -> None:
+        plan.add(
+            DDLOperation(
+                "concurrent" if online else "index",
+                sql.SQL("DROP INDEX {}IF EXISTS {};").format(
+                    sql.SQL("CONCURRENTLY " if online else ""),
+                    sql.Identifier(index_name),
+                ),
+                table_name,
+                f"drop index {index_name} ({reason})",
+            )
+        )
+        catalog.drop_index(table_name, index_name)
+
+    for index in existing.values():
+        is_managed = (index.comment or "").startswith(MANAGED_INDEX_MARKER)
+        if is_managed and index.name not in wanted:
+            drop(index.name, "no longer in the config")
+
+    for spec in specs:
+        current = existing.get(spec.name)
+        comment = MANAGED_INDEX_MARKER + spec.fingerprint()
+        if current is not None:
+            if current.valid and current.comment == comment:
+                continue
+            if current.valid and not (current.comment or "").startswith(
+                MANAGED_INDEX_MARKER
+            ):
+                logger.warning(
+                    f"Index {plan.database_name}/{spec.name} already exists and is not managed by create_tables. Leaving it alone."
+                )
+                continue
+            drop(spec.name, "definition changed" if current.valid else "invalid")
+
+        plan.add(
+            DDLOperation(
+                "concurrent" if online else "index",
+                spec.statement(concurrently=online),
+                table_name,
+                f"create {spec.method} index {spec.name} on {table_name} ({', '.join(spec.columns)})",
+                cleanup=_drop_index_concurrently(spec.name) if online else None,
+            )
+        )
+        plan.add(
+            DDLOperation(
+                "attach" if online else "index",
+                sql.SQL("COMMENT ON INDEX {} IS {};").format(
+                    sql.Identifier(spec.name), sql.Literal(comment)
+                ),
+                table_name,
+                f"mark index {spec.name} as managed",
+            )
+        )
+        catalog.add_index(
+            table_name,
+            IndexInfo(spec.name, spec.statement().as_string(), spec.unique, comment=comment),
+        )
+
+
+TAGGING_TABLE_NAMES = Literal["tag_names", "tags", "tag_aliases", "tag_groups"]
+TAGGING_TABLE_STATEMENTS: dict[TAGGING_TABLE_NAMES, sql.SQL] = {
+    "tag_names": sql.SQL("""
+                         CREATE TABLE {} (
+                            id SERIAL PRIMARY KEY,
+                            tag_name TEXT NOT NULL UNIQUE
+                         );
+                         """),
+    "tags": sql.SQL("""
+                    CREATE TABLE {} (
+                        id SERIAL PRIMARY KEY,
+                        entry_id INT REFERENCES {} (id) NOT NULL,
+                        tag_id INT REFERENCES {} (id) NOT NULL
+                    );
+                    """),
+    "tag_aliases": sql.SQL("""
+                         CREATE TABLE {} (
+                            alias TEXT PRIMARY KEY,
+                            tag_id INT REFERENCES {} (id) NOT NULL
+                         );
+                         """),
+    "tag_groups": sql.SQL("""
+                         CREATE TABLE {} (
+                            id SERIAL PRIMARY KEY,
+                            tag_id INT REFERENCES {} (id) NOT NULL,
+                            group_name TEXT NOT NULL
+                         );
+                         """),
+}
+
+
+def plan_tagging_tables(plan: SchemaPlan, table_name: str) -> None:
+    """Plans the creation of related tagging tables if necessary, assuming that the table requires tagging. Each table declares the tables it references so that the plan can order them.
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_name (str): The name of the target table.
+    """
+    catalog = plan.catalog
+    tag_names_table = f"{table_name}_tag_names"
+
+    # tag names
+    if not catalog.table_exists(tag_names_table):
+        _plan_create_table(
+            plan,
+            tag_names_table,
+            TAGGING_TABLE_STATEMENTS["tag_names"].format(
+                sql.Identifier(tag_names_table)
+            ),
+        )
+
+    # tags
+    if not catalog.table_exists(table_name + "_tags"):
+        _plan_create_table(
+            plan,
+            table_name + "_tags",
+            TAGGING_TABLE_STATEMENTS["tags"].format(
+                sql.Identifier(table_name + "_tags"),
+                sql.Identifier(table_name),
+                sql.Identifier(tag_names_table),
+            ),
+            depends_on=(table_name, tag_names_table),
+        )
+
+    # tag aliases
+    if not catalog.table_exists(table_name + "_tag_aliases"):
+        _plan_create_table(
+            plan,
+            table_name + "_tag_aliases",
+            TAGGING_TABLE_STATEMENTS["tag_aliases"].format(
+                sql.Identifier(table_name + "_tag_aliases"),
+                sql.Identifier(tag_names_table),
+            ),
+            depends_on=(tag_names_table,),
+            has_id=False,
+        )
+
+    # tag groups
+    if not catalog.table_exists(table_name + "_tag_groups"):
+        _plan_create_table(
+            plan,
+            table_name + "_tag_groups",
+            TAGGING_TABLE_STATEMENTS["tag_groups"].format(
+                sql.Identifier(table_name + "_tag_groups"),
+                sql.Identifier(tag_names_table),
+            ),
+            depends_on=(tag_names_table,),
+        )
+
+
+def plan_descriptor_tables(plan: SchemaPlan, table_schema: TableInfo) -> bool:
+    """Plans related descriptor tables if necessary. @TODO reject invalid configs where there is a collision between different descriptor tables (extremely unlikely if the user is good-faith)
+
+    Args:
+        plan (SchemaPlan): The plan to add operations to.
+        table_schema (dict): The schema for the parent table.
+
+    Returns:
+        bool: Whether or not the tables already exist or have been planned.
+    """
+    output: bool = True
+    if "descriptors" not in table_schema:
+        return True
+
+    # create one table for every descriptor type.
+    for descriptor_schema in table_schema["descriptors"]:
+        descriptor_table_name = plan.names.descriptor_table_name(
+            plan.names.normalize(table_schema["tableName"]), descriptor_schema["name"]
+        )
+        plan_table(plan, descriptor_table_name)
+
+        for column_schema in descriptor_schema["schema"]:
+            if not plan_column(plan, descriptor_table_name, column_schema):
+                output = False
+        plan_constraints(plan, descriptor_table_name, descriptor_schema["schema"])
+        plan_indexes(
+            plan,
+            descriptor_table_name,
+            config_index_specs(plan.names, descriptor_table_name, descriptor_schema),
+        )
+
+    return output
@@ -1,38 +1,222 @@
 import logging
-import psycopg
+from os import environ
+from typing import Literal
 from psycopg import sql
-from constants import CONN_CONFIG
-from config import CONFIG
-from utils import select_result_is_true, to_lower_snake_case
+from psycopg.connection import Connection
+from constants import CONN_CONFIG, FDW_OPTION_DEFAULTS
+from batch import BatchStatement, execute_batch
+from catalog import CatalogSnapshot, load_enums
+from connections import CONNECTIONS
+from planner import (
+    DDLOperation,
+    IndexSpec,
+    SchemaPlan,
+    apply_plan,
+    enum_changes,
+    plan_indexes,
+)
+from config import load_config
+from utils import to_lower_snake_case
 
 logger = logging.getLogger()
 
 
+# indexes for the sync workers, which look for entries that still need syncing and scan by database and time
+SYNC_STATUS_INDEXES = [
+    IndexSpec(
+        "sync_status_pending_idx",
+        "sync_status",
+        ("database_name", "status", "sync_timestamp"),
+        where="status IS DISTINCT FROM 'updated'",
+    ),
+    IndexSpec(
+        "sync_status_database_name_sync_timestamp_idx",
+        "sync_status",
+        ("database_name", "sync_timestamp"),
+    ),
+]
+
+
+SYNC_STATUS_ENUM = "sync_status_enum"
+# the statuses of info/sync_status, and those of the foreign tables in the data databases
+INFO_SYNC_STATUS_LABELS = ["modified", "updated", "failed", "anomalous"]
+DATA_SYNC_STATUS_LABELS = ["already exists", "added", "mismatch", "failed", "anomalous"]
+
+
+def _enum_statements(
+    conn: Connection, database_name: str, labels: list[str]
+) -> list[BatchStatement]:
+    """Creates sync_status_enum or adds its missing labels. Labels that are no longer wanted are only reported."""
+    changes = enum_changes(
+        SYNC_STATUS_ENUM, load_enums(conn).get(SYNC_STATUS_ENUM), labels
+    )
+    if len(changes.removed) > 0 or changes.reordered:
+        logger.warning(
+            f"{database_name}/{SYNC_STATUS_ENUM} has the labels {changes.labels} instead of {labels}. Fixing that requires rewriting the type and its column."
+        )
+    return [
+        BatchStatement(statement, f"{description} in {database_name}")
+        for statement, description in changes.statements
+    ]
+
+
+def _partitioning() -> Literal["none", "database"]:
+    """Reads the layout of info/sync_status from the SYNC_STATUS_PARTITIONING environment variable."""
+    partitioning = environ.get("SYNC_STATUS_PARTITIONING", "none").lower()
+    if partitioning not in ("none", "database"):
+        raise RuntimeError(
+            f'SYNC_STATUS_PARTITIONING must be "none" or "database", not "{partitioning}".'
+        )
+    return partitioning  # type: ignore
+
+
+def ensure_sync_status_layout(conn: Connection, partitioned: bool) -> None:
+    """Ensures that info/sync_status has its indexes and, if it is partitioned, one partition per data database plus a default partition.
+
+    Args:
+        conn (Connection): Connection to the info database.
+        partitioned (bool): Whether the table should be partitioned by database_name.
+    """
+    plan = SchemaPlan("info", CatalogSnapshot.load(conn))
+    is_partitioned = plan.catalog.tables["sync_status"].kind == "p"
+    if partitioned and not is_partitioned:
+        logger.warning(
+            "info/sync_status already exists without partitions. Recreate it (after moving its rows) to partition it by database."
+        )
+
+    if is_partitioned:
+        partitions: dict[str, sql.Composable] = {
+            "sync_status_default": sql.SQL("DEFAULT"),
+        }
+        for databaseInfo in load_config()["data"]:
+            database_name = to_lower_snake_case(databaseInfo["dbname"])
+            partitions[f"sync_status_{database_name}"] = sql.SQL(
+                "FOR VALUES IN ({})"
+            ).format(sql.Literal(database_name))
+        for partition_name, bounds in partitions.items():
+            if not plan.catalog.table_exists(partition_name):
+                plan.add(
+                    DDLOperation(
+                        "table",
+                        sql.SQL("CREATE TABLE {} PARTITION OF sync_status {};").format(
+                            sql.Identifier(partition_name), bounds
+                        ),
+                        "sync_status",
+                        f"create partition {partition_name}",
+                        creates=partition_name,
+                    )
+                )
+                plan.catalog.add_table(partition_name)
+
+    plan_indexes(plan, "sync_status", SYNC_STATUS_INDEXES)
+    apply_plan(conn, plan)
+
+
+# keep_connections can only be set on the server
+FDW_TABLE_OPTIONS = ("fetch_size", "batch_size", "use_remote_estimate", "async_capable")
+
+
+def fdw_options() -> tuple[dict[str, str], dict[str, str]]:
+    """Computes the desired options of sync_status_server and of the sync_status foreign table from the "syncStatus" section of the config, which has been validated beforehand (see validation.py).
+
+    Returns:
+        tuple[dict[str, str], dict[str, str]]: The server options and the foreign table options.
+    """
+    configured = {
+        **FDW_OPTION_DEFAULTS,
+        **(load_config().get("syncStatus") or {}),  # type: ignore
+    }
+    values = {
+        name: str(value).lower() if isinstance(value, bool) else str(value)
+        for name, value in configured.items()
+    }
+
+    server_options = {
+        "host": CONN_CONFIG["host"],
+        "dbname": "info",
+        "port": CONN_CONFIG["port"],
+        **values,
+    }
+    table_options = {
+        "table_name": "sync_status",
+        **{name: values[name] for name in FDW_TABLE_OPTIONS},
+    }
+    return server_options, table_options
+
+
+def _parse_options(options: list[str] | None) -> dict[str, str] | None:
+    if options is None:
+        return None
+    return dict(option.split("=", 1) for option in options)
+
+
+def _load_fdw_options(
+    conn: Connection,
+) -> tuple[dict[str, str] | None, dict[str, str] | None]:
+    """Loads the current options of sync_status_server and of the sync_status foreign table in one query.
+
+    Returns:
+        tuple[dict[str, str] | None, dict[str, str] | None]: The server options and the foreign table options. Either is None if the object does not exist.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT
+                (SELECT coalesce(srvoptions, '{}') FROM pg_foreign_server WHERE srvname = 'sync_status_server'),
+                (
+                    SELECT coalesce(ft.ftoptions, '{}')
+                    FROM pg_foreign_table ft
+                    JOIN pg_class c ON ft.ftrelid = c.oid
+                    WHERE c.relname = 'sync_status'
+                );
+            """)
+        row = cur.fetchone()
+        if row is None:
+            raise RuntimeError("None returned as a result.")
+        return _parse_options(row[0]), _parse_options(row[1])
+
+
+def _options_clause(options: dict[str, str]) -> sql.Composable:
+    """Renders e.g. `host 'localhost', port '5432'` for CREATE ... OPTIONS (...)."""
+    return sql.SQL(", ").join(
+        sql.SQL("{} {}").format(sql.Identifier(name), sql.Literal(value))
+        for name, value in options.items()
+    )
+
+
+def _option_changes(
+    current: dict[str, str], desired: dict[str, str]
+) -> sql.Composable | None:
+    """Renders the ADD/SET clauses for ALTER ... OPTIONS (...) that turn the current options into the desired ones. Options that are not managed here are left alone.
+
+    Returns:
+        sql.Composable | None: The clauses, or None if nothing needs to change.
+    """
+    changes = [
+        sql.SQL("{} {} {}").format(
+            sql.SQL("SET" if name in current else "ADD"),
+            sql.Identifier(name),
+            sql.Literal(value),
+        )
+        for name, value in desired.items()
+        if current.get(name) != value
+    ]
+    return sql.SQL(", ").join(changes) if len(changes) > 0 else None
+
+
 def main():
-    # create the info table
-    with psycopg.connect(**CONN_CONFIG, dbname="info") as conn:
-        with conn.cursor() as cur:
-            # ensure sync_status_enum exists
-            cur.execute("""
-                DO $$
-                BEGIN
-                    IF NOT EXISTS (
-                        SELECT 1 FROM pg_type WHERE typname = 'sync_status_enum'
-                    ) THEN
-                        CREATE TYPE sync_status_enum AS ENUM (
-                            'modified',
-                            'updated',
-                            'failed',
-                            'anomalous'
-                        );
-                    END IF;
-                END
-                $$;
-                """)
+    partitioned = _partitioning() == "database"
 
+    # create the info table
+    info_conn = CONNECTIONS.get("info")
+    execute_batch(
+        info_conn,
+        [
+            # ensure sync_status_enum exists and has every label
+            *_enum_statements(info_conn, "info", INFO_SYNC_STATUS_LABELS),
             # ensure info/sync_status exists
-            cur.execute("""CREATE TABLE IF NOT EXISTS sync_status (
-                    id SERIAL PRIMARY KEY,
+            BatchStatement(
+                sql.SQL("""CREATE TABLE IF NOT EXISTS sync_status (
+                    id SERIAL,
                     table_name TEXT NOT NULL,
                     parent_table_name TEXT NOT NULL,
                     table_type TEXT NOT NULL,
@@ -40,104 +224,129 @@ def main():
                     entry_id TEXT NOT NULL,
                     remote_id TEXT NULL,
                     sync_timestamp TIMESTAMPTZ NULL,
-                    status sync_status_enum NULL
-                )""")
-
+                    status sync_status_enum NULL,
+                    {primary_key}
+                ){partitioning}""").format(
+                    # the primary key of a partitioned table must contain the partition key
+                    primary_key=sql.SQL(
+                        "PRIMARY KEY (id, database_name)"
+                        if partitioned
+                        else "PRIMARY KEY (id)"
+                    ),
+                    partitioning=sql.SQL(
+                        " PARTITION BY LIST (database_name)" if partitioned else ""
+                    ),
+                ),
+                "create table info/sync_status",
+            ),
             # ensure that there is a UNIQUE constraint for the table_name and entry_id
             # @TODO reserved constraint name
-            cur.execute("""
+            BatchStatement(
+                """
                 DO $$
                 BEGIN
                     IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname='sync_status_entry_unique') THEN
                         ALTER TABLE sync_status ADD CONSTRAINT sync_status_entry_unique UNIQUE (table_name, database_name, entry_id);
                     END IF;
                 END $$
-                """)
-
-            logger.info("Table info/sync_status is ready.")
+                """,
+                "add constraint info/sync_status_entry_unique",
+            ),
+        ],
+    )
+    ensure_sync_status_layout(info_conn, partitioned)
+    logger.info("Table info/sync_status is ready.")
 
     # ensure there are foreign tables
     # @TODO reserve table name "sync_status" inside create_tables code
-    for databaseInfo in CONFIG["data"]:
+    server_options, table_options = fdw_options()
+    for databaseInfo in load_config()["data"]:
         database_name = to_lower_snake_case(databaseInfo["dbname"])
-        with psycopg.connect(**CONN_CONFIG, dbname=database_name) as data_conn:
-            with data_conn.cursor() as data_cur:
-                data_cur.execute("CREATE EXTENSION IF NOT EXISTS postgres_fdw;")
-
-                # foreign tables server
-                data_cur.execute(
-                    """SELECT EXISTS (
-                        SELECT 1
-                        FROM pg_foreign_server
-                        WHERE srvname = %s
-                    );""",
-                    ("sync_status_server",),
+        data_conn = CONNECTIONS.get(database_name)
+        current_server_options, current_table_options = _load_fdw_options(data_conn)
+
+        statements = [
+            BatchStatement(
+                "CREATE EXTENSION IF NOT EXISTS postgres_fdw;",
+                f"create extension {database_name}/postgres_fdw",
+            ),
+        ]
+
+        # foreign tables server
+        if current_server_options is None:
+            statements.append(
+                BatchStatement(
+                    sql.SQL(
+                        """CREATE SERVER IF NOT EXISTS sync_status_server
+                    FOREIGN DATA WRAPPER postgres_fdw
+                    OPTIONS ({options});"""
+                    ).format(options=_options_clause(server_options)),
+                    f"create server {database_name}/sync_status_server",
                 )
-                if not select_result_is_true(data_cur):
-                    data_cur.execute(
+            )
+        else:
+            changes = _option_changes(current_server_options, server_options)
+            if changes is not None:
+                statements.append(
+                    BatchStatement(
                         sql.SQL(
-                            """CREATE SERVER sync_status_server
-                        FOREIGN DATA WRAPPER postgres_fdw
-                        OPTIONS (host {host}, dbname {database_name}, port {port});"""
-                        ).format(
-                            host=sql.Literal(CONN_CONFIG["host"]),
-                            database_name=sql.Literal("info"),
-                            port=sql.Literal(CONN_CONFIG["port"]),
-                        )
+                            "ALTER SERVER sync_status_server OPTIONS ({});"
+                        ).format(changes),
+                        f"update the options of server {database_name}/sync_status_server",
                     )
+                )
+
+        statements += [
+            BatchStatement(
+                "DROP USER MAPPING IF EXISTS FOR PUBLIC SERVER sync_status_server;",
+                f"drop user mapping {database_name}/sync_status_server",
+            ),
+            BatchStatement(
+                sql.SQL(
+                    """CREATE USER MAPPING FOR PUBLIC
+                SERVER sync_status_server
+                OPTIONS (user {user}, password {password});"""
+                ).format(
+                    user=sql.Literal(CONN_CONFIG["user"]),
+                    password=sql.Literal(CONN_CONFIG["password"]),
+                ),
+                f"create user mapping {database_name}/sync_status_server",
+            ),
+            *_enum_statements(data_conn, database_name, DATA_SYNC_STATUS_LABELS),
+        ]
 
-                data_cur.execute(
+        if current_table_options is None:
+            statements.append(
+                BatchStatement(
                     sql.SQL(
-                        """DROP USER MAPPING IF EXISTS FOR PUBLIC SERVER sync_status_server;
-                    CREATE USER MAPPING FOR PUBLIC
+                        """CREATE FOREIGN TABLE IF NOT EXISTS sync_status (
+                        id INTEGER,
+                        table_name TEXT,
+                        parent_table_name TEXT,
+                        table_type TEXT,
+                        database_name TEXT,
+                        entry_id TEXT,
+                        remote_id TEXT,
+                        sync_timestamp TIMESTAMPTZ,
+                        status sync_status_enum
+                    )
                     SERVER sync_status_server
-                    OPTIONS (user {user}, password {password});"""
-                    ).format(
-                        user=sql.Literal(CONN_CONFIG["user"]),
-                        password=sql.Literal(CONN_CONFIG["password"]),
+                    OPTIONS ({options});"""
+                    ).format(options=_options_clause(table_options)),
+                    f"create foreign table {database_name}/sync_status",
+                )
+            )
+        else:
+            changes = _option_changes(current_table_options, table_options)
+            if changes is not None:
+                statements.append(
+                    BatchStatement(
+                        sql.SQL(
+                            "ALTER FOREIGN TABLE sync_status OPTIONS ({});"
+                        ).format(changes),
+                        f"update the options of foreign table {database_name}/sync_status",
                     )
                 )
 
-                data_cur.execute("""
-                    DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_type WHERE typname = 'sync_status_enum'
-                        ) THEN
-                            CREATE TYPE sync_status_enum AS ENUM (
-                                'already exists',
-                                'added',
-                                'mismatch',
-                                'failed',
-                                'anomalous'
-                            );
-                        END IF;
-                    END
-                    $$;
-                    """)
-
-                data_cur.execute("""DO $$
-                    BEGIN
-                        IF NOT EXISTS (
-                            SELECT 1 FROM pg_foreign_table ft
-                            JOIN pg_class c ON ft.ftrelid = c.oid
-                            WHERE c.relname = 'sync_status'
-                        ) THEN
-                            CREATE FOREIGN TABLE sync_status (
-                                id INTEGER,
-                                table_name TEXT,
-                                parent_table_name TEXT,
-                                table_type TEXT,
-                                database_name TEXT,
-                                entry_id TEXT,
-                                remote_id TEXT,
-                                sync_timestamp TIMESTAMPTZ,
-                                status sync_status_enum
-                            )
-                            SERVER sync_status_server
-                            OPTIONS (table_name 'sync_status');
-                        END IF;
-                    END
-                    $$;
-                    """)
-                logger.info(f"Table {database_name}/sync_status is ready.")
+        execute_batch(data_conn, statements)
+        logger.info(f"Table {database_name}/sync_status is ready.")
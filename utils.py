@@ -1,34 +1,5 @@
-from typing import List
-import re
 from psycopg.cursor import Cursor
-
-def to_snake_case(target: str) -> str:
-    """Attempts to convert from regular words/sentences to snake_case. This will not affect strings already in underscore notation. (Does not work with camelCase)
-    @param target
-    @return Returns underscore notation string. e.g. "hi I am Wywy" -> "hi_I_am_Wywy"
-    """
-    stringFrags: List[str] = re.split(r"[\.\ \-]", target)
-    
-    output: str = ""
-    
-    for i in stringFrags:
-        output += i + "_"
-    
-    return output[:-1] # remove trailing underscore with "[:-1]"
-
-def to_lower_snake_case(target: str) -> str:
-    """Attempts to convert from regular words/sentences to lower_snake_case. This will not affect strings already in underscore notation. (Does not work with camelCase)
-    @param target
-    @return Returns lower_snake_case string. e.g. "hi I am Wywy" -> "hi_i_am_wywy"
-    """
-    stringFrags: List[str] = re.split(r"[\.\ \-]", target)
-    
-    output: str = ""
-    
-    for i in stringFrags:
-        output += i.lower() + "_"
-    
-    return output[:-1] # remove trailing underscore with "[:-1]"
+from names import to_snake_case, to_lower_snake_case  # re-exported
 
 def select_result_is_true(cur: Cursor, is_none_safe: bool = False) -> bool:
     """Checks if the result of the SELECT query is true.
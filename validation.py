@@ -0,0 +1,404 @@
+"""Config validation.
+
+The whole config is walked once, before any connection is opened, so that an invalid config never costs a database round trip. Every violation is reported with its YAML path, e.g. data[0].tables[2].schema[1].name. Names that collide once normalized (including the tables, types, columns, constraints and indexes generated from them) are found through each database's NameTable.
+"""
+
+import logging
+from dataclasses import dataclass
+from datetime import date, time
+from typing import Any, Iterable, List
+from constants import (
+    AUTH_OPTION_DEFAULTS,
+    FDW_OPTION_DEFAULTS,
+    PSQLDATATYPES,
+    SPATIAL_INDEX_METHODS,
+    RESERVED_COLUMN_NAMES,
+    RESERVED_COLUMN_SUFFIXES,
+    RESERVED_DATABASE_NAMES,
+    RESERVED_TABLE_NAMES,
+    RESERVED_TABLE_SUFFIXES,
+)
+from names import (
+    MAX_IDENTIFIER_LENGTH,
+    NameTable,
+    generated_columns,
+    to_lower_snake_case,
+)
+from planner import INDEX_METHODS
+
+logger = logging.getLogger()
+
+DATATYPES = frozenset(PSQLDATATYPES) | {"pointer", "polymorphic pointer", "polypointer"}
+# datatypes whose columns cannot have a default
+NO_DEFAULT_DATATYPES = frozenset(
+    {"pointer", "polymorphic pointer", "polypointer", "geodetic point"}
+)
+# what YAML scalars parse to (datetime is a subclass of date)
+DEFAULT_TYPES = (str, int, float, bool, date, time)
+
+
+@dataclass
+class Violation:
+    path: str
+    message: str
+
+    def __str__(self) -> str:
+        return f"{self.path}: {self.message}"
+
+
+class NameRules:
+    """Reserved names and suffixes, stored as sets so that every lookup is O(1) (or O(length of the name) for suffixes)."""
+
+    def __init__(self, names: Iterable[str], suffixes: Iterable[str] = ()) -> None:
+        self.names = frozenset(names)
+        self.suffixes = frozenset(suffixes)
+
+    def reserved_name(self, name: str) -> bool:
+        return name in self.names
+
+    def reserved_suffix(self, name: str) -> str | None:
+        """Returns the reserved suffix the name ends with (after an underscore), if any."""
+        # only the parts after an underscore can be suffixes, so check each of them against the set
+        position = name.find("_")
+        while position != -1:
+            if name[position + 1 :] in self.suffixes:
+                return name[position + 1 :]
+            position = name.find("_", position + 1)
+        return None
+
+
+DATABASE_RULES = NameRules(RESERVED_DATABASE_NAMES)
+TABLE_RULES = NameRules(RESERVED_TABLE_NAMES, RESERVED_TABLE_SUFFIXES)
+COLUMN_RULES = NameRules(RESERVED_COLUMN_NAMES, RESERVED_COLUMN_SUFFIXES)
+
+
+# the violation of an option that does not have the type of its default
+_TYPE_NAMES = {
+    str: "Must be a string.",
+    int: "Must be a number.",
+    bool: "Must be true or false.",
+}
+
+
+def _is_name(value: Any) -> bool:
+    return isinstance(value, str) and len(value) > 0
+
+
+class ConfigValidator:
+    """Collects the violations of a config."""
+
+    def __init__(self) -> None:
+        self.violations: List[Violation] = []
+
+    def violation(self, path: str, message: str) -> None:
+        self.violations.append(Violation(path, message))
+
+    def validate(self, config: Any) -> List[Violation]:
+        if not isinstance(config, dict):
+            self.violation("(root)", "The config must be a mapping.")
+            return self.violations
+        databases = config.get("data")
+        if not isinstance(databases, list):
+            self.violation(
+                "data", 'The config must list its databases under the key "data".'
+            )
+            return self.violations
+
+        seen: dict[str, str] = {}
+        for i, database in enumerate(databases):
+            self.validate_database(f"data[{i}]", database, seen)
+        self.validate_auth(config.get("auth"))
+        self.validate_sync_status(config.get("syncStatus"))
+        return self.violations
+
+    def validate_options(
+        self, path: str, options: Any, defaults: dict[str, Any]
+    ) -> dict[str, Any]:
+        """Checks that an optional section is a mapping of known options and that every option has the type of its default.
+
+        Returns:
+            dict[str, Any]: The well-typed options of the section, for further checks.
+        """
+        if options is None:
+            return {}
+        if not isinstance(options, dict):
+            self.violation(path, "Must be a mapping.")
+            return {}
+        valid: dict[str, Any] = {}
+        for name, value in options.items():
+            if name not in defaults:
+                self.violation(
+                    f"{path}.{name}",
+                    f"Unknown {path} option. Expected one of {list(defaults)}.",
+                )
+            # bool is a subclass of int, so compare the types exactly, except that a float may replace an int
+            elif type(value) is type(defaults[name]) or (
+                type(defaults[name]) is int and type(value) is float
+            ):
+                valid[name] = value
+            else:
+                self.violation(f"{path}.{name}", _TYPE_NAMES[type(defaults[name])])
+        return valid
+
+    def validate_auth(self, auth: Any) -> None:
+        options = self.validate_options("auth", auth, AUTH_OPTION_DEFAULTS)
+        if len(options.get("session_retention", "-")) == 0:
+            self.violation("auth.session_retention", "Must be a PostgreSQL interval.")
+        batch_size = options.get("session_purge_batch_size", 1)
+        if not isinstance(batch_size, int) or batch_size <= 0:
+            self.violation(
+                "auth.session_purge_batch_size", "Must be a positive integer."
+            )
+        if options.get("token_capacity", 1) <= 0:
+            self.violation("auth.token_capacity", "Must be positive.")
+        if options.get("token_refill_rate", 0) < 0:
+            self.violation("auth.token_refill_rate", "Must not be negative.")
+
+    def validate_sync_status(self, sync_status: Any) -> None:
+        options = self.validate_options("syncStatus", sync_status, FDW_OPTION_DEFAULTS)
+        for name in ("fetch_size", "batch_size"):
+            if name in options and (
+                not isinstance(options[name], int) or options[name] <= 0
+            ):
+                self.violation(f"syncStatus.{name}", "Must be a positive integer.")
+
+    def validate_database(self, path: str, database: Any, seen: dict[str, str]) -> None:
+        if not isinstance(database, dict):
+            self.violation(path, "A database must be a mapping.")
+            return
+        if not _is_name(database.get("dbname")):
+            self.violation(
+                f"{path}.dbname",
+                'Databases must have a non-empty name under the key "dbname".',
+            )
+            return
+
+        db_name = to_lower_snake_case(database["dbname"])
+        if DATABASE_RULES.reserved_name(db_name):
+            self.violation(f"{path}.dbname", f"{db_name} is a reserved database name.")
+        if db_name in seen:
+            self.violation(
+                f"{path}.dbname", f"{db_name} is already the name of {seen[db_name]}."
+            )
+        seen[db_name] = path
+
+        tables = database.get("tables", [])
+        if not isinstance(tables, list):
+            self.violation(f"{path}.tables", "The tables must be a list.")
+            return
+        violation_count = len(self.violations)
+        for i, table in enumerate(tables):
+            self.validate_table(f"{path}.tables[{i}]", table)
+
+        # the name table assumes a well-formed entry
+        if len(self.violations) == violation_count:
+            names = NameTable.build(database, path)
+            for collision in names.collisions:
+                self.violation(collision.second, str(collision))
+            self.validate_references(path, database, names)
+
+    def validate_references(self, path: str, database: dict, names: NameTable) -> None:
+        """Checks that every pointer of the database references one of its tables."""
+        for i, table in enumerate(database.get("tables", [])):
+            schemas = [(f"{path}.tables[{i}]", table.get("schema", []))] + [
+                (f"{path}.tables[{i}].descriptors[{j}]", descriptor.get("schema", []))
+                for j, descriptor in enumerate(table.get("descriptors", []))
+            ]
+            for schema_path, schema in schemas:
+                for k, column in enumerate(schema):
+                    if column["datatype"] != "pointer":
+                        continue
+                    if names.table(column["references"]) is None:
+                        self.violation(
+                            f"{schema_path}.schema[{k}].references",
+                            f'No table named "{column["references"]}" in {database["dbname"]}.',
+                        )
+
+    def validate_table(self, path: str, table: Any) -> None:
+        if not isinstance(table, dict):
+            self.violation(path, "A table must be a mapping.")
+            return
+        if not _is_name(table.get("tableName")):
+            self.violation(
+                f"{path}.tableName",
+                'Tables must have a non-empty name under the key "tableName".',
+            )
+            return
+
+        table_name = to_lower_snake_case(table["tableName"])
+        if TABLE_RULES.reserved_name(table_name):
+            self.violation(
+                f"{path}.tableName", f'"{table["tableName"]}" is a reserved table name.'
+            )
+        suffix = TABLE_RULES.reserved_suffix(table_name)
+        if suffix is not None:
+            self.violation(
+                f"{path}.tableName",
+                f'"{table["tableName"]}" ends with the reserved table suffix "_{suffix}".',
+            )
+        self.validate_columns(path, table)
+
+        if not isinstance(table.get("tagging", False), bool):
+            self.violation(f"{path}.tagging", '"tagging" must be true or false.')
+
+        if "descriptors" in table:
+            descriptors = table["descriptors"]
+            if not isinstance(descriptors, list) or len(descriptors) < 1:
+                self.violation(
+                    f"{path}.descriptors",
+                    f"Table {table['tableName']} must have at least 1 descriptor if descriptors are enabled.",
+                )
+                return
+            for i, descriptor in enumerate(descriptors):
+                self.validate_descriptor(f"{path}.descriptors[{i}]", descriptor)
+
+    def validate_descriptor(self, path: str, descriptor: Any) -> None:
+        if not isinstance(descriptor, dict) or not _is_name(descriptor.get("name")):
+            self.violation(f"{path}.name", "Descriptors must have a non-empty name.")
+            return
+        # descriptor names are subject to the same rules as column names
+        name = to_lower_snake_case(descriptor["name"])
+        self.validate_column_name(f"{path}.name", descriptor["name"], name)
+        self.validate_columns(path, descriptor)
+
+    def validate_columns(self, path: str, schema: dict) -> None:
+        """Validates the "schema" (a non-empty list of columns) and "indexes" keys of a table or descriptor."""
+        columns = schema.get("schema")
+        if not isinstance(columns, list) or len(columns) < 1:
+            self.violation(
+                f"{path}.schema", "There must be at least 1 column of data to store."
+            )
+            return
+
+        # the columns indexes can cover: the config columns, the ones generated for them, and the reserved ones
+        available = {"id"}
+        if schema.get("tagging", False) is True:
+            available.add("primary_tag")
+        for i, column in enumerate(columns):
+            self.validate_column(f"{path}.schema[{i}]", column)
+            if isinstance(column, dict) and _is_name(column.get("name")):
+                name = to_lower_snake_case(column["name"])
+                available.add(name)
+                available.update(generated_columns(name, column))
+
+        indexes = schema.get("indexes", [])
+        if not isinstance(indexes, list):
+            self.violation(f"{path}.indexes", "The indexes must be a list.")
+            return
+        for i, index in enumerate(indexes):
+            self.validate_index(f"{path}.indexes[{i}]", index, available)
+
+    def validate_index(self, path: str, index: Any, available: set[str]) -> None:
+        if not isinstance(index, dict):
+            self.violation(path, "An index must be a mapping.")
+            return
+        columns = index.get("columns")
+        if not isinstance(columns, list) or len(columns) == 0:
+            self.violation(f"{path}.columns", "Indexes must list at least 1 column.")
+        else:
+            for j, column in enumerate(columns):
+                if not _is_name(column):
+                    self.violation(
+                        f"{path}.columns[{j}]", "Index columns must be column names."
+                    )
+                elif to_lower_snake_case(column) not in available:
+                    self.violation(
+                        f"{path}.columns[{j}]", f"The table has no column {column}."
+                    )
+
+        method = index.get("method", "btree")
+        if not isinstance(method, str) or method.lower() not in INDEX_METHODS:
+            self.violation(f"{path}.method", f"{method} is not one of {INDEX_METHODS}.")
+        if "name" in index and (
+            not _is_name(index["name"])
+            or len(index["name"].encode()) > MAX_IDENTIFIER_LENGTH
+        ):
+            self.violation(
+                f"{path}.name",
+                f"Index names must be non-empty and at most {MAX_IDENTIFIER_LENGTH} bytes long.",
+            )
+        if not isinstance(index.get("unique", False), bool):
+            self.violation(f"{path}.unique", '"unique" must be true or false.')
+        if "where" in index and not _is_name(index["where"]):
+            self.violation(f"{path}.where", '"where" must be an SQL predicate.')
+
+    def validate_column_name(self, path: str, raw_name: str, name: str) -> None:
+        if COLUMN_RULES.reserved_name(name):
+            self.violation(path, f'"{raw_name}" is a reserved column name.')
+        suffix = COLUMN_RULES.reserved_suffix(name)
+        if suffix is not None:
+            self.violation(
+                path, f'"{raw_name}" ends with the reserved column suffix "_{suffix}".'
+            )
+
+    def validate_column(self, path: str, column: Any) -> None:
+        if not isinstance(column, dict) or not _is_name(column.get("name")):
+            self.violation(f"{path}.name", "Columns must have a non-empty name.")
+            return
+        name = to_lower_snake_case(column["name"])
+        self.validate_column_name(f"{path}.name", column["name"], name)
+
+        datatype = column.get("datatype")
+        if datatype not in DATATYPES:
+            self.violation(
+                f"{path}.datatype", f"{datatype} is not one of {sorted(DATATYPES)}."
+            )
+        elif datatype == "enum":
+            values = column.get("values")
+            if not isinstance(values, list) or len(values) == 0:
+                self.violation(f"{path}.values", "Enums must list at least 1 value.")
+        elif datatype == "pointer" and not _is_name(column.get("references")):
+            self.violation(
+                f"{path}.references", "Pointers must name the table they reference."
+            )
+        elif datatype == "geodetic point":
+            method = column.get("spatialIndex", "gist")
+            if method is not False and str(method).lower() not in SPATIAL_INDEX_METHODS:
+                self.violation(
+                    f"{path}.spatialIndex",
+                    f"{method} is not one of {SPATIAL_INDEX_METHODS} or false.",
+                )
+            if not isinstance(column.get("geometry", False), bool):
+                self.violation(f"{path}.geometry", "geometry must be true or false.")
+
+        default = column.get("default")
+        if default is None:
+            return
+        if datatype in NO_DEFAULT_DATATYPES:
+            self.violation(f"{path}.default", f"{datatype} columns cannot have a default.")
+        elif not isinstance(default, DEFAULT_TYPES):
+            self.violation(f"{path}.default", "Defaults must be a single value.")
+        elif (
+            datatype == "enum"
+            and isinstance(column.get("values"), list)
+            and default not in column["values"]
+        ):
+            self.violation(
+                f"{path}.default", f"{default} is not one of the enum's values."
+            )
+
+
+def validate_config(config: Any) -> List[Violation]:
+    """Validates the whole config.
+
+    Args:
+        config (Any): The parsed config.
+
+    Returns:
+        List[Violation]: Every violation, in config order. The config is valid if the list is empty.
+    """
+    return ConfigValidator().validate(config)
+
+
+def validate_auth_config(config: Any) -> List[Violation]:
+    """Validates only the "auth" section of the config, which is all that purging sessions reads.
+
+    Args:
+        config (Any): The parsed config.
+
+    Returns:
+        List[Violation]: Every violation of the "auth" section.
+    """
+    validator = ConfigValidator()
+    validator.validate_auth(config.get("auth") if isinstance(config, dict) else None)
+    return validator.violations